@@ -0,0 +1,3 @@
+-- Extension behind /v2/students/search. Its indexes are built without
+-- blocking the table by DB/Schemas/online/V1__student_search_indexes.sql.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
@@ -0,0 +1,18 @@
+-- Row versioning for optimistic concurrency (If-Match on updates).
+-- Both defaults are constant for existing rows, so no table rewrite.
+ALTER TABLE students
+    ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION students_bump_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS students_bump_version ON students;
+CREATE TRIGGER students_bump_version
+    BEFORE UPDATE ON students
+    FOR EACH ROW EXECUTE FUNCTION students_bump_version();
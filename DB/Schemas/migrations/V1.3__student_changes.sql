@@ -0,0 +1,46 @@
+-- Change log behind /v2/students/changes. Every insert, update and delete
+-- of a student appends one row.
+CREATE TABLE IF NOT EXISTS student_changes (
+    seq BIGSERIAL PRIMARY KEY,
+    student_id INTEGER NOT NULL,
+    op CHAR(1) NOT NULL CHECK (op IN ('I', 'U', 'D')),
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    -- Writing transaction. seq values are handed out before commit, so
+    -- they can become visible out of order; readers page by (txid, seq)
+    -- over transactions older than every one still running, a set that
+    -- can no longer change.
+    txid XID8 NOT NULL DEFAULT pg_current_xact_id()
+);
+
+CREATE INDEX IF NOT EXISTS student_changes_txid_seq_idx
+    ON student_changes (txid, seq);
+
+CREATE OR REPLACE FUNCTION students_log_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO student_changes (student_id, op) VALUES (OLD.id, 'D');
+    ELSE
+        INSERT INTO student_changes (student_id, op)
+        VALUES (NEW.id, left(TG_OP, 1));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- One notification per statement wakes long-poll and SSE readers
+CREATE OR REPLACE FUNCTION students_notify_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('student_changes', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS students_log_change ON students;
+CREATE TRIGGER students_log_change
+    AFTER INSERT OR UPDATE OR DELETE ON students
+    FOR EACH ROW EXECUTE FUNCTION students_log_change();
+
+DROP TRIGGER IF EXISTS students_notify_change ON students;
+CREATE TRIGGER students_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON students
+    FOR EACH STATEMENT EXECUTE FUNCTION students_notify_change();
@@ -0,0 +1,11 @@
+-- Stamp updated_at with the time of the UPDATE rather than the start of
+-- its transaction. A writer that waited on the row lock would otherwise
+-- record a time earlier than the version it replaced, and clients using
+-- If-Modified-Since would never see its change.
+CREATE OR REPLACE FUNCTION students_bump_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,10 @@
+-- Oldest cursor the change feed can resume from. Pruning student_changes
+-- moves it past the rows it deletes; a reader behind it has missed
+-- changes and is told to resync instead of silently skipping them.
+CREATE TABLE IF NOT EXISTS student_changes_horizon (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    txid XID8 NOT NULL DEFAULT '0',
+    seq BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO student_changes_horizon DEFAULT VALUES ON CONFLICT DO NOTHING;
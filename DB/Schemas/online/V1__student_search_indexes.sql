@@ -0,0 +1,32 @@
+-- Indexes behind /v2/students/search, built without blocking writes.
+-- Emails are unique regardless of case. Existing duplicates would fail
+-- the unique index build, so they are reported first: list them with
+-- SELECT lower(email), array_agg(id) FROM students GROUP BY 1
+-- HAVING count(*) > 1;
+-- resolve them, and run the migration again.
+
+-- step: transaction
+DO $$
+DECLARE
+    duplicates BIGINT;
+BEGIN
+    SELECT count(*) INTO duplicates FROM (
+        SELECT 1 FROM students GROUP BY lower(email) HAVING count(*) > 1
+    ) AS d;
+    IF duplicates > 0 THEN
+        RAISE EXCEPTION 'duplicate emails (ignoring case): %', duplicates
+            USING HINT = 'Resolve them before the unique index is built.';
+    END IF;
+END
+$$;
+
+-- step: concurrently
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS students_email_key
+    ON students (lower(email));
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS students_phone_idx
+    ON students (phone);
+
+-- Serves both prefix (LIKE 'abc%') and fuzzy (%) name matches
+CREATE INDEX CONCURRENTLY IF NOT EXISTS students_name_trgm_idx
+    ON students USING gin (lower(name) gin_trgm_ops);
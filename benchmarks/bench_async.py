@@ -0,0 +1,97 @@
+"""
+Blocking vs. awaitable data layer under concurrency.
+
+Drives `get_student_by_Id` from many concurrent coroutines on one event
+loop, once calling db_students directly (the old handler path) and once
+through db_async, and reports p50/p99 latency for the lookups plus for a
+trivial probe coroutine standing in for /metrics or /HealthCheck.
+
+Needs the POSTGRES_* variables of a migrated database, e.g.
+
+    python benchmarks/bench_async.py --concurrency 100 --requests 20
+"""
+
+import argparse
+import asyncio
+import time
+
+import common
+
+import db_async
+import db_students
+from pydantic import BaseModel
+
+
+class _Row(BaseModel):
+    name: str
+    email: str
+    age: int
+    phone: str
+
+
+async def _blocking_lookup(student_id):
+    return db_students.get_student_by_Id(student_id)
+
+
+async def _async_lookup(student_id):
+    return await db_async.get_student_by_Id(student_id)
+
+
+async def _run_case(lookup, student_id, concurrency, requests):
+    latencies = []
+    probe_latencies = []
+    done = asyncio.Event()
+
+    async def client():
+        for _ in range(requests):
+            start = time.perf_counter()
+            # Yield once like a real request does while its body is read,
+            # so queued clients start their clocks as they would on a server.
+            await asyncio.sleep(0)
+            await lookup(student_id)
+            latencies.append(time.perf_counter() - start)
+
+    async def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0)
+            probe_latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.001)
+
+    probe_task = asyncio.create_task(probe())
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await probe_task
+    return (common.summarize(latencies, elapsed),
+            common.summarize(probe_latencies, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=20,
+                        help='lookups per concurrent client')
+    args = parser.parse_args()
+
+    seeded = db_students.insertstudent(
+        _Row(name='Bench', email='bench@example.com', age=30,
+             phone='1234567890'))
+    student_id = seeded['student_id']['id']
+    try:
+        rows = {}
+        for name, lookup in (('blocking', _blocking_lookup),
+                             ('async', _async_lookup)):
+            lookups, probe = asyncio.run(_run_case(
+                lookup, student_id, args.concurrency, args.requests))
+            rows[f'{name} lookup'] = lookups
+            rows[f'{name} loop probe'] = probe
+        common.print_table(
+            f'get_student_by_Id, concurrency={args.concurrency}', rows)
+    finally:
+        db_students.delete_student(student_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Bulk ingest throughput.
+
+Generates an NDJSON (or CSV) upload of N students and feeds it through
+the same ingest path as /v2/students/bulk, reporting rows per second
+for chunked multi-row INSERTs against one INSERT + commit per row.
+Inserted rows are deleted afterwards.
+
+    python benchmarks/bench_bulk.py --rows 100000 --chunk-size 1000
+"""
+
+import argparse
+import io
+import json
+import time
+
+import common  # noqa: F401  (puts code/ on the import path)
+
+import db_students
+from bulk_ingest import ingest_students
+from pydantic import BaseModel, EmailStr
+
+
+class _Student(BaseModel):
+    name: str
+    email: EmailStr
+    age: int
+    phone: str
+
+
+def _upload(rows, fmt):
+    if fmt == 'csv':
+        lines = ['name,email,age,phone'] + [
+            f'Student {i},student{i}@example.com,{18 + i % 10},'
+            f'{9000000000 + i}' for i in range(rows)]
+    else:
+        lines = [json.dumps({'name': f'Student {i}',
+                             'email': f'student{i}@example.com',
+                             'age': 18 + i % 10,
+                             'phone': str(9000000000 + i)})
+                 for i in range(rows)]
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def _cleanup(student_ids):
+    with db_students.get_cursor() as (conn, cur):
+        cur.execute('DELETE FROM students WHERE ID = ANY(%s);',
+                    ([i for i in student_ids if i is not None],))
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--format', choices=('ndjson', 'csv'),
+                        default='ndjson')
+    parser.add_argument('--single-rows', type=int, default=2000,
+                        help='rows for the one-INSERT-per-row baseline')
+    args = parser.parse_args()
+
+    body = _upload(args.rows, args.format)
+    start = time.perf_counter()
+    res = ingest_students(io.BytesIO(body), args.format, _Student,
+                          args.chunk_size)
+    elapsed = time.perf_counter() - start
+    _cleanup(res['student_ids'])
+    print(f"bulk ingest: {res['inserted']} rows in {elapsed:.2f}s "
+          f"({res['inserted'] / elapsed:,.0f} rows/s), "
+          f"{res['failed']} rejected")
+
+    students = [_Student(name=f'Student {i}',
+                         email=f'student{i}@example.com', age=20,
+                         phone=str(9000000000 + i))
+                for i in range(args.single_rows)]
+    start = time.perf_counter()
+    ids = [db_students.insertstudent(s)['student_id']['id']
+           for s in students]
+    elapsed = time.perf_counter() - start
+    _cleanup(ids)
+    print(f"insertstudent: {len(ids)} rows in {elapsed:.2f}s "
+          f"({len(ids) / elapsed:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Cost of a handler log call on the calling thread.
+
+Emits N handler-style event logs through each sink configuration and
+reports the mean time the caller spends per call: the synchronous JSON
+sink, the batching sink, and the batching sink with *_success events
+sampled at 10%. Output goes to a slow stream (a short sleep per write
+standing in for container stderr backpressure). No database is needed.
+
+    python benchmarks/bench_logging.py --records 20000
+"""
+
+import argparse
+import io
+import time
+
+import common  # noqa: F401  (puts code/ on the import path)
+
+from loguru import logger
+
+from log_config import BatchingSink, EventSampler, StderrSink
+
+
+class _SlowStream(io.StringIO):
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return super().write(text)
+
+
+def _time(sink, records, log_filter=None):
+    logger.remove()
+    handler = logger.add(sink, format="{message}", filter=log_filter)
+    start = time.perf_counter()
+    for i in range(records):
+        logger.info({"event": "get_student_success",
+                     "endpoint": "/GetStudent", "method": "GET", "id": i})
+    elapsed = time.perf_counter() - start
+    logger.remove(handler)
+    return elapsed / records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--write-delay-us', type=float, default=20)
+    args = parser.parse_args()
+
+    delay = args.write_delay_us / 1e6
+    cases = {
+        'sync': lambda: (StderrSink(_SlowStream(delay)), None),
+        'async': lambda: (BatchingSink(_SlowStream(delay),
+                                       maxsize=args.records), None),
+        'async + INFO=0.1': lambda: (
+            BatchingSink(_SlowStream(delay), maxsize=args.records),
+            EventSampler({"INFO": 0.1})),
+    }
+    print(f'{args.records} records, {args.write_delay_us:g} us per write')
+    baseline = None
+    for name, build in cases.items():
+        sink, log_filter = build()
+        seconds = _time(sink, args.records, log_filter)
+        baseline = baseline or seconds
+        print(f'{name:<20}{seconds * 1e6:>10.1f} us/call'
+              f'{baseline / seconds:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
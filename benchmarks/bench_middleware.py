@@ -0,0 +1,137 @@
+"""
+Per-request middleware overhead.
+
+Calls a minimal FastAPI app directly over ASGI (no sockets, no database)
+with three middleware stacks: none, the previous pair of
+@app.middleware("http") functions that parsed every JSON body, and the
+current pure ASGI PrometheusMiddleware. Reports the mean cost per
+request and the overhead over the bare app.
+
+    python benchmarks/bench_middleware.py --requests 20000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import common  # noqa: F401  (puts code/ on the import path)
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from metrics import REQUEST_COUNT, REQUEST_LATENCY, ERROR_COUNT
+from middleware import PrometheusMiddleware
+
+BODY = json.dumps({"name": "Foo", "email": "foo@example.com",
+                   "age": 20, "phone": "1234567890"}).encode()
+
+
+class _Student(BaseModel):
+    name: str
+    email: str
+    age: int
+    phone: str
+
+
+def _base_app():
+    app = FastAPI()
+
+    @app.post("/AddStudent")
+    async def create_student(student: _Student) -> dict:
+        return JSONResponse(content={"message": "Student data added"})
+
+    return app
+
+
+def _legacy_app():
+    app = _base_app()
+
+    @app.middleware("http")
+    async def prometheus_metrics(request: Request, call_next):
+        endpoint = request.url.path
+        method = request.method
+        start_time = time.time()
+        response = await call_next(request)
+        status_code = response.status_code
+        REQUEST_COUNT.labels(endpoint=endpoint, method=method,
+                             status_code=status_code).inc()
+        REQUEST_LATENCY.labels(endpoint=endpoint, method=method,
+                               status_code=status_code
+                               ).observe(time.time() - start_time)
+        if status_code >= 400:
+            ERROR_COUNT.labels(endpoint=endpoint, method=method,
+                               status_code=status_code).inc()
+        return response
+
+    @app.middleware("http")
+    async def handle_malformed_json(request: Request, call_next):
+        if request.headers.get("content-type") == "application/json":
+            try:
+                await request.json()
+            except json.JSONDecodeError as e:
+                return JSONResponse(status_code=400,
+                                    content={"details": str(e)})
+        return await call_next(request)
+
+    return app
+
+
+def _asgi_app():
+    app = _base_app()
+    app.add_middleware(PrometheusMiddleware)
+    return app
+
+
+async def _call(app):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/AddStudent",
+        "raw_path": b"/AddStudent", "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(BODY)).encode())],
+        "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 8000),
+    }
+    messages = [{"type": "http.request", "body": BODY, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def _measure(app, requests):
+    for _ in range(200):
+        await _call(app)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await _call(app)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    results = {}
+    for name, factory in (('no middleware', _base_app),
+                          ('BaseHTTPMiddleware x2', _legacy_app),
+                          ('PrometheusMiddleware', _asgi_app)):
+        results[name] = asyncio.run(_measure(factory(), args.requests))
+
+    bare = results['no middleware']
+    print(f"{'stack':<26}{'us/request':>12}{'overhead us':>14}")
+    for name, per_request in results.items():
+        print(f"{name:<26}{per_request * 1e6:>12.1f}"
+              f"{(per_request - bare) * 1e6:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
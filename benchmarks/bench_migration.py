@@ -0,0 +1,219 @@
+"""
+API latency while the students table is migrated.
+
+Seeds the table up to --rows students, then for each mode drives
+GetStudent and UpdateStudent against a running API for --baseline
+seconds, applies the sample migration in benchmarks/migrations (a new
+column, a backfill of every row and an index on it) and keeps driving
+until the migration is done:
+
+    blocking   the same change the pyway way: ALTER TABLE, one UPDATE
+               of every row and CREATE INDEX, in a single transaction
+    online     code/online_migrate.py: DDL under lock_timeout, a
+               batched, throttled backfill and CREATE INDEX CONCURRENTLY
+
+Latency percentiles, the slowest request and the failed requests are
+reported before and during each migration. The column is dropped after
+each run. Both migrations fire the table's triggers, bumping every
+student's version and adding a change-feed row for each, so run this
+against a disposable database such as the compose DB service. Exits
+1 if the online migration failed requests or its p99 exceeded
+--max-p99-ms.
+
+    python benchmarks/bench_migration.py --rows 2000000 --output migration.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import Counter
+
+import psycopg2
+
+from common import print_table, summarize
+import loadtest
+from online_migrate import OnlineMigrator, load_migration
+
+MIGRATION = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "migrations", "V900__student_email_domain.sql")
+
+BLOCKING = """
+    ALTER TABLE students ADD COLUMN IF NOT EXISTS email_domain TEXT;
+    UPDATE students SET email_domain = lower(split_part(email, '@', 2));
+    CREATE INDEX IF NOT EXISTS students_email_domain_idx
+        ON students (email_domain);
+    """
+
+
+def _count_seeded():
+    import db_students
+    with db_students.get_cursor() as (conn, cur):
+        cur.execute("SELECT count(*) AS n FROM students WHERE email LIKE %s;",
+                    (f"%@{loadtest.SEED_DOMAIN}",))
+        return cur.fetchone()["n"]
+
+
+def _execute(query, params=None):
+    import db_students
+    conn = db_students.connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            result = cur.fetchone() if cur.description else None
+        conn.commit()
+        return result
+    finally:
+        conn.close()
+
+
+def _blocking():
+    _execute(BLOCKING)
+
+
+def _online(args):
+    import db_students
+    OnlineMigrator(db_students.connect, lock_timeout=args.lock_timeout,
+                   batch_seconds=args.batch_seconds,
+                   max_active=args.max_active).migrate(
+        [load_migration(MIGRATION)])
+
+
+def _revert():
+    # The DROP needs the table's exclusive lock too; keep its wait short
+    while True:
+        try:
+            _execute("SET lock_timeout = '1s'; ALTER TABLE students "
+                     "DROP COLUMN IF EXISTS email_domain;")
+            break
+        except psycopg2.errors.LockNotAvailable:
+            time.sleep(0.5)
+    _execute("DELETE FROM online_migrations WHERE version = '900';")
+
+
+async def _drive(client, ids, write_ratio, stop, samples):
+    while not stop.is_set():
+        if random.random() < write_ratio:
+            method, path, params, body = (
+                "PATCH", "/v2/UpdateStudent", {"id": random.choice(ids)},
+                {"age": random.randint(18, 60)})
+        else:
+            method, path, params, body = (
+                "GET", "/GetStudent", {"id": random.choice(ids)}, None)
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, params=params,
+                                            json=body)
+            status = response.status_code
+        except Exception as e:
+            status = type(e).__name__
+        samples.append((start, time.perf_counter() - start, status))
+
+
+def _summary(samples, start, end):
+    window = [(latency, status) for begun, latency, status in samples
+              if start <= begun < end]
+    latencies = [latency for latency, _ in window]
+    failed = Counter(str(status) for _, status in window
+                     if not isinstance(status, int) or status >= 400)
+    result = summarize(latencies, end - start)
+    result["max_ms"] = round(max(latencies, default=0) * 1000, 3)
+    result["errors"] = sum(failed.values())
+    result["failed"] = dict(failed)
+    return result
+
+
+async def _run(args, mode, ids):
+    import httpx
+    samples, stop = [], asyncio.Event()
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits,
+                                 timeout=args.timeout) as client:
+        workers = [asyncio.create_task(
+            _drive(client, ids, args.write_ratio, stop, samples))
+            for _ in range(args.concurrency)]
+        begun = time.perf_counter()
+        await asyncio.sleep(args.baseline)
+        migration_start = time.perf_counter()
+        if mode == "blocking":
+            await asyncio.to_thread(_blocking)
+        else:
+            await asyncio.to_thread(_online, args)
+        migration_end = time.perf_counter()
+        stop.set()
+        await asyncio.gather(*workers)
+    await asyncio.to_thread(_revert)
+    return {
+        f"{mode}: before": _summary(samples, begun, migration_start),
+        f"{mode}: during": _summary(samples, migration_start, migration_end),
+    }, migration_end - migration_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2000000,
+                        help="seeded students to migrate")
+    parser.add_argument("--modes", default="blocking,online")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--write-ratio", type=float, default=0.2,
+                        help="fraction of requests that are updates")
+    parser.add_argument("--baseline", type=float, default=10.0,
+                        help="seconds of load before the migration")
+    parser.add_argument("--lock-timeout", type=float, default=2.0)
+    parser.add_argument("--batch-seconds", type=float, default=0.2)
+    parser.add_argument("--max-active", type=int, default=None)
+    parser.add_argument("--max-p99-ms", type=float, default=None,
+                        help="fail if the online migration's p99 is higher")
+    parser.add_argument("--base-url", default=os.getenv(
+        "BENCH_BASE_URL", f"http://localhost:{os.getenv('APP_PORT', '8000')}"))
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    seeded = _count_seeded()
+    if seeded < args.rows:
+        loadtest.seed(argparse.Namespace(rows=args.rows, batch_size=5000,
+                                         clean=False))
+    ids = [s["id"] for s in loadtest.seeded_students(1000)]
+
+    results, durations = {}, {}
+    for mode in args.modes.split(","):
+        rows, durations[mode] = asyncio.run(_run(args, mode, ids))
+        results.update(rows)
+
+    print_table(f"{args.rows} students, concurrency={args.concurrency}",
+                results)
+    for name, result in results.items():
+        print(f"{name}: max {result['max_ms']} ms, "
+              f"{result['errors']} failed requests {result['failed']}")
+    for mode, seconds in durations.items():
+        print(f"{mode} migration took {seconds:.1f}s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "title": "migration under load",
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                            time.gmtime()),
+                "host": platform.node(),
+                "python": platform.python_version(),
+                "rows": args.rows,
+                "migration_seconds": durations,
+                "results": results,
+            }, f, indent=2)
+        print(f"results written to {args.output}")
+
+    online = results.get("online: during")
+    if online is not None and (online["errors"] or (
+            args.max_p99_ms is not None
+            and online["p99_ms"] > args.max_p99_ms)):
+        print("online migration degraded the API", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Per-query latency with and without prepared statements.
+
+Runs the data layer's single-row lookup and a rotation through the
+UPDATE variants against the configured database, first with the
+statement cache disabled (plain SQL, parsed and planned on every call)
+and then enabled (PREPARE once per connection, EXECUTE afterwards).
+A scratch student is inserted for the run and deleted afterwards.
+
+    python benchmarks/bench_prepared.py --queries 5000
+"""
+
+import argparse
+import itertools
+import time
+
+from common import print_table, summarize
+
+import db_students
+from pydantic import BaseModel
+
+
+class _Student(BaseModel):
+    name: str
+    email: str
+    age: int
+    phone: str
+
+
+class _Update(BaseModel):
+    name: str = None
+    email: str = None
+    age: int = None
+    phone: str = None
+
+
+_VALUES = {"name": "Bench Student", "email": "bench.prepared@example.com",
+           "age": 30, "phone": "9000000000"}
+
+
+def _update_variants():
+    fields = list(_VALUES)
+    return [_Update(**{f: _VALUES[f] for f in combo})
+            for size in range(1, len(fields) + 1)
+            for combo in itertools.combinations(fields, size)]
+
+
+def _run(call, queries):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(queries):
+        t = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--queries', type=int, default=5000)
+    args = parser.parse_args()
+
+    student_id = db_students.insertstudent(
+        _Student(**_VALUES))["student_id"]["id"]
+    variants = _update_variants()
+    cases = {
+        'get_student_by_Id': lambda i: db_students.get_student_by_Id(
+            student_id),
+        'Update_student': lambda i: db_students.Update_student(
+            student_id, variants[i % len(variants)]),
+    }
+    cache_size = db_students.STATEMENT_CACHE_SIZE or 64
+    rows = {}
+    try:
+        for name, call in cases.items():
+            for label, size in (('plain', 0), ('prepared', cache_size)):
+                db_students.STATEMENT_CACHE_SIZE = size
+                _run(call, min(args.queries, 200))  # warm up
+                rows[f'{name} {label}'] = _run(call, args.queries)
+    finally:
+        db_students.delete_student(student_id)
+    print_table(f'{args.queries} queries per case, one connection at a '
+                'time', rows)
+
+
+if __name__ == '__main__':
+    main()
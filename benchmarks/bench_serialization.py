@@ -0,0 +1,63 @@
+"""
+Response serialization for large student lists.
+
+Renders a list of N student rows the way /GetAllStudents used to
+(jsonable_encoder, then Starlette's JSONResponse on stdlib json) and the
+way it does now (FastJSONResponse, orjson when installed), and reports
+the time per response and the speed-up. No database is needed.
+
+    python benchmarks/bench_serialization.py --rows 10000
+"""
+
+import argparse
+import time
+
+import common  # noqa: F401  (puts code/ on the import path)
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import serialization
+from serialization import FastJSONResponse
+
+
+def _rows(count):
+    return [{"id": i, "name": f"Student {i}",
+             "email": f"student{i}@example.com", "age": 18 + i % 10,
+             "phone": str(9000000000 + i)} for i in range(count)]
+
+
+def _time(render, repeat):
+    render()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        render()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = _rows(args.rows)
+    cases = {
+        'jsonable_encoder + JSONResponse':
+            lambda: JSONResponse(content=jsonable_encoder(rows)),
+        'FastJSONResponse':
+            lambda: FastJSONResponse(content=rows),
+    }
+    results = {name: _time(render, args.repeat)
+               for name, render in cases.items()}
+
+    backend = 'orjson' if serialization.orjson else 'stdlib json'
+    print(f'{args.rows} rows, FastJSONResponse backend: {backend}')
+    baseline = results['jsonable_encoder + JSONResponse']
+    for name, seconds in results.items():
+        print(f'{name:<34}{seconds * 1000:>10.2f} ms'
+              f'{baseline / seconds:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Cold-start time of the API.
+
+Measures, over several fresh processes:
+
+    import       interpreter start plus `import Main`, with and without
+                 precompiled bytecode (an empty PYTHONPYCACHEPREFIX and
+                 PYTHONDONTWRITEBYTECODE make every module compile again)
+    ready        launching code/serve.py until /readyz answers 200
+
+After each `ready` run the worker's own startup report (seconds from
+process start to imported, serving and ready) is read from /HealthCheck.
+The POSTGRES_* variables must point at a reachable database for the
+`ready` case. Results can be saved as JSON and checked against an
+earlier run with `loadtest.py compare`.
+
+    python benchmarks/bench_startup.py --runs 10 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from common import CODE_DIR, print_table, summarize
+
+
+def _import_time(bytecode):
+    env = dict(os.environ, PYTHONPATH=CODE_DIR)
+    with tempfile.TemporaryDirectory() as cache:
+        if not bytecode:
+            env.update(PYTHONPYCACHEPREFIX=cache, PYTHONDONTWRITEBYTECODE="1")
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import Main"], env=env,
+                       cwd=CODE_DIR, check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        return time.perf_counter() - start
+
+
+def _get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, None
+    except OSError:
+        return None, None
+
+
+def _ready_time(port, timeout):
+    """Seconds until /readyz answers 200, and the worker's report."""
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY="1")
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(CODE_DIR, "serve.py")], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if _get(base + "/readyz")[0] == 200:
+                elapsed = time.perf_counter() - start
+                _, health = _get(base + "/HealthCheck")
+                return elapsed, (health or {}).get("components", {}).get(
+                    "application", {}).get("startup", {})
+            time.sleep(0.01)
+        raise RuntimeError(f"API not ready after {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--no-ready", action="store_true",
+                        help="skip the case that needs a database")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for label, bytecode in (("import Main (bytecode)", True),
+                            ("import Main (no bytecode)", False)):
+        samples = [_import_time(bytecode) for _ in range(args.runs)]
+        results[label] = summarize(samples, sum(samples))
+    reports = []
+    if not args.no_ready:
+        samples = []
+        for _ in range(args.runs):
+            elapsed, report = _ready_time(args.port, args.timeout)
+            samples.append(elapsed)
+            reports.append(report)
+        results["serve.py until ready"] = summarize(samples, sum(samples))
+    for result in results.values():
+        result["errors"] = 0
+
+    print_table(f"{args.runs} cold starts per case", results)
+    for phase in reports[0] if reports else ():
+        values = sorted(r[phase] for r in reports if phase in r)
+        print(f"worker {phase}: median {values[len(values) // 2]:.3f}s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "title": "cold start",
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                            time.gmtime()),
+                "host": platform.node(),
+                "python": platform.python_version(),
+                "runs": args.runs,
+                "results": results,
+                "startup_reports": reports,
+            }, f, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Shared helpers for the benchmark scripts.
+Puts the application modules on the import path and summarises
+latency samples as throughput plus percentiles.
+"""
+
+import os
+import sys
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'code')
+if CODE_DIR not in sys.path:
+    sys.path.insert(0, CODE_DIR)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an unsorted list of samples."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1,
+                      int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies, elapsed):
+    """Summarise per-request latencies (seconds) over a run of `elapsed`."""
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def print_table(title, rows):
+    """Print {name: summary} rows as an aligned table."""
+    print(title)
+    print(f"{'case':<28}{'requests':>10}{'rps':>12}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, s in rows.items():
+        print(f"{name:<28}{s['requests']:>10}{s['rps']:>12}"
+              f"{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
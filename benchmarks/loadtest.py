@@ -0,0 +1,348 @@
+"""
+Load-test and benchmark harness for the student API.
+
+    seed     insert N generated students into the configured database
+    http     drive every endpoint of a running API at a given concurrency
+    db       call the db_students functions directly from worker threads
+    compare  fail when a result file regresses against a baseline
+
+Seeded students use the @loadtest.example email domain, so they can be
+found again and removed with `seed --clean`. `http` and `db` print a
+table of RPS and p50/p95/p99 latency per case and can save it as JSON.
+The POSTGRES_* variables must point at a migrated database, e.g. the
+compose DB service:
+
+    python benchmarks/loadtest.py seed --rows 100000
+    python benchmarks/loadtest.py http --concurrency 50 --requests 2000 \\
+        --output current.json
+    python benchmarks/loadtest.py db --concurrency 8 --output db.json
+    python benchmarks/loadtest.py compare baseline.json current.json \\
+        --threshold 0.10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from common import print_table, summarize
+
+SEED_DOMAIN = "loadtest.example"
+
+
+def _student(i):
+    return {"name": f"Loadtest Student {i}",
+            "email": f"student{i}@{SEED_DOMAIN}",
+            "age": 18 + i % 40,
+            "phone": str(9000000000 + i % 1000000000)}
+
+
+def seeded_students(limit=1000):
+    """A sample of seeded students as {"id", "email"} rows."""
+    import db_students
+    with db_students.get_cursor() as (conn, cur):
+        cur.execute("SELECT ID, email FROM students WHERE email LIKE %s "
+                    "ORDER BY random() LIMIT %s;", (f"%@{SEED_DOMAIN}", limit))
+        return cur.fetchall()
+
+
+def seed(args):
+    import db_students
+    from psycopg2.extras import execute_values
+    with db_students.get_cursor() as (conn, cur):
+        if args.clean:
+            cur.execute("DELETE FROM students WHERE email LIKE %s;",
+                        (f"%@{SEED_DOMAIN}",))
+            conn.commit()
+            print(f"removed {cur.rowcount} seeded students")
+            return 0
+        start = time.perf_counter()
+        for first in range(0, args.rows, args.batch_size):
+            batch = [_student(i) for i in range(
+                first, min(first + args.batch_size, args.rows))]
+            execute_values(
+                cur, "INSERT INTO students (name, email, age, phone) "
+                     "VALUES %s ON CONFLICT DO NOTHING;",
+                [(s["name"], s["email"], s["age"], s["phone"])
+                 for s in batch], page_size=len(batch))
+            conn.commit()
+        cur.execute("ANALYZE students;")
+        conn.commit()
+    print(f"seeded {args.rows} students in "
+          f"{time.perf_counter() - start:.1f}s")
+    return 0
+
+
+def _http_cases(students):
+    """name -> factory of (method, path, params, json body)."""
+    ids = [s["id"] for s in students]
+
+    def pick():
+        return random.choice(ids)
+
+    def new_student():
+        return {"name": "Loadtest Write",
+                "email": f"{uuid.uuid4().hex}@{SEED_DOMAIN}",
+                "age": 30, "phone": "9000000000"}
+
+    return {
+        "GET /GetStudent": lambda: ("GET", "/GetStudent",
+                                    {"id": pick()}, None),
+        "GET /GetAllStudents page": lambda: (
+            "GET", "/GetAllStudents",
+            {"limit": 100, "after": pick()}, None),
+        "GET /v2/students/search email": lambda: (
+            "GET", "/v2/students/search",
+            {"email": random.choice(students)["email"]}, None),
+        "GET /v2/students/search name": lambda: (
+            "GET", "/v2/students/search",
+            {"name": "loadtest student 1", "limit": 20}, None),
+        "POST /v2/students:batchGet": lambda: (
+            "POST", "/v2/students:batchGet", None,
+            {"ids": random.sample(ids, min(100, len(ids)))}),
+        "PATCH /v2/UpdateStudent": lambda: (
+            "PATCH", "/v2/UpdateStudent", {"id": pick()},
+            {"age": random.randint(18, 60)}),
+        "POST /AddStudent": lambda: ("POST", "/AddStudent", None,
+                                     new_student()),
+        "GET /HealthCheck": lambda: ("GET", "/HealthCheck", None, None),
+        "GET /metrics": lambda: ("GET", "/metrics", None, None),
+    }
+
+
+async def _drive(client, make_request, concurrency, requests):
+    latencies, errors = [], 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, path, params, body = make_request()
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, params=params,
+                                                json=body)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(latencies, time.perf_counter() - start)
+    result["errors"] = errors
+    return result
+
+
+async def _run_http(args, cases):
+    import httpx
+    limits = httpx.Limits(max_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits,
+                                 timeout=args.timeout) as client:
+        for name, make_request in cases.items():
+            if args.only and not any(o in name for o in args.only):
+                continue
+            await _drive(client, make_request, args.concurrency,
+                         min(args.requests, args.warmup))
+            results[name] = await _drive(client, make_request,
+                                         args.concurrency, args.requests)
+    return results
+
+
+def http(args):
+    students = seeded_students()
+    if not students:
+        print("no seeded students; run `loadtest.py seed` first",
+              file=sys.stderr)
+        return 1
+    try:
+        results = asyncio.run(_run_http(args, _http_cases(students)))
+    finally:
+        _cleanup_writes()
+    return _report(args, f"HTTP {args.base_url}, concurrency="
+                         f"{args.concurrency}", results)
+
+
+def _cleanup_writes():
+    """Remove the students created by the AddStudent case."""
+    import db_students
+    with db_students.get_cursor() as (conn, cur):
+        cur.execute("DELETE FROM students WHERE email LIKE %s "
+                    "AND name = 'Loadtest Write';", (f"%@{SEED_DOMAIN}",))
+        conn.commit()
+
+
+def _db_cases(students):
+    import db_students
+    from pydantic import BaseModel
+    ids = [s["id"] for s in students]
+
+    class _Patch(BaseModel):
+        name: str = None
+        email: str = None
+        age: int = None
+        phone: str = None
+
+    def pick():
+        return random.choice(ids)
+
+    return {
+        "get_student_by_Id": lambda: db_students.get_student_by_Id(pick()),
+        "get_students_page": lambda: db_students.get_students_page(
+            100, pick()),
+        "search_students email": lambda: db_students.search_students(
+            email=random.choice(students)["email"]),
+        "search_students name": lambda: db_students.search_students(
+            name="loadtest student 1", limit=20),
+        "get_students_by_ids": lambda: db_students.get_students_by_ids(
+            random.sample(ids, min(100, len(ids)))),
+        "Update_student": lambda: db_students.Update_student(
+            pick(), _Patch(age=random.randint(18, 60))),
+        "ping": db_students.ping,
+    }
+
+
+def _drive_threads(call, concurrency, requests):
+    def timed(_):
+        start = time.perf_counter()
+        try:
+            res = call()
+            ok = res is None or res["status"] == "success"
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        samples = list(executor.map(timed, range(requests)))
+    result = summarize([s[0] for s in samples], time.perf_counter() - start)
+    result["errors"] = sum(1 for s in samples if not s[1])
+    return result
+
+
+def db(args):
+    students = seeded_students()
+    if not students:
+        print("no seeded students; run `loadtest.py seed` first",
+              file=sys.stderr)
+        return 1
+    results = {}
+    for name, call in _db_cases(students).items():
+        if args.only and not any(o in name for o in args.only):
+            continue
+        _drive_threads(call, args.concurrency,
+                       min(args.requests, args.warmup))
+        results[name] = _drive_threads(call, args.concurrency, args.requests)
+    return _report(args, f"db_students, concurrency={args.concurrency}",
+                   results)
+
+
+def _report(args, title, results):
+    print_table(title, results)
+    errors = sum(r["errors"] for r in results.values())
+    if errors:
+        print(f"{errors} requests failed", file=sys.stderr)
+    if args.output:
+        document = {
+            "title": title,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+        print(f"results written to {args.output}")
+    return 0
+
+
+def compare(args):
+    """
+    Compare two result files case by case. A case regresses when its RPS
+    drops, or its p95/p99 latency grows, by more than `threshold`.
+    """
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+    regressions = []
+    print(f"{'case':<34}{'metric':>8}{'baseline':>12}{'current':>12}"
+          f"{'change':>9}")
+    for name, base in baseline.items():
+        if name not in current:
+            print(f"{name:<34} missing from current run")
+            continue
+        for metric, higher_is_better in (("rps", True), ("p95_ms", False),
+                                         ("p99_ms", False)):
+            old, new = base[metric], current[name][metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = " REGRESSION" if worse > args.threshold else ""
+            if flag:
+                regressions.append((name, metric))
+            print(f"{name:<34}{metric:>8}{old:>12}{new:>12}"
+                  f"{change:>+9.1%}{flag}")
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond "
+              f"{args.threshold:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("seed", help="insert generated students")
+    p.add_argument("--rows", type=int, default=100000)
+    p.add_argument("--batch-size", type=int, default=5000)
+    p.add_argument("--clean", action="store_true",
+                   help="remove the seeded students instead")
+    p.set_defaults(func=seed)
+
+    for name, func, help in (
+            ("http", http, "benchmark the endpoints of a running API"),
+            ("db", db, "benchmark the db_students functions directly")):
+        p = commands.add_parser(name, help=help)
+        p.add_argument("--concurrency", type=int, default=20)
+        p.add_argument("--requests", type=int, default=1000,
+                       help="measured requests per case")
+        p.add_argument("--warmup", type=int, default=100,
+                       help="unmeasured requests per case before timing")
+        p.add_argument("--only", action="append",
+                       help="run only cases whose name contains this")
+        p.add_argument("--output", help="write results as JSON")
+        p.set_defaults(func=func)
+    commands.choices["http"].add_argument(
+        "--base-url", default=os.getenv(
+            "BENCH_BASE_URL",
+            f"http://localhost:{os.getenv('APP_PORT', '8000')}"))
+    commands.choices["http"].add_argument("--timeout", type=float,
+                                          default=30.0)
+
+    p = commands.add_parser("compare", help="check for regressions")
+    p.add_argument("baseline")
+    p.add_argument("current")
+    p.add_argument("--threshold", type=float, default=0.10,
+                   help="allowed relative slowdown, e.g. 0.10 for 10%%")
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
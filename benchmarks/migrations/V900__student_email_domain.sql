@@ -0,0 +1,16 @@
+-- Sample online migration used by bench_migration.py: a new column, a
+-- backfill of the existing rows, and an index on it. The index is built
+-- after the backfill, so the backfill doesn't maintain it row by row and
+-- the planner doesn't pick it, without statistics, for the batches. The
+-- benchmark drops the column again afterwards.
+
+-- step: transaction
+ALTER TABLE students ADD COLUMN IF NOT EXISTS email_domain TEXT;
+
+-- step: backfill table=students key=id batch=2000
+UPDATE students SET email_domain = lower(split_part(email, '@', 2))
+WHERE id > %(start)s AND id <= %(end)s AND email_domain IS NULL;
+
+-- step: concurrently
+CREATE INDEX CONCURRENTLY IF NOT EXISTS students_email_domain_idx
+    ON students (email_domain);
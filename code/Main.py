@@ -4,66 +4,106 @@ This API provides CRUD operations for student management with PostgreSQL.
 """
 
 from fastapi import FastAPI, HTTPException
-from fastapi import APIRouter, Request, Response
+from fastapi import APIRouter, Header, Query, Request, Response
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
-from db_students import insertstudent, get_all_students
-from db_students import get_student_by_Id, Update_student, delete_student
-import uvicorn
-from fastapi.encoders import jsonable_encoder
+from db_async import insertstudent, get_all_students
+from db_async import get_student_by_Id, Update_student, delete_student
+from db_async import get_students_page, open_student_stream, run_db
+from db_async import search_students, get_students_by_ids
+from db_async import update_students_batch, delete_students_batch
+from db_async import get_changes, get_table_version, open_pool
+from db_async import get_change_horizon
+from db_async import insert_batcher
+import db_students
+import deadlines
+from db_students import STUDENT_FIELDS
+from contextlib import asynccontextmanager
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from typing import Optional
+from fastapi.responses import StreamingResponse
+# Every JSON response renders through the fast serializer
+from serialization import FastJSONResponse as JSONResponse
+from serialization import dumps, dumps_str
+from typing import List, Literal, Optional
 from dotenv import load_dotenv
+import asyncio
 import os
+import csv
 import json
 from loguru import logger
-import sys
+import tempfile
 import time
-import psycopg2
-from prometheus_client import Counter, Histogram
-
-
-# Configure Loguru to emit JSON logs
-def serialize(record):
-    subset = {
-        "timestamp": record["time"].strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
-        "message": record["message"],
-        "level": record["level"].name,
-        "function": record["function"],
-        "line": record["line"],
-        "file": record["file"].name,
-        "module": record["module"]
-    }
-    return json.dumps(subset)
-
-
-def patching(record):
-    record["extra"]["serialized"] = serialize(record)
-
+from middleware import PrometheusMiddleware, AdmissionMiddleware
+from compression import CompressionMiddleware, available, compress
+from compression import negotiate, weak_etag
+import list_cache
+from middleware import parse_route_timeouts, ReadYourWritesMiddleware
+from middleware import ServerTimingMiddleware, ProfilerMiddleware
+from middleware import debug_authorized
+from profiler import ProfileStore, Sampler
+from request_timing import TimedRoute
+from replicas import ReplicaMonitor
+from metrics import generate_metrics, mark_worker_stopped
+from metrics import LIST_CACHE_REQUESTS
+from health import build_health_checker
+from conditional import etag, parse_if_match, list_etag, last_modified
+from conditional import not_modified, validators
+from change_feed import build_change_notifier, build_change_pruner
+from change_feed import parse_cursor
+from log_config import configure_logging, shutdown_logging
+import startup
 
-logger.remove()
-logger = logger.patch(patching)
-logger.add(sys.stderr, format="{extra[serialized]}", backtrace=True)
 
 load_dotenv()
+configure_logging()
 
-# Prometheus metrics
-REQUEST_COUNT = Counter(
-    'api_requests_total',
-    'Total number of API requests',
-    ['endpoint', 'method', 'status_code']
-)
-REQUEST_LATENCY = Histogram(
-    'api_request_latency_seconds',
-    'API request latency in seconds',
-    ['endpoint', 'method', 'status_code'],
-    buckets=[0.1, 0.3, 0.5, 1.0, 2.0, 5.0, 10.0]
-)
-ERROR_COUNT = Counter(
-    'api_errors_total',
-    'Total number of API errors',
-    ['endpoint', 'method', 'status_code']
-)
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 1000))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 1000))
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 50))
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", 500))
+# Longest a change-feed long poll may wait for new changes (seconds)
+CHANGES_MAX_WAIT = float(os.getenv("CHANGES_MAX_WAIT", 30))
+
+# Admission control and per-route deadlines (seconds, 0 = no deadline)
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 100))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 100))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 1))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", 10))
+ROUTE_TIMEOUTS = {
+    "/GetAllStudents": 120,
+    "/v2/students/bulk": 300,
+    "/v2/students/changes": CHANGES_MAX_WAIT + REQUEST_TIMEOUT,
+    "/v2/students/changes/stream": 0,
+    **parse_route_timeouts(os.getenv("ROUTE_TIMEOUTS")),
+}
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 1000))
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 1000))
+# Uploads larger than this are spooled to disk while they are received
+BULK_SPOOL_BYTES = int(os.getenv("BULK_SPOOL_BYTES", 8 * 1024 * 1024))
+# Responses of at least this many bytes are compressed, with the first
+# of these encodings the client accepts (empty disables compression)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_ENCODINGS = available(
+    os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(","))
+# Read replicas: lag beyond which a replica is ejected, how often lag is
+# measured, and how long a client's reads stay on the primary after it
+# writes (keep it above the lag limit plus the check interval)
+REPLICA_MAX_LAG = float(os.getenv("POSTGRES_REPLICA_MAX_LAG", 5))
+REPLICA_CHECK_INTERVAL = float(
+    os.getenv("POSTGRES_REPLICA_CHECK_INTERVAL", 1))
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", 10))
+# Request instrumentation: Server-Timing on every response, or only for
+# requests whose X-Debug-Token matches DEBUG_TOKEN, which also profiles
+# them; a fraction of all requests can be profiled as well
+SERVER_TIMING = os.getenv("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN") or None
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(
+    tempfile.gettempdir(), "student-api-profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 100))
+# Startup connection attempts while the database is unreachable
+POSTGRES_CONNECT_RETRIES = int(os.getenv("POSTGRES_CONNECT_RETRIES", 10))
+POSTGRES_CONNECT_BACKOFF = float(os.getenv("POSTGRES_CONNECT_BACKOFF", 0.5))
 
 
 class Student(BaseModel):
@@ -112,64 +152,141 @@ class UpdateStudent(BaseModel):
     )
 
 
-app = FastAPI()
-app.start_time = time.time()
+class StudentIds(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=MAX_BATCH_SIZE,
+                           examples=[[1, 2, 3]])
+
+    model_config = ConfigDict(extra='forbid')
+
 
-version_v1 = APIRouter()
-version_v2 = APIRouter()
+class StudentPatch(UpdateStudent):
+    id: int = Field(examples=[1])
 
 
-# Middleware to capture metrics
-@app.middleware("http")
-async def prometheus_metrics(request: Request, call_next):
+class StudentPatches(BaseModel):
+    students: List[StudentPatch] = Field(min_length=1,
+                                         max_length=MAX_BATCH_SIZE)
+
+    model_config = ConfigDict(extra='forbid')
+
+
+health_checker = build_health_checker()
+change_notifier = build_change_notifier()
+change_pruner = build_change_pruner()
+replica_monitor = None
+if db_students.router is not None:
+    replica_monitor = ReplicaMonitor(db_students.router,
+                                     interval=REPLICA_CHECK_INTERVAL,
+                                     max_lag=REPLICA_MAX_LAG)
+
+
+async def warm_up():
     """
-    Middleware to capture request count, latency, and errors for Prometheus.
+    Connect the pool in the background, then start the health checks
+    that mark the worker ready. Serving starts without waiting, so a
+    database that is briefly unreachable only delays readiness.
     """
-    endpoint = request.url.path
-    method = request.method
-    start_time = time.time()
+    await open_pool(POSTGRES_CONNECT_RETRIES, POSTGRES_CONNECT_BACKOFF)
+    health_checker.start()
+    if change_pruner is not None:
+        change_pruner.start()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db_students.check_settings()
+    warm_up_task = asyncio.create_task(warm_up())
+    if replica_monitor is not None:
+        replica_monitor.start()
+    startup.mark("serving")
+    yield
+    if insert_batcher is not None:
+        await insert_batcher.stop()
+    if replica_monitor is not None:
+        await replica_monitor.stop()
+    warm_up_task.cancel()
     try:
-        response = await call_next(request)
-        status_code = response.status_code
-        REQUEST_COUNT.labels(endpoint=endpoint, method=method,
-                             status_code=status_code).inc()
-        REQUEST_LATENCY.labels(endpoint=endpoint, method=method,
-                               status_code=status_code
-                               ).observe(time.time() - start_time)
-        if status_code >= 400:
-            ERROR_COUNT.labels(endpoint=endpoint, method=method,
-                               status_code=status_code).inc()
-        return response
-    except Exception as e:
-        ERROR_COUNT.labels(endpoint=endpoint, method=method,
-                           status_code=500).inc()
-        raise e
+        await warm_up_task
+    except asyncio.CancelledError:
+        pass
+    await health_checker.stop()
+    await change_notifier.stop()
+    if change_pruner is not None:
+        await change_pruner.stop()
+    mark_worker_stopped()
+    shutdown_logging()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=JSONResponse)
+app.start_time = time.time()
 
+# Routes record their request validation time for Server-Timing
+app.router.route_class = TimedRoute
+version_v1 = APIRouter(route_class=TimedRoute)
+version_v2 = APIRouter(route_class=TimedRoute)
 
-# Middleware to catch malformed JSON
-@app.middleware("http")
-async def handle_malformed_json(request: Request, call_next):
+
+# Middleware added first runs innermost. Routing state is per request.
+if db_students.router is not None:
+    app.add_middleware(ReadYourWritesMiddleware,
+                       window=READ_YOUR_WRITES_WINDOW)
+# Inside admission control, so compression time counts towards request
+# latency and the deadline, and shed requests are never compressed
+if COMPRESSION_ENCODINGS:
+    app.add_middleware(CompressionMiddleware,
+                       min_size=COMPRESSION_MIN_SIZE,
+                       encodings=COMPRESSION_ENCODINGS)
+# Added before PrometheusMiddleware so it runs inside it, and the 503s
+# and 504s it produces are counted
+app.add_middleware(
+    AdmissionMiddleware,
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    default_timeout=REQUEST_TIMEOUT,
+    timeouts=ROUTE_TIMEOUTS,
+    # Probes must answer even when the API is saturated
+    exempt=("/livez", "/readyz", "/HealthCheck", "/metrics"),
+    # Long polls and event streams mostly sit idle; they do not take slots
+    unqueued=("/v2/students/changes", "/v2/students/changes/stream"))
+profile_store = ProfileStore(PROFILE_DIR, PROFILE_KEEP)
+if DEBUG_TOKEN or PROFILE_SAMPLE_RATE:
+    app.add_middleware(ProfilerMiddleware,
+                       sampler=Sampler(PROFILE_INTERVAL_MS / 1000),
+                       store=profile_store,
+                       token=DEBUG_TOKEN,
+                       sample_rate=PROFILE_SAMPLE_RATE)
+app.add_middleware(PrometheusMiddleware)
+# Outermost, so the total covers the whole request
+if SERVER_TIMING or DEBUG_TOKEN:
+    app.add_middleware(ServerTimingMiddleware, always=SERVER_TIMING,
+                       token=DEBUG_TOKEN)
+
+
+def malformed_json_response(e: json.JSONDecodeError):
     """
-    Middleware to catch malformed JSON in the request body.
+    400 response for a request body that is not well-formed JSON.
     """
-    if request.headers.get("content-type") == "application/json":
-        try:
-            await request.json()  # Try parsing the JSON body
-        except json.JSONDecodeError as e:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "error": """Given Json is not well formatted,
+    return JSONResponse(
+        status_code=400,
+        content={
+            "error": """Given Json is not well formatted,
                                 please check the input Json""",
-                    "details": str(e),
-                },
-            )
-    return await call_next(request)
+            "details": str(e),
+        },
+    )
 
 
 # Custom handler for 422 Unprocessable Entity
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc: RequestValidationError):
+    # FastAPI reports an unparsable body as a json_invalid validation error;
+    # answer it with the malformed-JSON 400 without parsing the body again.
+    for error in exc.errors():
+        if error["type"] == "json_invalid":
+            return malformed_json_response(json.JSONDecodeError(
+                error["ctx"]["error"], exc.body, error["loc"][-1]))
+
     error_messages = []
     for error in exc.errors():
         loc = " -> ".join(str(i) for i in error["loc"])
@@ -208,7 +325,7 @@ async def create_student(student: Student) -> Student:
             "endpoint": "/AddStudent",
             "method": "POST"
         })
-        res = jsonable_encoder(insertstudent(data=student))
+        res = await insertstudent(data=student)
         if res['status'] == "success":
             logger.info({
                 "event": "create_student_success",
@@ -235,23 +352,182 @@ async def create_student(student: Student) -> Student:
         return JSONResponse(status_code=400, content=str(e))
 
 
+def parse_fields(fields: Optional[str]):
+    """
+    Turn a comma separated `fields=` projection into a tuple of columns.
+    Raises ValueError for unknown columns.
+    """
+    if not fields:
+        return None
+    requested = tuple(f.strip().lower() for f in fields.split(",")
+                      if f.strip())
+    unknown = [f for f in requested if f not in STUDENT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. "
+                         f"Allowed: {', '.join(STUDENT_FIELDS)}")
+    return requested
+
+
+def encode_student_stream(first, batches, stream_format):
+    """
+    Encode batches of rows as NDJSON lines or as one chunked JSON array.
+    Runs in Starlette's threadpool, one chunk per database batch. The
+    request's deadline ends once the response starts, so each later
+    batch gets REQUEST_TIMEOUT of its own instead.
+    """
+    try:
+        if stream_format == "json":
+            yield b"["
+        separator = b""
+        batch = first
+        while batch:
+            if stream_format == "ndjson":
+                yield b"".join(dumps(row) + b"\n" for row in batch)
+            else:
+                yield separator + b",".join(dumps(row) for row in batch)
+                separator = b","
+            token = deadlines.start(REQUEST_TIMEOUT)
+            try:
+                batch = next(batches, None)
+            finally:
+                deadlines.reset(token)
+        if stream_format == "json":
+            yield b"]"
+    finally:
+        batches.close()
+
+
+async def full_list_response(version, headers, accept_encoding):
+    """
+    The full student list from the body cache. Only a miss queries,
+    serializes and compresses; the result is kept for later requests
+    at the same table version. Returns None when the list could not be
+    read, so the caller answers with its usual error.
+    """
+    cache = list_cache.cache
+    body = cache.get(version, "identity")
+    LIST_CACHE_REQUESTS.labels(result="miss" if body is None else "hit").inc()
+    if body is None:
+        res = await get_all_students()
+        if res['status'] != "success":
+            return None
+        body = dumps(res['students'])
+        cache.put(version, "identity", body)
+    encoding = negotiate(accept_encoding, COMPRESSION_ENCODINGS)
+    if encoding is None or len(body) < COMPRESSION_MIN_SIZE:
+        return Response(content=body, media_type="application/json",
+                        headers=headers)
+    compressed = cache.get(version, encoding)
+    if compressed is None:
+        compressed = await compress(encoding, body)
+        cache.put(version, encoding, compressed)
+    return Response(content=compressed, media_type="application/json",
+                    headers={**headers, "ETag": weak_etag(headers["ETag"]),
+                             "Content-Encoding": encoding,
+                             "Vary": "Accept-Encoding"})
+
+
 @version_v1.get("/GetAllStudents", status_code=200)
-async def get_students() -> dict:
+async def get_students(
+        limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+        after: Optional[int] = Query(default=None, ge=0),
+        fields: Optional[str] = None,
+        stream: Optional[Literal["ndjson", "json"]] = None,
+        if_none_match: Optional[str] = Header(default=None),
+        accept_encoding: Optional[str] = Header(default=None)) -> dict:
+    """
+    Without parameters returns every student, as before.
+    `limit`/`after` page through students by ID; the cursor for the next
+    page is returned in the X-Next-After header. `fields` projects columns.
+    `stream=ndjson|json` streams the whole table from a server-side cursor.
+    Responses carry an ETag; send it back as If-None-Match to get a 304
+    without the students being read again while nothing has changed.
+    """
     try:
         logger.info({
             "event": "get_all_students_start",
             "endpoint": "/GetAllStudents",
             "method": "GET"
         })
-        res = jsonable_encoder(get_all_students())
+        try:
+            columns = parse_fields(fields)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"detail": str(e)})
+
+        # Read the version before the rows: a write landing in between
+        # leaves the ETag older than the body, which only costs the
+        # client one more full response. A conditional request or a
+        # cached list needs it up front; other reads take it in the
+        # same transaction as the rows.
+        whole_list = (list_cache.cache is not None and stream is None
+                      and limit is None and after is None
+                      and columns is None)
+        read_first = if_none_match is not None or whole_list
+        tag = None
+        if read_first:
+            version = await get_table_version()
+        if read_first and version['status'] == "success":
+            tag = list_etag(version['version'], limit, after, columns,
+                            stream)
+            cached = not_modified(if_none_match, None, tag)
+            if cached is not None:
+                logger.info({
+                    "event": "get_all_students_success",
+                    "endpoint": "/GetAllStudents",
+                    "method": "GET",
+                    "not_modified": True
+                })
+                return cached
+        headers = validators(tag)
+
+        if whole_list and tag is not None:
+            response = await full_list_response(
+                version['version'], headers, accept_encoding)
+            if response is not None:
+                logger.info({
+                    "event": "get_all_students_success",
+                    "endpoint": "/GetAllStudents",
+                    "method": "GET",
+                    "cached_body": True
+                })
+                return response
+
+        if stream is not None:
+            first, batches, table_version = await open_student_stream(
+                columns, after, STREAM_BATCH_SIZE, not read_first)
+            if table_version is not None:
+                headers = validators(list_etag(table_version, limit, after,
+                                               columns, stream))
+            logger.info({
+                "event": "get_all_students_stream",
+                "endpoint": "/GetAllStudents",
+                "method": "GET",
+                "format": stream
+            })
+            media_type = ("application/x-ndjson" if stream == "ndjson"
+                          else "application/json")
+            return StreamingResponse(
+                encode_student_stream(first, batches, stream),
+                media_type=media_type, headers=headers)
+
+        if limit is not None or after is not None:
+            res = await get_students_page(limit or MAX_PAGE_SIZE, after,
+                                          columns, not read_first)
+        else:
+            res = await get_all_students(columns, not read_first)
         if res['status'] == "success":
+            if res.get('version') is not None:
+                headers = validators(list_etag(res['version'], limit, after,
+                                               columns, stream))
             logger.info({
                 "event": "get_all_students_success",
                 "endpoint": "/GetAllStudents",
                 "method": "GET",
                 "student_count": len(res['students'])
             })
-            return JSONResponse(content=res['students'])
+            if res.get('next_after') is not None:
+                headers["X-Next-After"] = str(res['next_after'])
+            return JSONResponse(content=res['students'], headers=headers)
         else:
             logger.error({
                 "event": "get_all_students_failure",
@@ -272,21 +548,37 @@ async def get_students() -> dict:
 
 
 @version_v1.get("/GetStudent", status_code=200)
-async def get_student(id: int) -> dict:
+async def get_student(
+        id: int,
+        if_none_match: Optional[str] = Header(default=None),
+        if_modified_since: Optional[str] = Header(default=None)) -> dict:
+    """
+    Return one student with its ETag and Last-Modified. A matching
+    If-None-Match, or an If-Modified-Since no older than the row's
+    updated_at, gets a 304; cached rows answer it without the database.
+    """
     try:
         logger.info({
             "event": "get_student_start",
             "endpoint": "/GetStudent",
             "method": "GET"
         })
-        res = get_student_by_Id(id)
+        res = await get_student_by_Id(id)
         if res['status'] == "success":
+            student = res['students']
+            tag, modified = etag(student), last_modified(student)
+            cached = not_modified(if_none_match, if_modified_since, tag,
+                                  modified)
             logger.info({
                 "event": "get_student_success",
                 "endpoint": "/GetStudent",
-                "method": "GET"
+                "method": "GET",
+                "not_modified": cached is not None
             })
-            return JSONResponse(content=res['students'])
+            if cached is not None:
+                return cached
+            return JSONResponse(content=student,
+                                headers=validators(tag, modified))
         else:
             logger.error({
                 "event": "get_student_failure",
@@ -307,21 +599,46 @@ async def get_student(id: int) -> dict:
 
 
 @version_v2.patch("/UpdateStudent", status_code=200)
-async def Update(id: int, student: UpdateStudent) -> dict:
+async def Update(id: int, student: UpdateStudent,
+                 if_match: Optional[str] = Header(default=None)) -> dict:
+    """
+    Update the given fields and return the new row with its ETag.
+    Send the ETag from a previous read as If-Match to update only if
+    nobody changed the student since; otherwise the response is 412
+    with the current row.
+    """
     try:
         logger.info({
             "event": "update_student_start",
             "endpoint": "/UpdateStudent",
             "method": "PATCH"
         })
-        res = Update_student(id, student)
+        try:
+            expected_version = parse_if_match(if_match)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"detail": str(e)})
+        res = await Update_student(id, student, expected_version)
         if res['status'] == "success":
             logger.info({
                 "event": "update_student_success",
                 "endpoint": "/UpdateStudent",
                 "method": "PATCH"
             })
-            return JSONResponse(content={"message": res["message"]})
+            return JSONResponse(
+                content={"message": res["message"],
+                         "student": res["students"]},
+                headers={"ETag": etag(res["students"])})
+        elif res.get('precondition_failed'):
+            logger.info({
+                "event": "update_student_conflict",
+                "endpoint": "/UpdateStudent",
+                "method": "PATCH"
+            })
+            return JSONResponse(
+                status_code=412,
+                content={"detail": res["message"],
+                         "student": res["students"]},
+                headers={"ETag": etag(res["students"])})
         else:
             logger.error({
                 "event": "update_student_failure",
@@ -351,7 +668,7 @@ async def delete(id: int) -> dict:
             "endpoint": "/DeleteStudent",
             "method": "DELETE"
         })
-        res = delete_student(id)
+        res = await delete_student(id)
         if res['status'] == "success":
             logger.info({
                 "event": "delete_student_success",
@@ -380,47 +697,462 @@ async def delete(id: int) -> dict:
         return JSONResponse(status_code=500, content={"detail": str(e)})
 
 
+@version_v2.post("/students/bulk", status_code=200)
+async def bulk_create_students(request: Request) -> dict:
+    """
+    Insert many students from a JSON array, NDJSON or CSV upload.
+    Rows are validated against the Student schema and written in chunked
+    transactions; the response lists the assigned ID for every row
+    (null when rejected) and the errors of each rejected row.
+    """
+    try:
+        logger.info({
+            "event": "bulk_create_students_start",
+            "endpoint": "/v2/students/bulk",
+            "method": "POST"
+        })
+        # Rarely used, so imported on first upload rather than at startup
+        from bulk_ingest import media_format, ingest_students
+        fmt = media_format(request.headers.get("content-type"))
+        if fmt is None:
+            return JSONResponse(status_code=415, content={
+                "detail": "Content-Type must be application/json, "
+                          "application/x-ndjson or text/csv"})
+
+        with tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_BYTES) as body:
+            async for chunk in request.stream():
+                body.write(chunk)
+            body.seek(0)
+            try:
+                res = await run_db(ingest_students, body, fmt, Student,
+                                   BULK_CHUNK_SIZE)
+            except json.JSONDecodeError as e:
+                return malformed_json_response(e)
+            except (ValueError, UnicodeDecodeError, csv.Error) as e:
+                logger.error({
+                    "event": "bulk_create_students_failure",
+                    "endpoint": "/v2/students/bulk",
+                    "method": "POST",
+                    "error": str(e)
+                })
+                return JSONResponse(status_code=400,
+                                    content={"detail": str(e)})
+
+        logger.info({
+            "event": "bulk_create_students_success",
+            "endpoint": "/v2/students/bulk",
+            "method": "POST",
+            "inserted": res["inserted"],
+            "failed": res["failed"]
+        })
+        return JSONResponse(content=res)
+    except Exception as e:
+        logger.error({
+            "event": "bulk_create_students_error",
+            "endpoint": "/v2/students/bulk",
+            "method": "POST",
+            "error": str(e)
+        })
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+
+
+@version_v2.get("/students/search", status_code=200)
+async def search(
+        email: Optional[str] = None,
+        phone: Optional[str] = None,
+        name: Optional[str] = Query(default=None, min_length=1),
+        match: Literal["prefix", "fuzzy"] = "prefix",
+        limit: int = Query(default=SEARCH_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        after: Optional[int] = Query(default=None, ge=0),
+        fields: Optional[str] = None) -> dict:
+    """
+    Find students by exact `email` (case-insensitive) or `phone`, and by
+    `name` prefix or, with `match=fuzzy`, by similar spelling. Filters
+    combine with AND. Results are ordered by ID and paged with
+    `limit`/`after` like /GetAllStudents (cursor in X-Next-After).
+    """
+    try:
+        logger.info({
+            "event": "search_students_start",
+            "endpoint": "/v2/students/search",
+            "method": "GET"
+        })
+        if not (email or phone or name):
+            return JSONResponse(status_code=400, content={
+                "detail": "Provide at least one of email, phone or name"})
+        try:
+            columns = parse_fields(fields)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"detail": str(e)})
+
+        res = await search_students(email, phone, name, match, limit, after,
+                                    columns)
+        if res['status'] == "success":
+            logger.info({
+                "event": "search_students_success",
+                "endpoint": "/v2/students/search",
+                "method": "GET",
+                "student_count": len(res['students'])
+            })
+            headers = {}
+            if res['next_after'] is not None:
+                headers["X-Next-After"] = str(res['next_after'])
+            return JSONResponse(content=res['students'], headers=headers)
+        else:
+            logger.error({
+                "event": "search_students_failure",
+                "endpoint": "/v2/students/search",
+                "method": "GET",
+                "error": res['message']
+            })
+            return JSONResponse(status_code=400,
+                                content={"detail": res['message']})
+    except Exception as e:
+        logger.error({
+            "event": "search_students_error",
+            "endpoint": "/v2/students/search",
+            "method": "GET",
+            "error": str(e)
+        })
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+
+
+@version_v2.post("/students:batchGet", status_code=200)
+async def batch_get_students(body: StudentIds,
+                             fields: Optional[str] = None) -> dict:
+    """
+    Look up many students in one query. Returns one result per requested
+    ID, in request order.
+    """
+    try:
+        logger.info({
+            "event": "batch_get_students_start",
+            "endpoint": "/v2/students:batchGet",
+            "method": "POST",
+            "count": len(body.ids)
+        })
+        try:
+            columns = parse_fields(fields)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"detail": str(e)})
+        res = await get_students_by_ids(set(body.ids), columns)
+        if res['status'] != "success":
+            logger.error({
+                "event": "batch_get_students_failure",
+                "endpoint": "/v2/students:batchGet",
+                "method": "POST",
+                "error": res['message']
+            })
+            return JSONResponse(status_code=400,
+                                content={"detail": res['message']})
+        found = res['students']
+        results = [
+            {"id": id, "status": "success", "student": found[id]}
+            if id in found else
+            {"id": id, "status": "error", "message": "No Data found"}
+            for id in body.ids]
+        logger.info({
+            "event": "batch_get_students_success",
+            "endpoint": "/v2/students:batchGet",
+            "method": "POST",
+            "found": len(found)
+        })
+        return JSONResponse(content={"results": results})
+    except Exception as e:
+        logger.error({
+            "event": "batch_get_students_error",
+            "endpoint": "/v2/students:batchGet",
+            "method": "POST",
+            "error": str(e)
+        })
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+
+
+@version_v2.post("/students:batchUpdate", status_code=200)
+async def batch_update_students(body: StudentPatches) -> dict:
+    """
+    Apply a list of patches, each an UpdateStudent plus its `id`, in one
+    transaction. Returns one result per ID, in request order; a repeated
+    ID is applied once.
+    """
+    try:
+        logger.info({
+            "event": "batch_update_students_start",
+            "endpoint": "/v2/students:batchUpdate",
+            "method": "POST",
+            "count": len(body.students)
+        })
+        errors, patches, seen = {}, [], set()
+        for patch in body.students:
+            fields = patch.model_dump(exclude={"id"})
+            if patch.id in seen:
+                errors[patch.id] = "Duplicate ID in batch"
+            elif not any(v not in (None, "") for v in fields.values()):
+                errors[patch.id] = \
+                    "Please provide at least one field to update."
+            else:
+                patches.append((patch.id, patch))
+            seen.add(patch.id)
+
+        updated = set()
+        if patches:
+            res = await update_students_batch(patches)
+            if res['status'] != "success":
+                logger.error({
+                    "event": "batch_update_students_failure",
+                    "endpoint": "/v2/students:batchUpdate",
+                    "method": "POST",
+                    "error": res['message']
+                })
+                return JSONResponse(status_code=400,
+                                    content={"detail": res['message']})
+            updated = res['updated']
+            errors.update(res['errors'])
+
+        results = []
+        for id in dict.fromkeys(p.id for p in body.students):
+            if id in updated:
+                results.append({"id": id, "status": "success",
+                                "message": "Data is updated"})
+            else:
+                results.append({"id": id, "status": "error",
+                                "message": errors.get(id, "No Data found")})
+        logger.info({
+            "event": "batch_update_students_success",
+            "endpoint": "/v2/students:batchUpdate",
+            "method": "POST",
+            "updated": len(updated)
+        })
+        return JSONResponse(content={"results": results})
+    except Exception as e:
+        logger.error({
+            "event": "batch_update_students_error",
+            "endpoint": "/v2/students:batchUpdate",
+            "method": "POST",
+            "error": str(e)
+        })
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+
+
+@version_v2.post("/students:batchDelete", status_code=200)
+async def batch_delete_students(body: StudentIds) -> dict:
+    """
+    Delete many students in one statement. Returns one result per
+    requested ID, in request order.
+    """
+    try:
+        logger.info({
+            "event": "batch_delete_students_start",
+            "endpoint": "/v2/students:batchDelete",
+            "method": "POST",
+            "count": len(body.ids)
+        })
+        ids = list(dict.fromkeys(body.ids))
+        res = await delete_students_batch(ids)
+        if res['status'] != "success":
+            logger.error({
+                "event": "batch_delete_students_failure",
+                "endpoint": "/v2/students:batchDelete",
+                "method": "POST",
+                "error": res['message']
+            })
+            return JSONResponse(status_code=400,
+                                content={"detail": res['message']})
+        deleted = res['deleted']
+        results = [
+            {"id": id, "status": "success",
+             "message": "Student deleted successfully"}
+            if id in deleted else
+            {"id": id, "status": "error", "message": "Student not found"}
+            for id in ids]
+        logger.info({
+            "event": "batch_delete_students_success",
+            "endpoint": "/v2/students:batchDelete",
+            "method": "POST",
+            "deleted": len(deleted)
+        })
+        return JSONResponse(content={"results": results})
+    except Exception as e:
+        logger.error({
+            "event": "batch_delete_students_error",
+            "endpoint": "/v2/students:batchDelete",
+            "method": "POST",
+            "error": str(e)
+        })
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+
+
+@version_v2.get("/students/changes", status_code=200)
+async def student_changes(
+        since: Optional[str] = None,
+        limit: int = Query(default=CHANGES_PAGE_SIZE, ge=1,
+                           le=MAX_PAGE_SIZE),
+        wait: float = Query(default=0, ge=0, le=CHANGES_MAX_WAIT)) -> dict:
+    """
+    Student inserts, updates and deletes after the `since` cursor, oldest
+    first, each with the student's current row. Pass back `next_cursor`
+    to continue. With `wait`, an empty result is held open for up to that
+    many seconds until a change arrives (long poll).
+    """
+    try:
+        logger.info({
+            "event": "student_changes_start",
+            "endpoint": "/v2/students/changes",
+            "method": "GET"
+        })
+        try:
+            after = parse_cursor(since)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"detail": str(e)})
+
+        deadline = time.monotonic() + wait
+        while True:
+            res = await get_changes(after, limit)
+            remaining = deadline - time.monotonic()
+            if res['status'] != "success" or res['changes'] \
+                    or remaining <= 0:
+                break
+            await change_notifier.wait(remaining)
+
+        if res['status'] == "success":
+            changes = res['changes']
+            logger.info({
+                "event": "student_changes_success",
+                "endpoint": "/v2/students/changes",
+                "method": "GET",
+                "change_count": len(changes)
+            })
+            return JSONResponse(content={
+                "changes": changes,
+                "next_cursor": changes[-1]["cursor"] if changes
+                else "%d:%d" % after,
+                "has_more": res['has_more']})
+        elif res['status'] == "expired":
+            logger.warning({
+                "event": "student_changes_expired",
+                "endpoint": "/v2/students/changes",
+                "method": "GET",
+                "horizon": res['horizon']
+            })
+            return JSONResponse(status_code=410, content={
+                "detail": res['message'], "horizon": res['horizon']})
+        else:
+            logger.error({
+                "event": "student_changes_failure",
+                "endpoint": "/v2/students/changes",
+                "method": "GET",
+                "error": res['message']
+            })
+            return JSONResponse(status_code=400,
+                                content={"detail": res['message']})
+    except Exception as e:
+        logger.error({
+            "event": "student_changes_error",
+            "endpoint": "/v2/students/changes",
+            "method": "GET",
+            "error": str(e)
+        })
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+
+
+async def change_events(request: Request, after):
+    """
+    Server-Sent Events for every change after `after`. Each event's id is
+    its cursor, so a reconnecting EventSource resumes via Last-Event-ID.
+    """
+    while not await request.is_disconnected():
+        res = await get_changes(after, CHANGES_PAGE_SIZE)
+        if res['status'] != "success":
+            yield f"event: error\ndata: {dumps_str(res['message'])}\n\n"
+            return
+        for change in res['changes']:
+            yield (f"id: {change['cursor']}\nevent: {change['op']}\n"
+                   f"data: {dumps_str(change)}\n\n")
+        if res['changes']:
+            after = parse_cursor(res['changes'][-1]['cursor'])
+        if not res['has_more'] and not await change_notifier.wait(
+                CHANGES_MAX_WAIT):
+            # Comment line keeps proxies from closing an idle stream
+            yield ": keep-alive\n\n"
+
+
+@version_v2.get("/students/changes/stream", status_code=200)
+async def student_change_stream(
+        request: Request, since: Optional[str] = None,
+        last_event_id: Optional[str] = Header(default=None)):
+    """
+    The change feed as a Server-Sent-Events stream, starting after
+    `since` or the Last-Event-ID header of a reconnecting client.
+    """
+    try:
+        after = parse_cursor(last_event_id or since)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    # Refused before the stream starts: EventSource gives up on a 410
+    # instead of reconnecting with the same Last-Event-ID
+    horizon = await get_change_horizon(after)
+    if horizon['status'] == "expired":
+        return JSONResponse(status_code=410, content={
+            "detail": horizon['message'], "horizon": horizon['horizon']})
+    logger.info({
+        "event": "student_change_stream_start",
+        "endpoint": "/v2/students/changes/stream",
+        "method": "GET"
+    })
+    return StreamingResponse(change_events(request, after),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
 @version_v1.get("/HealthCheck", status_code=200)
 async def HealthCheck() -> dict:
     """
     Performs a comprehensive health check on critical components.
     Returns status of database connectivity and application uptime.
+    The database status comes from the background health checker, with
+    the probe latency and connection pool statistics.
     """
+    database = health_checker.database_status()
+    if db_students.router is not None:
+        database["replicas"] = [
+            {"name": r.name, "available": r.healthy, "lag_seconds": r.lag}
+            for r in db_students.router.replicas]
+    healthy = database["status"] == "healthy"
     health_status = {
-        "status": "healthy",
+        "status": "healthy" if healthy else "unhealthy",
         "components": {
-            "database": {"status": "unknown", "details": ""},
+            "database": database,
             "application": {"status": "up",
                             "uptime_seconds":
-                            int(time.time() - app.start_time)}
+                            int(time.time() - app.start_time),
+                            "startup": startup.report()}
         }
     }
+    return JSONResponse(status_code=200 if healthy else 503,
+                        content=health_status)
 
-    # Check database connectivity
-    try:
-        conn = psycopg2.connect(
-            database=os.getenv('POSTGRES_DB'),
-            user=os.getenv('POSTGRES_USER'),
-            password=os.getenv('POSTGRES_PASSWORD'),
-            host=os.getenv('POSTGRES_HOST'),
-        )
-        cur = conn.cursor()
-        cur.execute("SELECT 1;")
-        cur.close()
-        conn.close()
-        health_status["components"]["database"]["status"] = "healthy"
-        return JSONResponse(status_code=200, content=health_status)
-    except psycopg2.Error as e:
-        health_status["status"] = "unhealthy"
-        health_status["components"]["database"]["status"] = "unhealthy"
-        health_status["components"]["database"]["details"] = str(e)
-        logger.error({
-            "event": "health_check_db_error",
-            "endpoint": "/HealthCheck",
-            "method": "GET",
-            "error": str(e)
-        })
-        return JSONResponse(status_code=503, content=health_status)
+
+@version_v1.get("/livez", status_code=200)
+async def liveness() -> dict:
+    """
+    Liveness probe: the process is up and its event loop is responsive.
+    Never touches the database.
+    """
+    return JSONResponse(content={
+        "status": "up",
+        "uptime_seconds": int(time.time() - app.start_time)})
+
+
+@version_v1.get("/readyz", status_code=200)
+async def readiness() -> dict:
+    """
+    Readiness probe: the last background database check succeeded.
+    """
+    database = health_checker.database_status()
+    ready = database["status"] == "healthy"
+    return JSONResponse(status_code=200 if ready else 503, content={
+        "status": "ready" if ready else "not ready",
+        "database": database})
 
 
 # Expose Prometheus metrics endpoint
@@ -429,13 +1161,29 @@ async def metrics():
     """
     Expose Prometheus metrics for scraping.
     """
-    from prometheus_client import generate_latest
-    return Response(content=generate_latest(), media_type="text/plain")
+    return Response(content=generate_metrics(), media_type="text/plain")
+
+
+@app.get("/debug/profiles/{profile_id}", include_in_schema=False)
+def get_profile(profile_id: str, request: Request):
+    """
+    A saved request profile as collapsed stacks, for flamegraph.pl or
+    speedscope. Needs the X-Debug-Token header; 404 without it.
+    """
+    stacks = None
+    if debug_authorized(request.headers.raw, DEBUG_TOKEN):
+        stacks = profile_store.load(profile_id)
+    if stacks is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(content=stacks, media_type="text/plain")
 
 
 app.include_router(version_v1, tags=['Version 1 Api Endpoints'])
 app.include_router(version_v2, prefix='/v2', tags=['Version 2 Api Endpoints'])
 
+startup.mark("imported")
+
 if __name__ == "__main__":
+    import uvicorn
     port = int(os.getenv("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,120 @@
+"""
+Bulk student ingest for the /v2/students/bulk endpoint.
+Parses JSON array, NDJSON or CSV uploads, validates rows in batches
+against the Student schema and writes every batch with one multi-row
+INSERT in its own transaction.
+"""
+
+import csv
+import io
+from itertools import islice
+
+from pydantic import ValidationError
+
+import db_students
+from serialization import JSONDecodeError, loads
+
+# Accepted request content types and the parser used for each
+MEDIA_FORMATS = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "text/csv": "csv",
+}
+
+
+class _RowError:
+    """A record that could not be parsed; carries the reason."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def media_format(content_type):
+    """Map a Content-Type header to a parser name, or None."""
+    if not content_type:
+        return None
+    return MEDIA_FORMATS.get(content_type.split(";")[0].strip().lower())
+
+
+def iter_records(fileobj, fmt):
+    """
+    Yield raw records from an uploaded binary file. JSON arrays are
+    parsed in one go; NDJSON and CSV are read line by line.
+    """
+    if fmt == "json":
+        payload = loads(fileobj.read())
+        if not isinstance(payload, list):
+            raise ValueError("Expected a JSON array of students")
+        yield from payload
+        return
+    text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="")
+    if fmt == "ndjson":
+        for line in text:
+            if not line.strip():
+                continue
+            try:
+                yield loads(line)
+            except JSONDecodeError as e:
+                yield _RowError(f"Invalid JSON: {e}")
+    else:
+        yield from csv.DictReader(text, restkey="_extra")
+
+
+def _validate(record, model):
+    if isinstance(record, _RowError):
+        return None, [record.message]
+    try:
+        return model.model_validate(record), None
+    except ValidationError as e:
+        return None, [(" -> ".join(str(i) for i in error["loc"]) or "row")
+                      + f": {error['msg']}" for error in e.errors()]
+
+
+def ingest_students(fileobj, fmt, model, chunk_size=1000):
+    """
+    Validate and insert every record of the upload, `chunk_size` rows per
+    transaction. Returns the assigned ID for every row (None if rejected)
+    and a per-row error list; row numbers are 0-based upload positions.
+    """
+    records = iter_records(fileobj, fmt)
+    student_ids = []
+    errors = []
+    while True:
+        batch = list(islice(records, chunk_size))
+        if not batch:
+            break
+        base = len(student_ids)
+        batch_ids = [None] * len(batch)
+        batch_errors = {}
+        valid, positions = [], []
+        for offset, record in enumerate(batch):
+            student, problems = _validate(record, model)
+            if problems:
+                batch_errors[offset] = problems
+            else:
+                valid.append(student)
+                positions.append(offset)
+
+        if valid:
+            res = db_students.insert_students_bulk(valid)
+            if res["status"] == "success":
+                for offset, student_id in zip(positions,
+                                              res["student_ids"]):
+                    batch_ids[offset] = student_id
+                for index, message in res["errors"].items():
+                    batch_errors[positions[index]] = [message]
+            else:
+                for offset in positions:
+                    batch_errors[offset] = [res["message"]]
+
+        student_ids.extend(batch_ids)
+        errors.extend({"row": base + offset, "errors": problems}
+                      for offset, problems in sorted(batch_errors.items()))
+
+    return {
+        "inserted": len(student_ids) - len(errors),
+        "failed": len(errors),
+        "student_ids": student_ids,
+        "errors": errors,
+    }
@@ -0,0 +1,175 @@
+"""
+Change feed support: cursors, LISTEN/NOTIFY wake-ups and retention.
+The student_changes log (migration V1.3) is paged by a (txid, seq)
+cursor, rendered as "txid:seq". Long-poll and Server-Sent-Events readers
+wait on a ChangeNotifier instead of re-querying in a tight loop. A
+ChangeLogPruner keeps the log to a retention period; cursors older than
+what it kept are refused as expired (migration V1.5).
+"""
+
+import asyncio
+import os
+
+import psycopg2
+from anyio import to_thread
+from loguru import logger
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+import db_students
+
+CHANNEL = "student_changes"
+
+
+def parse_cursor(value):
+    """(txid, seq) from a "txid:seq" cursor; (0, 0) when empty."""
+    if not value:
+        return (0, 0)
+    try:
+        txid, seq = value.split(":")
+        cursor = (int(txid), int(seq))
+    except ValueError:
+        raise ValueError(f"Malformed change cursor: {value}") from None
+    if min(cursor) < 0:
+        raise ValueError(f"Malformed change cursor: {value}")
+    return cursor
+
+
+class ChangeNotifier:
+    """
+    Wakes waiting requests when Postgres signals a student change.
+
+    Holds one LISTEN connection per worker, outside the pool, and reads
+    it from the event loop. It is opened on the first wait. While it is
+    down, waiters simply re-check every `poll_interval` seconds.
+    """
+
+    def __init__(self, poll_interval=5.0):
+        self.poll_interval = poll_interval
+        self._changed = None
+        self._task = None
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def start(self):
+        if self._task is None:
+            self._changed = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        conn = await to_thread.run_sync(db_students.connect)
+        try:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CHANNEL};")
+            # Changes made while we were not listening
+            self._wake()
+            readable = asyncio.Event()
+            fd = conn.fileno()
+            loop.add_reader(fd, readable.set)
+            try:
+                while True:
+                    await readable.wait()
+                    readable.clear()
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self._wake()
+            finally:
+                loop.remove_reader(fd)
+        finally:
+            conn.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+            except psycopg2.Error as e:
+                logger.warning({
+                    "event": "change_listener_error",
+                    "error": str(e)
+                })
+                await asyncio.sleep(self.poll_interval)
+
+    async def wait(self, timeout):
+        """
+        Wait up to `timeout` seconds for a change notification.
+        Returns True if woken by a notification.
+        """
+        self.start()
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(),
+                                   min(timeout, self.poll_interval))
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def build_change_notifier():
+    return ChangeNotifier(
+        poll_interval=float(os.getenv("CHANGES_POLL_INTERVAL", 5)))
+
+
+class ChangeLogPruner:
+    """
+    Deletes change log entries older than `retention_days` every
+    `interval` seconds. Every worker runs one; an advisory lock lets
+    only one of them prune at a time.
+    """
+
+    def __init__(self, retention_days, interval=3600.0):
+        self.retention_days = retention_days
+        self.interval = interval
+        self._task = None
+
+    async def prune(self):
+        res = await to_thread.run_sync(db_students.prune_changes,
+                                       self.retention_days)
+        if res["status"] != "success":
+            logger.warning({"event": "change_log_prune_error",
+                            "deleted": res["deleted"],
+                            "error": res["message"]})
+        elif res["deleted"]:
+            logger.info({"event": "change_log_pruned",
+                         "deleted": res["deleted"],
+                         "retention_days": self.retention_days})
+
+    async def _run(self):
+        while True:
+            await self.prune()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def build_change_pruner():
+    """A ChangeLogPruner, or None if CHANGES_RETENTION_DAYS is 0."""
+    retention_days = float(os.getenv("CHANGES_RETENTION_DAYS", 30))
+    if retention_days <= 0:
+        return None
+    return ChangeLogPruner(
+        retention_days,
+        interval=float(os.getenv("CHANGES_PRUNE_INTERVAL", 3600)))
@@ -0,0 +1,272 @@
+"""
+Negotiated response compression.
+Compresses JSON and NDJSON responses with zstd, brotli or gzip, whichever
+the client accepts first in the configured preference order. Bodies are
+compressed as they stream, flushing at every chunk, so paged cursors and
+chunked responses reach the client incrementally. zstd and brotli are
+optional dependencies; without them only gzip is offered.
+"""
+
+import time
+import zlib
+
+from anyio import to_thread
+
+from metrics import (COMPRESSION_INPUT_BYTES, COMPRESSION_OUTPUT_BYTES,
+                     COMPRESSION_SECONDS)
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+# Fast settings: on multi-MB lists these keep most of the size reduction
+# of the top levels for a fraction of their CPU time
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson",
+                      "text/csv", "text/plain")
+
+# Chunks at least this large are compressed on a worker thread, so a
+# multi-MB body does not stall the event loop
+THREAD_THRESHOLD = 256 * 1024
+
+
+class _Gzip:
+    def __init__(self):
+        self._z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._z.compress(data)
+
+    def flush(self):
+        return self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._z.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._b = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._b.process(data)
+
+    def flush(self):
+        return self._b.flush()
+
+    def finish(self):
+        return self._b.finish()
+
+
+class _Zstd:
+    def __init__(self):
+        self._z = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self._z.compress(data)
+
+    def flush(self):
+        return self._z.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._z.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+COMPRESSORS = {"gzip": _Gzip}
+if brotli is not None:
+    COMPRESSORS["br"] = _Brotli
+if zstandard is not None:
+    COMPRESSORS["zstd"] = _Zstd
+
+
+def available(preference):
+    """The encodings in `preference` that this process can produce."""
+    return tuple(e for e in preference if e in COMPRESSORS)
+
+
+def negotiate(accept_encoding, encodings):
+    """
+    The first of `encodings` that the Accept-Encoding header allows, or
+    None for an identity response.
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.strip().lower()] = q
+    wildcard = accepted.get("*", 0.0)
+    for encoding in encodings:
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+class Stream:
+    """
+    Compresses one response body chunk by chunk, recording bytes in and
+    out and the CPU time spent in Prometheus.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._compressor = COMPRESSORS[encoding]()
+
+    def _process(self, data, last):
+        start = time.thread_time()
+        out = self._compressor.compress(data)
+        out += self._compressor.finish() if last else \
+            self._compressor.flush()
+        COMPRESSION_SECONDS.labels(encoding=self.encoding).inc(
+            time.thread_time() - start)
+        COMPRESSION_INPUT_BYTES.labels(encoding=self.encoding).inc(len(data))
+        COMPRESSION_OUTPUT_BYTES.labels(encoding=self.encoding).inc(len(out))
+        return out
+
+    async def process(self, data, last=False):
+        """Compress `data`; `last` ends the stream."""
+        if len(data) >= THREAD_THRESHOLD:
+            return await to_thread.run_sync(self._process, data, last)
+        return self._process(data, last)
+
+
+async def compress(encoding, data):
+    """Compress a complete body."""
+    return await Stream(encoding).process(data, last=True)
+
+
+def weak_etag(value):
+    """
+    Weaken a strong ETag for a compressed representation. Conditional
+    reads compare weakly, so the tag still validates the identity body.
+    """
+    prefix = b"W/" if isinstance(value, bytes) else "W/"
+    if value and not value.startswith(prefix):
+        return prefix + value
+    return value
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses of a compressible type once they reach
+    `min_size` bytes. Short responses with a Content-Length are passed
+    through at once; streamed ones are buffered until they either reach
+    `min_size` or end. Responses that already carry a Content-Encoding,
+    such as pre-compressed cached bodies, are left alone, and so are
+    event streams, which must not be held back by a compressor.
+    """
+
+    def __init__(self, app, min_size=1024, encodings=("zstd", "br", "gzip")):
+        self.app = app
+        self.min_size = min_size
+        self.encodings = available(encodings)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = negotiate(accept, self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _Responder(send, encoding, self.min_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _Responder:
+    def __init__(self, send, encoding, min_size):
+        self._send = send
+        self.encoding = encoding
+        self.min_size = min_size
+        self.start = None
+        self.stream = None
+        self.passthrough = False
+        self.buffer = []
+        self.buffered = 0
+
+    def _eligible(self, message):
+        if message["status"] < 200 or message["status"] in (204, 304):
+            return False
+        content_type = b""
+        for name, value in message.get("headers", ()):
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value
+            if name == b"content-length" and int(value) < self.min_size:
+                return False
+        media_type = content_type.split(b";")[0].strip().decode("latin-1")
+        return media_type in COMPRESSIBLE_TYPES
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            if self._eligible(message):
+                self.start = message
+            else:
+                self.passthrough = True
+                await self._send(message)
+            return
+        if self.passthrough or message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.stream is None:
+            self.buffer.append(body)
+            self.buffered += len(body)
+            if self.buffered < self.min_size and more_body:
+                return
+            body = b"".join(self.buffer)
+            self.buffer = []
+            if self.buffered < self.min_size:
+                # Ended below the threshold: not worth compressing
+                self.passthrough = True
+                await self._send(self.start)
+                await self._send(message | {"body": body})
+                return
+            self.stream = Stream(self.encoding)
+            await self._send(self._compressed_start())
+        await self._send({
+            "type": "http.response.body",
+            "body": await self.stream.process(body, last=not more_body),
+            "more_body": more_body,
+        })
+
+    def _compressed_start(self):
+        headers = []
+        vary = None
+        for name, value in self.start.get("headers", ()):
+            if name == b"content-length":
+                continue
+            if name == b"etag":
+                value = weak_etag(value)
+            if name == b"vary":
+                vary = value
+                continue
+            headers.append((name, value))
+        headers.append((b"content-encoding", self.encoding.encode()))
+        headers.append((b"vary", vary + b", Accept-Encoding" if vary
+                        else b"Accept-Encoding"))
+        return self.start | {"headers": headers}
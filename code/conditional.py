@@ -0,0 +1,124 @@
+"""
+HTTP validators for student rows and lists.
+A row's ETag is its `version` column (migration V1.2), which a trigger
+bumps on every UPDATE, so clients can make writes conditional with
+If-Match instead of re-reading the row first. A list's ETag hashes the
+table version token from db_students.get_table_version together with
+the query that selected the rows.
+
+Reads honour If-None-Match, and If-Modified-Since against `updated_at`,
+with a 304 that is answered before anything is serialized.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi.responses import Response
+
+
+def etag(row):
+    """Strong ETag for a student row, or None if it has no version."""
+    version = row.get("version") if row else None
+    return None if version is None else f'"{version}"'
+
+
+# No row is ever at this version (they start at 1)
+NO_MATCH = 0
+
+
+def parse_if_match(value):
+    """
+    Expected row version from an If-Match header. Returns None when the
+    header is absent or "*", which only requires the row to exist, and
+    NO_MATCH for a weak ETag, which If-Match compares strongly and so
+    never matches (RFC 9110 13.1.1). Raises ValueError for anything that
+    is not one of our ETags.
+    """
+    if value is None or value.strip() == "*":
+        return None
+    tags = [tag.strip() for tag in value.split(",") if tag.strip()]
+    if len(tags) != 1:
+        raise ValueError("If-Match must name exactly one ETag")
+    tag = tags[0]
+    if tag.startswith("W/"):
+        return NO_MATCH
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        raise ValueError(f"Malformed ETag in If-Match: {tag}") from None
+
+
+def list_etag(table_version, *variant):
+    """Strong ETag for a list read at `table_version` with `variant`."""
+    key = "|".join(map(str, (table_version, *variant))).encode()
+    return f'"{hashlib.blake2b(key, digest_size=12).hexdigest()}"'
+
+
+def none_match(value, tag):
+    """
+    Whether If-None-Match `value` still matches `tag`, i.e. the client's
+    copy is current. Uses weak comparison, as RFC 9110 13.1.2 requires.
+    """
+    if value is None or tag is None:
+        return False
+    if value.strip() == "*":
+        return True
+    tags = (t.strip() for t in value.split(","))
+    return tag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+def last_modified(row):
+    """The row's `updated_at` as an aware datetime, or None."""
+    value = row.get("updated_at") if row else None
+    if isinstance(value, str):
+        # Rows from the shared cache tier come back as ISO strings
+        value = datetime.fromisoformat(value)
+    return value
+
+
+def http_date(value):
+    """Format a datetime as an HTTP-date (second resolution)."""
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def modified_since(value, modified):
+    """
+    Whether a row last modified at `modified` changed after the
+    If-Modified-Since date `value`. An absent or unparsable header counts
+    as modified, so the full response is sent.
+    """
+    if value is None or modified is None:
+        return True
+    try:
+        since = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return True
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return modified.replace(microsecond=0) > since
+
+
+def validators(tag=None, modified=None):
+    """ETag/Last-Modified headers; clients must revalidate before reuse."""
+    headers = {"Cache-Control": "no-cache"}
+    if tag is not None:
+        headers["ETag"] = tag
+    if modified is not None:
+        headers["Last-Modified"] = http_date(modified)
+    return headers
+
+
+def not_modified(if_none_match, if_modified_since, tag=None, modified=None):
+    """
+    A 304 response if the client's copy is current, else None.
+    If-Modified-Since is only consulted without If-None-Match.
+    """
+    if if_none_match is not None:
+        current = none_match(if_none_match, tag)
+    else:
+        current = (if_modified_since is not None
+                   and not modified_since(if_modified_since, modified))
+    if not current:
+        return None
+    return Response(status_code=304, headers=validators(tag, modified))
@@ -0,0 +1,188 @@
+"""
+Awaitable data-access layer for the FastAPI handlers.
+Runs the pooled psycopg2 operations from db_students on worker threads,
+so a slow query no longer freezes the event loop for every other request.
+"""
+
+import asyncio
+import random
+import time
+
+import anyio
+import psycopg2
+from anyio import to_thread
+from loguru import logger
+
+import db_students
+import profiler
+import replicas
+import request_timing
+from insert_batcher import build_insert_batcher
+from student_cache import build_student_cache
+
+_limiter = None
+student_cache = build_student_cache()
+
+
+def _get_limiter():
+    # One worker thread per pooled connection: threads beyond that would
+    # only queue inside the pool's checkout instead of on the limiter.
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(db_students.pool.maxconn)
+    return _limiter
+
+
+async def run_db(func, *args):
+    """Run a blocking db_students function without blocking the loop."""
+    if request_timing.current() is None and profiler.current() is None:
+        return await to_thread.run_sync(func, *args, limiter=_get_limiter())
+    queued = time.perf_counter()
+
+    def call():
+        # Time spent waiting for a worker thread counts as db_wait
+        request_timing.add("db_wait", time.perf_counter() - queued)
+        with profiler.worker():
+            return func(*args)
+    return await to_thread.run_sync(call, limiter=_get_limiter())
+
+
+async def open_pool(attempts=10, backoff=0.5, max_backoff=10.0):
+    """
+    Open the pool's initial connections, retrying with jittered
+    exponential backoff while the database is unreachable. Returns True
+    once connected, or False after `attempts` failures; queries still
+    connect on demand after that.
+    """
+    delay = backoff
+    for attempt in range(1, attempts + 1):
+        try:
+            await run_db(db_students.pool.open)
+            return True
+        except psycopg2.Error as e:
+            logger.warning({
+                "event": "db_connect_retry",
+                "attempt": attempt,
+                "attempts": attempts,
+                "error": str(e)
+            })
+        if attempt < attempts:
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, max_backoff)
+    logger.error({"event": "db_connect_failed", "attempts": attempts})
+    return False
+
+
+async def insert_students_group(students):
+    return await run_db(db_students.insert_students_group, students)
+
+
+insert_batcher = build_insert_batcher(insert_students_group)
+
+
+async def insertstudent(data):
+    if insert_batcher is None:
+        return await run_db(db_students.insertstudent, data)
+    # The batch commits outside this request's context, so record the
+    # write for read-your-writes routing here
+    replicas.mark_write()
+    return await insert_batcher.insert(data)
+
+
+async def get_all_students(fields=None, with_version=False):
+    return await run_db(db_students.get_all_students, fields, with_version)
+
+
+async def get_students_page(limit, after=None, fields=None,
+                            with_version=False):
+    return await run_db(db_students.get_students_page, limit, after, fields,
+                        with_version)
+
+
+async def search_students(email=None, phone=None, name=None,
+                          match="prefix", limit=50, after=None, fields=None):
+    return await run_db(db_students.search_students, email, phone, name,
+                        match, limit, after, fields)
+
+
+async def open_student_stream(fields=None, after=None, batch_size=1000,
+                              with_version=False):
+    """
+    Start a server-side cursor over the students table and fetch its
+    first batch, so query errors surface before a response is started.
+    Returns (first_batch, remaining_batches_iterator, table_version),
+    the version being None unless `with_version` is set.
+    """
+    batches = db_students.iter_students(fields, after, batch_size,
+                                        with_version)
+    version = await run_db(next, batches) if with_version else None
+    first = await run_db(next, batches, [])
+    return first, batches, version
+
+
+async def get_student_by_Id(id):
+    # A client reading its own write skips the cache, which may hold a
+    # row loaded from a lagging replica
+    if student_cache is None or replicas.pinned():
+        return await run_db(db_students.get_student_by_Id, id)
+
+    async def load():
+        res = await run_db(db_students.get_student_by_Id, id)
+        if res["status"] != "success":
+            return res, None
+        # Outside a routed request the serving server isn't recorded
+        state = replicas.current()
+        from_replica = db_students.router is not None and (
+            state is None or state.served_by is not None)
+        return ({"status": "success", "students": dict(res["students"])},
+                "replica" if from_replica else "primary")
+
+    return await student_cache.get_or_load(id, load)
+
+
+async def invalidate_students(*ids):
+    """Drop cached lookups for students changed by a write."""
+    if student_cache is not None:
+        for id in ids:
+            await student_cache.invalidate(id)
+
+
+async def Update_student(id, student, expected_version=None):
+    res = await run_db(db_students.Update_student, id, student,
+                       expected_version)
+    await invalidate_students(id)
+    return res
+
+
+async def delete_student(id):
+    res = await run_db(db_students.delete_student, id)
+    await invalidate_students(id)
+    return res
+
+
+async def get_students_by_ids(ids, fields=None):
+    return await run_db(db_students.get_students_by_ids, ids, fields)
+
+
+async def update_students_batch(patches):
+    res = await run_db(db_students.update_students_batch, patches)
+    await invalidate_students(*(id for id, _ in patches))
+    return res
+
+
+async def delete_students_batch(ids):
+    res = await run_db(db_students.delete_students_batch, ids)
+    await invalidate_students(*ids)
+    return res
+
+
+async def get_changes(after=(0, 0), limit=500):
+    return await run_db(db_students.get_changes, after, limit)
+
+
+async def get_change_horizon(after):
+    return await run_db(db_students.get_change_horizon, after)
+
+
+async def get_table_version():
+    return await run_db(db_students.get_table_version)
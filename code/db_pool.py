@@ -0,0 +1,176 @@
+"""
+Connection pool for the student database.
+Keeps a bounded set of psycopg2 connections with checkout timeouts,
+health validation on checkout and reconnect-on-failure, so every
+database call can borrow its own connection and cursor.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from loguru import logger
+
+
+class PoolTimeout(pg_pool.PoolError):
+    """Raised when no connection could be checked out in time."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool.
+
+    At most `maxconn` connections exist at once; callers beyond that wait
+    up to `timeout` seconds for one to be returned. No connection is made
+    on construction: `open()` establishes `minconn` of them up front, and
+    otherwise connections are made on first checkout. Idle connections
+    are kept open for reuse.
+    A connection that sat idle for longer than `validate_after` seconds
+    is pinged before it is handed out, and broken connections are
+    discarded so the next checkout reconnects.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=5.0, validate_after=30.0,
+                 **connect_kwargs):
+        if not 0 <= minconn <= maxconn or maxconn < 1:
+            raise ValueError("expected 0 <= minconn <= maxconn, maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.validate_after = validate_after
+        self._connect_kwargs = connect_kwargs
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._idle = deque()
+        self._closed = False
+        self._in_use = 0
+        self._checkouts = 0
+        self._wait_seconds = 0.0
+
+    def _connect(self):
+        return psycopg2.connect(**self._connect_kwargs)
+
+    def open(self):
+        """
+        Top the idle connections up to `minconn`. Raises psycopg2.Error if
+        the database cannot be reached; connections made so far are kept.
+        """
+        while True:
+            with self._lock:
+                if self._closed or (len(self._idle) + self._in_use
+                                    >= self.minconn):
+                    return
+            conn = self._connect()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.validate_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Discarding broken pooled connection: {e}")
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self, timeout=None):
+        """
+        Check out a healthy connection, waiting up to the pool's `timeout`
+        or the shorter `timeout` given here.
+        """
+        if self._closed:
+            raise pg_pool.PoolError("connection pool is closed")
+        if timeout is None or timeout > self.timeout:
+            timeout = self.timeout
+        wait_start = time.perf_counter()
+        acquired = self._slots.acquire(timeout=max(0.0, timeout))
+        with self._lock:
+            self._wait_seconds += time.perf_counter() - wait_start
+            if acquired:
+                self._checkouts += 1
+                self._in_use += 1
+        if not acquired:
+            raise PoolTimeout(
+                f"No database connection available after {timeout:.3g}s")
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    return self._connect()
+                conn, idle_since = entry
+                if self._is_healthy(conn, idle_since):
+                    return conn
+                self._close(conn)
+        except BaseException:
+            self._release_slot()
+            raise
+
+    def _release_slot(self):
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
+
+    def putconn(self, conn, broken=False):
+        """Return a connection; broken or closed ones are dropped."""
+        try:
+            if broken or conn.closed or self._closed:
+                self._close(conn)
+                return
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._release_slot()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Borrow a connection for the duration of the block.
+        Uncommitted work is rolled back before the connection is returned.
+        """
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            broken = bool(conn.closed)
+            if not broken:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            self.putconn(conn, broken=broken)
+
+    def stats(self):
+        """Point-in-time pool usage plus cumulative checkout wait."""
+        with self._lock:
+            return {
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "max": self.maxconn,
+                "checkouts": self._checkouts,
+                "wait_seconds_total": round(self._wait_seconds, 6),
+                "avg_wait_ms": round(
+                    self._wait_seconds * 1000 / self._checkouts, 3)
+                if self._checkouts else 0.0,
+            }
+
+    def closeall(self):
+        self._closed = True
+        with self._lock:
+            while self._idle:
+                self._close(self._idle.pop()[0])
@@ -5,11 +5,23 @@ Provides functions for insert, update, delete, and retrieve operations.
 """
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor, execute_values
 import os
+import time
+from contextlib import ExitStack, contextmanager
+from functools import wraps
 from dotenv import load_dotenv
 from loguru import logger
-import json
+from db_pool import ConnectionPool
+import deadlines
+import list_cache
+import replicas
+import request_timing
+import statements
+from query_log import build_slow_query_log
+from statements import PreparingConnection
+from metrics import DB_OPERATION_LATENCY
 
 load_dotenv()
 
@@ -19,83 +31,523 @@ db_password = os.getenv('POSTGRES_PASSWORD')
 db_host = os.getenv('POSTGRES_HOST')
 db_port = os.getenv('POSTGRES_PORT')
 
-if not all([db_name, db_user, db_password, db_host, db_port]):
-    logger.error("""One or more required
-                    environment variables are not set or empty.""")
-    exit(1)
 
+def check_settings():
+    """
+    Raise RuntimeError naming any required POSTGRES_* variable that is
+    not set. Checked at app startup rather than on import, so importing
+    this module never needs a database configuration.
+    """
+    missing = [name for name, value in (
+        ('POSTGRES_DB', db_name), ('POSTGRES_USER', db_user),
+        ('POSTGRES_PASSWORD', db_password), ('POSTGRES_HOST', db_host),
+        ('POSTGRES_PORT', db_port)) if not value]
+    if missing:
+        raise RuntimeError("Required environment variables are not set: "
+                           + ", ".join(missing))
 
-# Configure logger
-def serialize(record):
-    subset = {
-        "timestamp": record["time"].strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
-        "message": record["message"],
-        "level": record["level"].name,
-        "function": record["function"],
-        "line": record["line"],
-        "file": record["file"].name,
-        "module": record["module"]
-    }
-    return json.dumps(subset)
 
+# Columns a client may request through a projection
+STUDENT_FIELDS = ("id", "name", "email", "age", "phone", "version",
+                  "updated_at")
 
-def patching(record):
-    record["extra"]["serialized"] = serialize(record)
+# Explicit columns rather than *, so a prepared plan keeps its result
+# shape when a migration adds a column
+SELECT_STUDENT = f"""
+        SELECT {', '.join(STUDENT_FIELDS)} FROM students WHERE ID = %s;
+        """
+
+
+def pool_size():
+    """
+    (min, max) connections for this process. With a total
+    POSTGRES_CONNECTION_BUDGET, each of the WEB_CONCURRENCY workers gets
+    an equal share of it instead of POSTGRES_POOL_MAX.
+    """
+    maxconn = int(os.getenv('POSTGRES_POOL_MAX', 10))
+    budget = os.getenv('POSTGRES_CONNECTION_BUDGET')
+    if budget:
+        workers = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+        maxconn = max(1, int(budget) // workers)
+    return min(int(os.getenv('POSTGRES_POOL_MIN', 1)), maxconn), maxconn
 
 
-conn = psycopg2.connect(
+def _make_pool(host, port):
+    return ConnectionPool(
+            minconn=pool_min,
+            maxconn=pool_max,
+            timeout=float(os.getenv('POSTGRES_POOL_TIMEOUT', 5)),
+            validate_after=float(
+                os.getenv('POSTGRES_POOL_VALIDATE_AFTER', 30)),
             database=db_name,
             user=db_user, password=db_password,
-            host=db_host, port=db_port)
+            host=host, port=port,
+            connection_factory=PreparingConnection)
+
+
+# Connects lazily: nothing touches the database until the app lifespan
+# calls open_pool() or the first query checks out a connection
+pool_min, pool_max = pool_size()
+pool = _make_pool(db_host, db_port)
+
+# Optional streaming replicas for reads, as "host[:port],..." sharing the
+# primary's database and credentials; each gets a pool of its own
+router = None
+_replica_hosts = replicas.parse_hosts(os.getenv('POSTGRES_REPLICA_HOSTS'),
+                                      db_port or "5432")
+if _replica_hosts:
+    router = replicas.ReplicaRouter(
+        [replicas.Replica(f"{host}:{port}", _make_pool(host, port))
+         for host, port in _replica_hosts],
+        os.getenv('POSTGRES_REPLICA_SELECTION', 'round_robin'))
+
+# Prepared statements kept per pooled connection (0 sends plain SQL)
+STATEMENT_CACHE_SIZE = int(os.getenv('POSTGRES_STATEMENT_CACHE_SIZE', 64))
+
+slow_queries = build_slow_query_log()
+
+
+def connect():
+    """
+    A new connection outside the pool, for long-lived sessions such as
+    the change feed's LISTEN connection.
+    """
+    return psycopg2.connect(database=db_name, user=db_user,
+                            password=db_password, host=db_host,
+                            port=db_port)
+
+
+class _DeadlineCursor(RealDictCursor):
+    """
+    RealDictCursor that sends a pending SET LOCAL statement_timeout in
+    the same round trip as its first query. Statement and row-building
+    time are added to the request's Server-Timing, and statements are
+    checked against the slow-query log.
+    """
+
+    pending = None
+
+    def execute(self, query, vars=None):
+        statement = query
+        prefix, self.pending = self.pending, None
+        if prefix:
+            if isinstance(query, sql.Composable):
+                query = statement = query.as_string(self)
+            if isinstance(query, bytes):
+                prefix = prefix.encode()
+            query = prefix + query
+        start_time = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except psycopg2.Error:
+            self._observe(statement, vars, start_time, failed=True)
+            raise
+        self._observe(statement, vars, start_time)
+        return result
+
+    def fetchone(self):
+        with request_timing.timed("fetch"):
+            return super().fetchone()
+
+    def fetchmany(self, size=None):
+        with request_timing.timed("fetch"):
+            return super().fetchmany(size)
+
+    def fetchall(self):
+        with request_timing.timed("fetch"):
+            return super().fetchall()
+
+    def _observe(self, statement, vars, start_time, failed=False):
+        elapsed = time.perf_counter() - start_time
+        request_timing.add("db", elapsed)
+        if slow_queries is not None:
+            slow_queries.record(self, statement, vars, elapsed, failed)
+
+
+def _timeout_statement():
+    """SET LOCAL bounding a transaction by the request's deadline."""
+    timeout_ms = deadlines.statement_timeout_ms()
+    if timeout_ms is None:
+        return None
+    return f"SET LOCAL statement_timeout = {timeout_ms}; "
+
 
-cur = conn.cursor(cursor_factory=RealDictCursor)
+@contextmanager
+def _connection(read=False):
+    """
+    Borrow a pooled connection: from a replica for a `read` when one is
+    available, else from the primary. A replica that cannot be reached
+    is ejected and the read falls back to the primary.
+    """
+    with ExitStack() as stack:
+        with request_timing.timed("db_wait"):
+            conn = None
+            replica = router.for_read() if read and router else None
+            if replica is not None:
+                try:
+                    conn = stack.enter_context(
+                        replica.pool.connection(deadlines.remaining()))
+                except psycopg2.OperationalError as e:
+                    router.eject(replica, str(e).strip())
+                    replica = None
+            if conn is None:
+                conn = stack.enter_context(
+                    pool.connection(deadlines.remaining()))
+        if read:
+            replicas.served(replica)
+        yield conn
 
 
+@contextmanager
+def get_cursor(read=False):
+    """
+    Borrow a pooled connection and a fresh cursor for one operation.
+    Any uncommitted work is rolled back when the block exits. Inside a
+    request with a deadline, the checkout wait and statement_timeout
+    are capped by the time the request has left. `read` operations may
+    be served by a replica.
+    """
+    with _connection(read) as conn:
+        with conn.cursor(cursor_factory=_DeadlineCursor) as cur:
+            cur.pending = _timeout_statement()
+            yield conn, cur
+
+
+def execute(cur, query, params=()):
+    """Run `query` through this connection's prepared statement cache."""
+    statements.execute(cur, query, params, STATEMENT_CACHE_SIZE)
+
+
+def observe_db(operation):
+    """Record the wall time of a database operation in Prometheus."""
+    histogram = DB_OPERATION_LATENCY.labels(operation=operation)
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+
+def writes(func):
+    """
+    Bookkeeping for a write: pin the request's reads to the primary, and
+    drop the cached full-list body once the write has run.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        replicas.mark_write()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            list_cache.invalidate()
+    return wrapper
+
+
+def ping():
+    """
+    Round trip a trivial query on a pooled connection.
+    Raises psycopg2.Error (including PoolTimeout) on failure.
+    """
+    with get_cursor() as (conn, cur):
+        cur.execute("SELECT 1;")
+        cur.fetchone()
+
+
+@observe_db("insert_student")
+@writes
 def insertstudent(data: dict):
     try:
         insert_query = """INSERT INTO students (name, email, age, phone)
                         VALUES (%s, %s, %s, %s) RETURNING ID;"""
-        cur.execute(insert_query, (data.name, data.email,
-                                   data.age, data.phone))
-        student_id = cur.fetchone()
-        conn.commit()
+        with get_cursor() as (conn, cur):
+            execute(cur, insert_query, (data.name, data.email,
+                                        data.age, data.phone))
+            student_id = cur.fetchone()
+            conn.commit()
         return {"status": "success", "message":
                 "Student inserted successfully", "student_id": student_id}
+    except psycopg2.errors.UniqueViolation:
+        return {"status": "error", "message":
+                "A student with this email already exists"}
     except psycopg2.Error as e:
-        conn.rollback()
         logger.error(f'error:"{str(e)}')
         return {"status": "error", "message":
                 "An unexpected error occurred. Please contact support."}
 
 
-def get_all_students():
+def _projection(fields):
+    """
+    SELECT list for the requested fields. ID is always included because
+    it is the keyset cursor for pagination.
+    """
+    if not fields:
+        return sql.SQL("*")
+    columns = ["id"] + [f for f in fields if f != "id"]
+    return sql.SQL(", ").join(sql.Identifier(c) for c in columns)
+
+
+INSERT_STUDENTS = """INSERT INTO students (name, email, age, phone)
+                VALUES %s RETURNING ID;"""
+
+
+def _insert_rows(conn, cur, students):
+    """
+    Insert students in one transaction with a single multi-row INSERT.
+    If that fails, rows are retried one by one behind savepoints so only
+    the offending rows are rejected. Commits, and returns the new IDs
+    (None for rejected rows) and {position: exception}.
+    """
+    values = [(s.name, s.email, s.age, s.phone) for s in students]
     try:
-        select_query = """
-        SELECT * from  students;
-        """
-        cur.execute(select_query)
-        students = cur.fetchall()
+        rows = execute_values(cur, INSERT_STUDENTS, values,
+                              page_size=len(values), fetch=True)
         conn.commit()
+        return [row["id"] for row in rows], {}
+    except (psycopg2.DataError, psycopg2.IntegrityError):
+        conn.rollback()
+        # The retry is a new transaction: bound it by the deadline again
+        cur.pending = _timeout_statement()
+
+    student_ids, errors = [], {}
+    for position, row in enumerate(values):
+        cur.execute("SAVEPOINT bulk_row;")
+        try:
+            inserted = execute_values(cur, INSERT_STUDENTS, [row],
+                                      fetch=True)
+            cur.execute("RELEASE SAVEPOINT bulk_row;")
+            student_ids.append(inserted[0]["id"])
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            cur.execute("ROLLBACK TO SAVEPOINT bulk_row;")
+            student_ids.append(None)
+            errors[position] = e
+    conn.commit()
+    return student_ids, errors
+
+
+@observe_db("insert_students_bulk")
+@writes
+def insert_students_bulk(students):
+    """
+    Insert a chunk of validated students in one transaction.
+    Returns the new IDs (None for rejected rows) and {position: error}.
+    """
+    try:
+        with get_cursor() as (conn, cur):
+            student_ids, errors = _insert_rows(conn, cur, students)
+        return {"status": "success", "student_ids": student_ids,
+                "errors": {position: e.diag.message_primary or str(e)
+                           for position, e in errors.items()}}
+    except psycopg2.Error as e:
+        logger.error(f'error:"{str(e)}')
+        return {"status": "error", "message":
+                "An unexpected error occurred. Please contact support."}
+
+
+@observe_db("insert_students_group")
+@writes
+def insert_students_group(students):
+    """
+    Insert the students of concurrent AddStudent calls gathered by the
+    insert batcher, with one statement and one commit. Returns one
+    insertstudent-style result per student, in order.
+    """
+    try:
+        with get_cursor() as (conn, cur):
+            student_ids, errors = _insert_rows(conn, cur, students)
+    except psycopg2.Error as e:
+        logger.error(f'error:"{str(e)}')
+        return [{"status": "error", "message":
+                 "An unexpected error occurred. Please contact support."}
+                for _ in students]
+    results = []
+    for position, student_id in enumerate(student_ids):
+        error = errors.get(position)
+        if error is None:
+            results.append({"status": "success", "message":
+                            "Student inserted successfully",
+                            "student_id": {"id": student_id}})
+        elif isinstance(error, psycopg2.errors.UniqueViolation):
+            results.append({"status": "error", "message":
+                            "A student with this email already exists"})
+        else:
+            logger.error(f'error:"{str(error)}')
+            results.append({"status": "error", "message":
+                            "An unexpected error occurred. "
+                            "Please contact support."})
+    return results
+
+
+@observe_db("get_all_students")
+def get_all_students(fields=None, with_version=False):
+    """
+    Every student. With `with_version` the result also carries the
+    get_table_version token, read in the same transaction before the
+    rows.
+    """
+    try:
+        select_query = sql.SQL("""
+        SELECT {columns} from  students;
+        """).format(columns=_projection(fields))
+        version = None
+        with get_cursor(read=True) as (conn, cur):
+            if with_version:
+                version = _table_version(cur)
+            cur.execute(select_query)
+            students = cur.fetchall()
+            conn.commit()
         if len(students) > 0 or students is None:
             return {"status": "success", "message":
-                    "Student inserted successfully", "students": students}
+                    "Student inserted successfully", "students": students,
+                    "version": version}
         else:
             return {"status": "error", "message": "No Data Present"}
     except psycopg2.Error as e:
-        conn.rollback()
         logger.error(f'error:"{str(e)}')
         return {"status": "error", "message":
                 "An unexpected error occurred. Please contact support."}
 
 
-def get_student_by_Id(id):
+@observe_db("get_students_page")
+def get_students_page(limit, after=None, fields=None, with_version=False):
+    """
+    Keyset pagination on ID: returns up to `limit` students with
+    ID > `after` and the cursor for the next page (None on the last page).
+    `with_version` adds the table version, as in get_all_students.
+    """
     try:
-        select_query = """
-        SELECT * FROM students WHERE ID = %s;
-        """
-        cur.execute(select_query, (id,))
-        students = cur.fetchone()
+        select_query = sql.SQL("""
+        SELECT {columns} FROM students WHERE ID > %s
+        ORDER BY ID LIMIT %s;
+        """).format(columns=_projection(fields or STUDENT_FIELDS))
+        version = None
+        with get_cursor(read=True) as (conn, cur):
+            if with_version:
+                version = _table_version(cur)
+            # Fetch one extra row to learn whether another page exists.
+            execute(cur, select_query.as_string(conn),
+                    (after or 0, limit + 1))
+            students = cur.fetchall()
+            conn.commit()
+        next_after = None
+        if len(students) > limit:
+            students = students[:limit]
+            next_after = students[-1]["id"]
+        return {"status": "success", "students": students,
+                "next_after": next_after, "version": version}
+    except psycopg2.Error as e:
+        logger.error(f'error:"{str(e)}')
+        return {"status": "error", "message":
+                "An unexpected error occurred. Please contact support."}
+
+
+def iter_students(fields=None, after=None, batch_size=1000,
+                  with_version=False):
+    """
+    Yield students in ID order as lists of at most `batch_size` rows,
+    read from a server-side cursor so memory stays constant regardless
+    of table size. The pooled connection is held until the generator
+    is exhausted or closed. With `with_version` the first item yielded
+    is the table version, read in the same transaction.
+    """
+    select_query = sql.SQL("""
+    SELECT {columns} FROM students WHERE ID > %s ORDER BY ID;
+    """).format(columns=_projection(fields))
+    with _connection(read=True) as conn:
+        timeout = _timeout_statement()
+        if timeout:
+            with conn.cursor() as setup:
+                setup.execute(timeout)
+        if with_version:
+            with conn.cursor(cursor_factory=_DeadlineCursor) as setup:
+                version = _table_version(setup)
+            yield version
+        with conn.cursor(name="students_stream",
+                         cursor_factory=RealDictCursor) as cur:
+            cur.itersize = batch_size
+            cur.execute(select_query, (after or 0,))
+            while True:
+                # Each batch runs under the deadline current when the
+                # consumer asks for it
+                timeout = _timeout_statement()
+                if timeout:
+                    with conn.cursor() as setup:
+                        setup.execute(timeout)
+                students = cur.fetchmany(batch_size)
+                if not students:
+                    break
+                yield students
         conn.commit()
+
+
+def _like_prefix(value):
+    """LIKE pattern matching strings that start with `value` literally."""
+    escaped = (value.replace("\\", "\\\\").replace("%", "\\%")
+               .replace("_", "\\_"))
+    return escaped + "%"
+
+
+@observe_db("search_students")
+def search_students(email=None, phone=None, name=None, match="prefix",
+                    limit=50, after=None, fields=None):
+    """
+    Students matching every given filter, paged by ID like
+    get_students_page. `email` (case-insensitive) and `phone` match
+    exactly; `name` matches by case-insensitive prefix or, with
+    match="fuzzy", by trigram similarity. Each filter is served by an
+    index from migration V1.1.
+    """
+    conditions = []
+    params = []
+    if email:
+        conditions.append("lower(email) = lower(%s)")
+        params.append(email)
+    if phone:
+        conditions.append("phone = %s")
+        params.append(phone)
+    if name:
+        if match == "fuzzy":
+            conditions.append("lower(name) %% lower(%s)")
+            params.append(name)
+        else:
+            conditions.append("lower(name) LIKE %s")
+            params.append(_like_prefix(name.lower()))
+    conditions.append("ID > %s")
+    params.extend([after or 0, limit + 1])
+    try:
+        select_query = sql.SQL("""
+        SELECT {columns} FROM students WHERE {conditions}
+        ORDER BY ID LIMIT %s;
+        """).format(columns=_projection(fields or STUDENT_FIELDS),
+                    conditions=sql.SQL(" AND ".join(conditions)))
+        with get_cursor(read=True) as (conn, cur):
+            execute(cur, select_query.as_string(conn), params)
+            students = cur.fetchall()
+            conn.commit()
+        next_after = None
+        if len(students) > limit:
+            students = students[:limit]
+            next_after = students[-1]["id"]
+        return {"status": "success", "students": students,
+                "next_after": next_after}
+    except psycopg2.Error as e:
+        logger.error(f'error:"{str(e)}')
+        return {"status": "error", "message":
+                "An unexpected error occurred. Please contact support."}
+
+
+@observe_db("get_student")
+def get_student_by_Id(id):
+    try:
+        with get_cursor(read=True) as (conn, cur):
+            execute(cur, SELECT_STUDENT, (id,))
+            students = cur.fetchone()
+            conn.commit()
         if students is not None:
             return {"status": "success", "students": students}
         else:
@@ -107,7 +559,15 @@ def get_student_by_Id(id):
                 "An unexpected error occurred. Please contact support."}
 
 
-def Update_student(id, student):
+@observe_db("update_student")
+@writes
+def Update_student(id, student, expected_version=None):
+    """
+    Apply the fields set on `student` and return the updated row in the
+    same statement. With `expected_version`, the row is only changed if
+    it is still at that version; otherwise the result is flagged
+    "precondition_failed" and carries the current row.
+    """
     try:
         update_fields = []
         update_values = []
@@ -118,10 +578,10 @@ def Update_student(id, student):
         if student.email is not None and student.email != "":
             update_fields.append("email = %s")
             update_values.append(student.email)
-        if student.age is not None and student.email != "":
+        if student.age is not None:
             update_fields.append("age = %s")
             update_values.append(student.age)
-        if student.phone is not None and student.email != "":
+        if student.phone is not None and student.phone != "":
             update_fields.append("phone = %s")
             update_values.append(student.phone)
 
@@ -130,38 +590,345 @@ def Update_student(id, student):
             return {"status": "error", "message":
                     "Please provide at least one field to update."}
 
+        conditions = "id = %s"
         update_values.append(id)
+        if expected_version is not None:
+            conditions += " AND version = %s"
+            update_values.append(expected_version)
         update_query = f'''UPDATE students SET {', '.join(update_fields)}
-        WHERE id = %s;'''
-        cur.execute(update_query, update_values)
-        conn.commit()
-        rows_affected = cur.rowcount
-        if rows_affected > 0:
-            return {"status": "success", "message": "Data is updated"}
+        WHERE {conditions} RETURNING {', '.join(STUDENT_FIELDS)};'''
+        current = None
+        with get_cursor() as (conn, cur):
+            execute(cur, update_query, update_values)
+            student_row = cur.fetchone()
+            if student_row is None and expected_version is not None:
+                # Tell a stale version apart from a missing student
+                execute(cur, SELECT_STUDENT, (id,))
+                current = cur.fetchone()
+            conn.commit()
+        if student_row is not None:
+            return {"status": "success", "message": "Data is updated",
+                    "students": student_row}
+        elif current is not None:
+            return {"status": "error", "message":
+                    "Student was modified by another request",
+                    "precondition_failed": True, "students": current}
         else:
             return {"status": "error", "message": "No Data found"}
 
+    except psycopg2.errors.UniqueViolation:
+        return {"status": "error", "message":
+                "A student with this email already exists"}
     except psycopg2.Error as e:
-        conn.rollback()
         logger.error(f'error:"{str(e)}')
         return {"status": "error", "message":
                 "An unexpected error occurred. Please contact support."}
 
 
+@observe_db("delete_student")
+@writes
 def delete_student(id):
     try:
         delete_query = """
         DELETE FROM students WHERE Id = %s;
         """
-        cur.execute(delete_query, (id, ))
-        if cur.rowcount > 0:
+        with get_cursor() as (conn, cur):
+            execute(cur, delete_query, (id, ))
+            if cur.rowcount > 0:
+                conn.commit()
+                return {"status": "success", "message":
+                        "Student deleted successfully"}
+            else:
+                return {"status": "error", "message": "Student not found"}
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {str(e)}")
+        return {"status": "error", "message":
+                "An unexpected error occurred. Please contact support."}
+
+
+@observe_db("get_students_batch")
+def get_students_by_ids(ids, fields=None):
+    """
+    Fetch many students in one query. Returns {id: row} for the IDs that
+    exist; missing IDs are simply absent.
+    """
+    try:
+        select_query = sql.SQL("""
+        SELECT {columns} FROM students WHERE ID = ANY(%s);
+        """).format(columns=_projection(fields or STUDENT_FIELDS))
+        with get_cursor(read=True) as (conn, cur):
+            execute(cur, select_query.as_string(conn), (list(ids),))
+            students = cur.fetchall()
             conn.commit()
-            return {"status": "success", "message":
-                    "Student deleted successfully"}
-        else:
-            return {"status": "error", "message": "Student not found"}
+        return {"status": "success",
+                "students": {row["id"]: row for row in students}}
+    except psycopg2.Error as e:
+        logger.error(f'error:"{str(e)}')
+        return {"status": "error", "message":
+                "An unexpected error occurred. Please contact support."}
+
+
+def _patch_values(id, student):
+    """(id, name, email, age, phone) with unset fields as NULL."""
+    return (id, student.name or None, student.email or None,
+            student.age, student.phone or None)
+
+
+@observe_db("update_students_batch")
+@writes
+def update_students_batch(patches):
+    """
+    Apply [(id, UpdateStudent)] patches in one transaction with a single
+    UPDATE ... FROM (VALUES ...); fields left unset keep their value.
+    If the batch violates a constraint, patches are retried one by one
+    behind savepoints so only the offending ones are rejected.
+    Returns the updated IDs and {id: error}.
+    """
+    update_query = """
+    UPDATE students AS s SET
+        name = COALESCE(v.name, s.name),
+        email = COALESCE(v.email, s.email),
+        age = COALESCE(v.age, s.age),
+        phone = COALESCE(v.phone, s.phone)
+    FROM (VALUES %s) AS v (id, name, email, age, phone)
+    WHERE s.ID = v.id RETURNING s.ID;
+    """
+    template = ("(%s::integer, %s::varchar, %s::varchar, %s::integer, "
+                "%s::varchar)")
+    values = [_patch_values(id, student) for id, student in patches]
+    try:
+        with get_cursor() as (conn, cur):
+            try:
+                rows = execute_values(cur, update_query, values,
+                                      template=template,
+                                      page_size=len(values), fetch=True)
+                conn.commit()
+                return {"status": "success",
+                        "updated": {row["id"] for row in rows},
+                        "errors": {}}
+            except (psycopg2.DataError, psycopg2.IntegrityError):
+                conn.rollback()
+                cur.pending = _timeout_statement()
+
+            updated, errors = set(), {}
+            for row in values:
+                cur.execute("SAVEPOINT batch_row;")
+                try:
+                    changed = execute_values(cur, update_query, [row],
+                                             template=template, fetch=True)
+                    cur.execute("RELEASE SAVEPOINT batch_row;")
+                    updated.update(r["id"] for r in changed)
+                except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT batch_row;")
+                    if isinstance(e, psycopg2.errors.UniqueViolation):
+                        errors[row[0]] = \
+                            "A student with this email already exists"
+                    else:
+                        errors[row[0]] = e.diag.message_primary or str(e)
+            conn.commit()
+            return {"status": "success", "updated": updated,
+                    "errors": errors}
+    except psycopg2.Error as e:
+        logger.error(f'error:"{str(e)}')
+        return {"status": "error", "message":
+                "An unexpected error occurred. Please contact support."}
+
+
+@observe_db("delete_students_batch")
+@writes
+def delete_students_batch(ids):
+    """Delete many students in one statement; returns the deleted IDs."""
+    try:
+        delete_query = """
+        DELETE FROM students WHERE ID = ANY(%s) RETURNING ID;
+        """
+        with get_cursor() as (conn, cur):
+            execute(cur, delete_query, (list(ids),))
+            deleted = {row["id"] for row in cur.fetchall()}
+            conn.commit()
+        return {"status": "success", "deleted": deleted}
     except psycopg2.Error as e:
-        conn.rollback()
         logger.error(f"Database error: {str(e)}")
         return {"status": "error", "message":
                 "An unexpected error occurred. Please contact support."}
+
+
+# Settled transactions (below the snapshot's xmin) are fixed by xmin
+# alone. While xmin stands still the committed changes at or above it
+# only accumulate, so their count moves whenever another one commits.
+TABLE_VERSION = """
+    SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS xmin,
+           count(*) AS pending, max(seq) AS latest
+      FROM student_changes
+     WHERE txid >= pg_snapshot_xmin(pg_current_snapshot());
+    """
+
+
+def _table_version(cur):
+    execute(cur, TABLE_VERSION)
+    row = cur.fetchone()
+    return f"{row['xmin']}:{row['pending']}:{row['latest'] or ''}"
+
+
+@observe_db("get_table_version")
+def get_table_version():
+    """
+    A token that changes whenever a committed insert, update or delete
+    becomes visible in the students table. It reads the change log rows
+    written since the oldest running transaction started, through the
+    (txid, seq) index. That is usually a handful, but a long transaction
+    keeps the window open and the read grows with every write made
+    meanwhile. Writes to other tables may change it too, which only
+    costs a client a full response.
+    """
+    try:
+        with get_cursor(read=True) as (conn, cur):
+            version = _table_version(cur)
+            conn.commit()
+        return {"status": "success", "version": version}
+    except psycopg2.Error as e:
+        logger.error(f'error:"{str(e)}')
+        return {"status": "error", "message":
+                "An unexpected error occurred. Please contact support."}
+
+
+CHANGE_OPS = {"I": "insert", "U": "update", "D": "delete"}
+
+CHANGE_HORIZON = """
+    SELECT txid::text::bigint AS txid, seq FROM student_changes_horizon;
+    """
+
+# Oldest entries of the settled part of the log, in cursor order
+CHANGE_LOG_HEAD = """
+    SELECT txid::text AS txid, seq,
+           changed_at < now() - %s * interval '1 day' AS expired
+    FROM student_changes
+    WHERE txid < pg_snapshot_xmin(pg_current_snapshot())
+    ORDER BY txid, seq LIMIT %s;
+    """
+
+# Key of the advisory lock held while pruning the change log
+PRUNE_CHANGES_LOCK = 0x73636c70
+
+
+def _horizon(cur):
+    execute(cur, CHANGE_HORIZON)
+    row = cur.fetchone()
+    return (row["txid"], row["seq"]) if row else (0, 0)
+
+
+def _expired(horizon):
+    return {"status": "expired", "horizon": "%d:%d" % horizon,
+            "message": "Change cursor expired: changes up to "
+            "%d:%d were pruned from the log" % horizon}
+
+
+@observe_db("get_changes")
+def get_changes(after=(0, 0), limit=500):
+    """
+    Student changes after the (txid, seq) cursor `after`, oldest first,
+    with the current row of each changed student (None once deleted).
+    Only changes from transactions older than every running transaction
+    are returned, so a cursor never skips a change that commits late.
+    A cursor behind the pruned part of the log gets status "expired".
+    """
+    try:
+        select_query = f"""
+        SELECT c.txid::text::bigint AS txid, c.seq, c.op, c.student_id,
+               c.changed_at,
+               {', '.join(f's.{f} AS s_{f}' for f in STUDENT_FIELDS)}
+        FROM student_changes c LEFT JOIN students s ON s.ID = c.student_id
+        WHERE (c.txid, c.seq) > (%s::text::xid8, %s)
+          AND c.txid < pg_snapshot_xmin(pg_current_snapshot())
+        ORDER BY c.txid, c.seq LIMIT %s;
+        """
+        with get_cursor() as (conn, cur):
+            execute(cur, select_query, (str(after[0]), after[1], limit + 1))
+            rows = cur.fetchall()
+            # Read after the changes, so a prune in between can only
+            # expire a cursor whose changes were all still there
+            horizon = _horizon(cur)
+            conn.commit()
+        if after != (0, 0) and after < horizon:
+            return _expired(horizon)
+        has_more = len(rows) > limit
+        changes = []
+        for row in rows[:limit]:
+            student = None
+            if row["s_id"] is not None:
+                student = {f: row[f"s_{f}"] for f in STUDENT_FIELDS}
+            changes.append({
+                "cursor": f"{row['txid']}:{row['seq']}",
+                "op": CHANGE_OPS[row["op"]],
+                "id": row["student_id"],
+                "changed_at": row["changed_at"],
+                "student": student,
+            })
+        return {"status": "success", "changes": changes,
+                "has_more": has_more}
+    except psycopg2.Error as e:
+        logger.error(f'error:"{str(e)}')
+        return {"status": "error", "message":
+                "An unexpected error occurred. Please contact support."}
+
+
+@observe_db("get_change_horizon")
+def get_change_horizon(after):
+    """Status "expired" if `after` is behind the pruned log, else success."""
+    try:
+        with get_cursor() as (conn, cur):
+            horizon = _horizon(cur)
+            conn.commit()
+        if after != (0, 0) and after < horizon:
+            return _expired(horizon)
+        return {"status": "success", "horizon": "%d:%d" % horizon}
+    except psycopg2.Error as e:
+        logger.error(f'error:"{str(e)}')
+        return {"status": "error", "message":
+                "An unexpected error occurred. Please contact support."}
+
+
+@observe_db("prune_changes")
+def prune_changes(retention_days, batch_size=5000):
+    """
+    Delete change log entries older than `retention_days` and move the
+    feed's horizon past them. Entries go oldest cursor first, in short
+    transactions of up to `batch_size`, and only from transactions that
+    have settled, so the log always keeps a contiguous tail. A prune
+    already running in another worker makes this one a no-op.
+    """
+    deleted = 0
+    try:
+        while True:
+            with get_cursor() as (conn, cur):
+                execute(cur, "SELECT pg_try_advisory_xact_lock(%s) AS ok;",
+                        (PRUNE_CHANGES_LOCK,))
+                if not cur.fetchone()["ok"]:
+                    break
+                execute(cur, CHANGE_LOG_HEAD, (retention_days, batch_size))
+                head = cur.fetchall()
+                expired = []
+                for row in head:
+                    if not row["expired"]:
+                        break
+                    expired.append(row)
+                if not expired:
+                    break
+                last = (expired[-1]["txid"], expired[-1]["seq"])
+                execute(cur, """
+                    DELETE FROM student_changes
+                    WHERE (txid, seq) <= (%s::xid8, %s);
+                    """, last)
+                execute(cur, """
+                    UPDATE student_changes_horizon
+                    SET txid = %s::xid8, seq = %s;
+                    """, last)
+                conn.commit()
+            deleted += len(expired)
+            if len(expired) < batch_size:
+                break
+        return {"status": "success", "deleted": deleted}
+    except psycopg2.Error as e:
+        logger.error(f'error:"{str(e)}')
+        return {"status": "error", "deleted": deleted, "message":
+                "An unexpected error occurred. Please contact support."}
@@ -0,0 +1,44 @@
+"""
+Per-request deadlines.
+The admission middleware records when the current request must finish
+in a context variable. anyio copies it into the worker threads that run
+db_students, which caps the pool checkout wait and each transaction's
+statement_timeout by the time the request has left.
+"""
+
+import contextvars
+import time
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+def start(timeout):
+    """
+    Give the current context a deadline `timeout` seconds from now, or
+    none when `timeout` is falsy. Returns a token for `reset`.
+    """
+    return _deadline.set(time.monotonic() + timeout if timeout else None)
+
+
+def reset(token):
+    _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left before the deadline (may be negative), or None."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def statement_timeout_ms():
+    """
+    statement_timeout for the next transaction in milliseconds, or None
+    without a deadline. Never 0, which Postgres reads as "no limit".
+    """
+    left = remaining()
+    return None if left is None else max(1, int(left * 1000))
@@ -0,0 +1,104 @@
+"""
+Background database health checker.
+Pings Postgres through the application's connection pool on a fixed
+interval and caches the outcome, so liveness/readiness probes and
+/HealthCheck answer from memory instead of opening a connection each.
+"""
+
+import asyncio
+import os
+import time
+
+import psycopg2
+from loguru import logger
+
+import db_students
+import startup
+from db_async import run_db
+from db_pool import PoolTimeout
+
+
+class HealthChecker:
+    """
+    Runs `db_students.ping` every `interval` seconds and keeps the latest
+    result. A result older than `max_age` seconds counts as unhealthy.
+    """
+
+    def __init__(self, interval=5.0, max_age=None):
+        self.interval = interval
+        self.max_age = max_age if max_age is not None else 3 * interval
+        self._task = None
+        self._result = {
+            "status": "unknown",
+            "details": "No health check has completed yet",
+            "latency_ms": None,
+            "checked_at": None,
+        }
+
+    async def check(self):
+        """Ping the database once and store the result."""
+        start = time.perf_counter()
+        try:
+            await run_db(db_students.ping)
+            status, details = "healthy", ""
+            startup.mark_ready()
+        except PoolTimeout as e:
+            # Every connection is busy: the database is reachable but this
+            # probe could not get a turn, so keep the last known status.
+            status = self._result["status"]
+            details = f"Connection pool saturated: {e}"
+        except psycopg2.Error as e:
+            status, details = "unhealthy", str(e)
+            # Log the transition only, not every failed probe of an outage.
+            if self._result["status"] != "unhealthy":
+                logger.error({
+                    "event": "health_check_db_error",
+                    "endpoint": "/HealthCheck",
+                    "method": "GET",
+                    "error": str(e)
+                })
+        self._result = {
+            "status": status,
+            "details": details,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 3),
+            "checked_at": time.time(),
+        }
+        return self._result
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def database_status(self):
+        """Cached database component status with pool statistics."""
+        result = dict(self._result)
+        checked_at = result["checked_at"]
+        if checked_at is not None:
+            age = time.time() - checked_at
+            result["age_seconds"] = round(age, 3)
+            if age > self.max_age:
+                result["status"] = "unhealthy"
+                result["details"] = "Health check result is stale"
+        result["pool"] = db_students.pool.stats()
+        return result
+
+
+def build_health_checker():
+    return HealthChecker(
+        interval=float(os.getenv("HEALTHCHECK_INTERVAL", 5)),
+        max_age=float(os.getenv("HEALTHCHECK_MAX_AGE")) if os.getenv(
+            "HEALTHCHECK_MAX_AGE") else None)
@@ -0,0 +1,56 @@
+"""
+Cache of the serialized full student list.
+Keeps the /GetAllStudents body for one table version, as JSON and in
+each content encoding clients asked for, so a repeated full dump is a
+copy from memory instead of a query, a serialization and a compression.
+
+Entries are keyed by the version from db_students.get_table_version,
+which keeps them correct with several workers and with writes from
+other clients. The write paths in db_students also drop the entry at
+once, so a superseded body does not hold memory until the next read.
+"""
+
+import os
+import threading
+
+
+class ListBodyCache:
+    """The full-list bodies of a single table version, by encoding."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._bodies = {}
+
+    def get(self, version, encoding):
+        """The cached body for `version` in `encoding`, or None."""
+        with self._lock:
+            if version != self._version:
+                return None
+            return self._bodies.get(encoding)
+
+    def put(self, version, encoding, body):
+        with self._lock:
+            if version != self._version:
+                self._version, self._bodies = version, {}
+            self._bodies[encoding] = body
+
+    def invalidate(self):
+        with self._lock:
+            self._version, self._bodies = None, {}
+
+
+def build_list_cache():
+    """A ListBodyCache if STUDENT_LIST_CACHE is enabled, else None."""
+    if os.getenv("STUDENT_LIST_CACHE", "").lower() in ("1", "true", "yes"):
+        return ListBodyCache()
+    return None
+
+
+cache = build_list_cache()
+
+
+def invalidate():
+    """Drop the cached list after a write."""
+    if cache is not None:
+        cache.invalidate()
@@ -0,0 +1,172 @@
+"""
+Structured JSON logging for the student API.
+Every loguru record is written to stderr as one JSON line. With LOG_ASYNC
+enabled, records are handed to a bounded in-memory queue and a background
+thread serializes and writes them in batches, so request handlers never
+wait on JSON encoding or a slow stderr. High-volume *_start/*_success
+events can be sampled per level.
+"""
+
+import os
+import queue
+import random
+import re
+import sys
+import threading
+
+from loguru import logger
+
+import request_timing
+from metrics import LOG_QUEUE_DEPTH, LOG_DROPPED, LOG_SAMPLED_OUT
+from serialization import dumps_str
+
+# Handler messages are dicts rendered with str(); pull out their event name
+_EVENT_PATTERN = re.compile(r"'event': '(\w+)'")
+_SAMPLED_SUFFIXES = ("_start", "_success")
+
+
+def serialize(record):
+    subset = {
+        "timestamp": record["time"].strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+        "message": record["message"],
+        "level": record["level"].name,
+        "function": record["function"],
+        "line": record["line"],
+        "file": record["file"].name,
+        "module": record["module"]
+    }
+    return dumps_str(subset)
+
+
+class StderrSink:
+    """Synchronous sink: serialize and write each record immediately."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+
+    def write(self, message):
+        with request_timing.timed("log"):
+            self.stream.write(serialize(message.record) + "\n")
+
+
+class BatchingSink:
+    """
+    Non-blocking sink. Records go onto a queue of at most `maxsize`
+    entries; a daemon thread serializes up to `batch_size` of them at a
+    time and writes them with a single call. When the queue is full the
+    record is dropped, or with `block=True` the caller waits for room.
+    """
+
+    _STOP = object()
+
+    def __init__(self, stream=None, maxsize=10000, batch_size=256,
+                 block=False):
+        self.stream = stream or sys.stderr
+        self.batch_size = batch_size
+        self.block = block
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="log-writer")
+        self._thread.start()
+
+    def write(self, message):
+        with request_timing.timed("log"):
+            try:
+                if self.block:
+                    self._queue.put(message.record)
+                else:
+                    self._queue.put_nowait(message.record)
+            except queue.Full:
+                LOG_DROPPED.inc()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is self._STOP
+            if stop:
+                batch.pop()
+            if batch:
+                try:
+                    self.stream.write("".join(
+                        serialize(record) + "\n" for record in batch))
+                    self.stream.flush()
+                except Exception:
+                    LOG_DROPPED.inc(len(batch))
+            LOG_QUEUE_DEPTH.set(self._queue.qsize())
+            if stop:
+                return
+
+    def stop(self, timeout=5.0):
+        """Write out queued records and stop the writer thread."""
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+
+class EventSampler:
+    """
+    Loguru filter that keeps only a fraction of the *_start/*_success
+    events at each level, e.g. {"INFO": 0.1}. Other records always pass.
+    """
+
+    def __init__(self, rates):
+        self.rates = rates
+
+    def __call__(self, record):
+        rate = self.rates.get(record["level"].name)
+        if rate is None or rate >= 1:
+            return True
+        match = _EVENT_PATTERN.search(record["message"])
+        if not match or not match.group(1).endswith(_SAMPLED_SUFFIXES):
+            return True
+        if random.random() < rate:
+            return True
+        LOG_SAMPLED_OUT.labels(level=record["level"].name).inc()
+        return False
+
+
+def parse_sample_rates(value):
+    """Parse "INFO=0.1,DEBUG=0" into {"INFO": 0.1, "DEBUG": 0.0}."""
+    rates = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            level, rate = item.split("=", 1)
+            rates[level.strip().upper()] = float(rate)
+    return rates
+
+
+_handler_id = None
+_sink = None
+
+
+def configure_logging():
+    """
+    Replace loguru's default handler with the JSON sink chosen by
+    LOG_ASYNC, LOG_QUEUE_SIZE, LOG_BATCH_SIZE, LOG_QUEUE_FULL
+    ("drop" or "block") and LOG_SAMPLE_RATES.
+    """
+    global _handler_id, _sink
+    logger.remove()
+    if os.getenv("LOG_ASYNC", "").lower() in ("1", "true", "yes"):
+        _sink = BatchingSink(
+            maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+            batch_size=int(os.getenv("LOG_BATCH_SIZE", 256)),
+            block=os.getenv("LOG_QUEUE_FULL", "drop").lower() == "block")
+    else:
+        _sink = StderrSink()
+    rates = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES"))
+    _handler_id = logger.add(
+        _sink, format="{message}", backtrace=True,
+        filter=EventSampler(rates) if rates else None)
+
+
+def shutdown_logging():
+    """Flush the async sink, if any, before the process exits."""
+    global _handler_id
+    if _handler_id is not None:
+        logger.remove(_handler_id)
+        _handler_id = None
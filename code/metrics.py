@@ -0,0 +1,203 @@
+"""
+Prometheus metrics shared by the API and the data layer.
+Kept in one module so the middleware, the cache and the database code
+can record into the same registry without importing Main.
+
+When PROMETHEUS_MULTIPROC_DIR is set (see serve.py), every worker writes
+its samples there and /metrics aggregates them across workers.
+"""
+
+import os
+
+from prometheus_client import Counter, Gauge, Histogram
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Latency buckets (seconds) fine enough for sub-millisecond CRUD calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Label used for requests that matched no route, so scanners and 404
+# spam cannot create unbounded series
+UNMATCHED_ROUTE = "<unmatched>"
+
+# Request metrics, labelled by route template (e.g. /GetStudent)
+REQUEST_COUNT = Counter(
+    'api_requests_total',
+    'Total number of API requests',
+    ['endpoint', 'method', 'status_code']
+)
+REQUEST_LATENCY = Histogram(
+    'api_request_latency_seconds',
+    'API request latency in seconds',
+    ['endpoint', 'method', 'status_code'],
+    buckets=LATENCY_BUCKETS
+)
+ERROR_COUNT = Counter(
+    'api_errors_total',
+    'Total number of API errors',
+    ['endpoint', 'method', 'status_code']
+)
+
+REQUESTS_IN_PROGRESS = Gauge(
+    'api_requests_in_progress',
+    'API requests currently being handled',
+    ['method'],
+    multiprocess_mode='livesum'
+)
+
+# Admission control and deadlines (see AdmissionMiddleware)
+REQUESTS_REJECTED = Counter(
+    'api_requests_rejected_total',
+    'Requests shed with 503 before reaching a handler',
+    ['reason']
+)
+REQUESTS_TIMED_OUT = Counter(
+    'api_requests_timed_out_total',
+    'Requests answered with 504 after exceeding their deadline',
+    ['endpoint']
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    'api_admission_queue_depth',
+    'Requests waiting for an admission slot',
+    multiprocess_mode='livesum'
+)
+
+# Seconds from process start to each startup phase (see startup.py)
+STARTUP_SECONDS = Gauge(
+    'app_startup_seconds',
+    'Seconds from process start to imported, serving and ready',
+    ['phase'],
+    multiprocess_mode='livemax'
+)
+
+# Time spent in each database operation, apart from total handler time
+DB_OPERATION_LATENCY = Histogram(
+    'db_operation_latency_seconds',
+    'Database operation latency in seconds',
+    ['operation'],
+    buckets=LATENCY_BUCKETS
+)
+
+DB_SLOW_QUERIES = Counter(
+    'db_slow_queries_total',
+    'Statements that ran at or over SLOW_QUERY_MS (see query_log.py)'
+)
+
+# Write coalescing of AddStudent calls (see insert_batcher.py)
+INSERT_BATCH_SIZE = Histogram(
+    'insert_batch_size',
+    'Students inserted per group commit',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+INSERT_BATCH_WAIT = Histogram(
+    'insert_batch_wait_seconds',
+    'Time an AddStudent insert waited for its batch to be flushed',
+    buckets=LATENCY_BUCKETS
+)
+
+# Read replica routing (see replicas.py)
+DB_READS_ROUTED = Counter(
+    'db_reads_routed_total',
+    'Database reads by the server they were routed to',
+    ['target']
+)
+REPLICA_LAG = Gauge(
+    'db_replica_lag_seconds',
+    'Replication lag last measured on each read replica',
+    ['replica'],
+    multiprocess_mode='livemax'
+)
+REPLICA_AVAILABLE = Gauge(
+    'db_replica_available',
+    'Whether reads are routed to the replica (1) or it is ejected (0)',
+    ['replica'],
+    multiprocess_mode='livemin'
+)
+
+# Student cache metrics
+CACHE_HITS = Counter(
+    'student_cache_hits_total',
+    'Student lookups served from cache',
+    ['tier']
+)
+CACHE_MISSES = Counter(
+    'student_cache_misses_total',
+    'Student lookups that had to query the database'
+)
+CACHE_COALESCED = Counter(
+    'student_cache_coalesced_total',
+    'Student lookups that waited on an identical in-flight query'
+)
+CACHE_EVICTIONS = Counter(
+    'student_cache_evictions_total',
+    'Student cache entries evicted for size or expiry',
+    ['reason']
+)
+CACHE_INVALIDATIONS = Counter(
+    'student_cache_invalidations_total',
+    'Student cache entries invalidated by writes'
+)
+
+# Serialized full-list bodies (see list_cache.py)
+LIST_CACHE_REQUESTS = Counter(
+    'student_list_cache_requests_total',
+    'Full-list reads answered from the cached body (hit) or not (miss)',
+    ['result']
+)
+
+# Response compression (see compression.py); the ratio is
+# output / input bytes per encoding
+COMPRESSION_INPUT_BYTES = Counter(
+    'response_compression_input_bytes_total',
+    'Response body bytes before compression',
+    ['encoding']
+)
+COMPRESSION_OUTPUT_BYTES = Counter(
+    'response_compression_output_bytes_total',
+    'Response body bytes after compression',
+    ['encoding']
+)
+COMPRESSION_SECONDS = Counter(
+    'response_compression_cpu_seconds_total',
+    'CPU time spent compressing response bodies',
+    ['encoding']
+)
+
+# Asynchronous log sink (see log_config.py)
+LOG_QUEUE_DEPTH = Gauge(
+    'log_queue_depth',
+    'Log records waiting for the background writer',
+    multiprocess_mode='livesum'
+)
+LOG_DROPPED = Counter(
+    'log_records_dropped_total',
+    'Log records dropped because the log queue was full'
+)
+LOG_SAMPLED_OUT = Counter(
+    'log_records_sampled_out_total',
+    'Start/success log events skipped by sampling',
+    ['level']
+)
+
+
+def generate_metrics():
+    """Render the metrics exposition, merged across workers if needed."""
+    from prometheus_client import CollectorRegistry, generate_latest
+    if not MULTIPROCESS:
+        return generate_latest()
+    from prometheus_client import multiprocess
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def mark_worker_stopped():
+    """
+    Drop this worker's live gauges when it shuts down, e.g. on a SIGHUP
+    restart. Called from the app lifespan because worker processes exit
+    without running atexit hooks.
+    """
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,389 @@
+"""
+ASGI middleware for the student API.
+Records Prometheus request metrics, applies admission control and
+request deadlines, routes reads for read-your-writes, and times and
+profiles requests on demand, as pure ASGI wrappers so requests do not
+pay for BaseHTTPMiddleware's extra task and body streams.
+"""
+
+import asyncio
+import hmac
+import random
+import time
+
+from anyio import to_thread
+from loguru import logger
+
+import deadlines
+import profiler
+import replicas
+import request_timing
+from metrics import REQUEST_COUNT, REQUEST_LATENCY, ERROR_COUNT
+from metrics import REQUESTS_IN_PROGRESS, UNMATCHED_ROUTE
+from metrics import (REQUESTS_REJECTED, REQUESTS_TIMED_OUT,
+                     ADMISSION_QUEUE_DEPTH)
+from serialization import dumps
+
+
+HTTP_METHODS = frozenset(
+    ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+
+def route_template(scope):
+    """
+    The path template of the route that handled the request (for example
+    /GetStudent or /v2/UpdateStudent), or UNMATCHED_ROUTE.
+    """
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+class PrometheusMiddleware:
+    """
+    Captures request count, latency, errors and in-flight requests for
+    Prometheus. Series are labelled by route template rather than raw
+    path. The status code is read from the response start message;
+    requests that raise are counted as 500 errors.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        if method not in HTTP_METHODS:
+            method = "OTHER"
+        start_time = time.perf_counter()
+        status_code = None
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method=method)
+        in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            ERROR_COUNT.labels(endpoint=route_template(scope), method=method,
+                               status_code=500).inc()
+            raise
+        finally:
+            in_progress.dec()
+
+        if status_code is None:
+            return
+        endpoint = route_template(scope)
+        REQUEST_COUNT.labels(endpoint=endpoint, method=method,
+                             status_code=status_code).inc()
+        REQUEST_LATENCY.labels(endpoint=endpoint, method=method,
+                               status_code=status_code
+                               ).observe(time.perf_counter() - start_time)
+        if status_code >= 400:
+            ERROR_COUNT.labels(endpoint=endpoint, method=method,
+                               status_code=status_code).inc()
+
+
+def parse_route_timeouts(value):
+    """Parse "/path=seconds,..." into {path: seconds}; 0 means no limit."""
+    timeouts = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            path, seconds = item.rsplit("=", 1)
+            timeouts[path.strip()] = float(seconds)
+    return timeouts
+
+
+class AdmissionMiddleware:
+    """
+    Load shedding and request deadlines.
+
+    At most `max_in_flight` requests run at once. Up to `max_queue` more
+    may wait `queue_timeout` seconds for a slot; anything beyond that is
+    answered at once with 503 and Retry-After, so overload sheds traffic
+    instead of piling up requests until the process runs out of memory.
+
+    Every admitted request gets a deadline from `timeouts` (by path) or
+    `default_timeout`, counted from arrival. The data layer turns it into
+    statement_timeout. A request that outlives it is answered with 504,
+    including one whose handler turned the cancelled query into an error
+    response. The deadline only runs until the response starts: a
+    streamed body is left to its handler, which bounds each batch. Paths
+    in `exempt` skip both admission and the deadline.
+    """
+
+    def __init__(self, app, max_in_flight=100, max_queue=100,
+                 queue_timeout=1.0, default_timeout=10.0, timeouts=None,
+                 exempt=(), unqueued=(), retry_after=1):
+        self.app = app
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.default_timeout = default_timeout
+        self.timeouts = timeouts or {}
+        self.exempt = frozenset(exempt)
+        self.unqueued = frozenset(unqueued)
+        self.retry_after = str(retry_after)
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._waiting = 0
+
+    async def _reject(self, send, reason):
+        REQUESTS_REJECTED.labels(reason=reason).inc()
+        await _send_json(send, 503, {"detail": "Server is overloaded, "
+                                               "retry later"},
+                         [(b"retry-after", self.retry_after.encode())])
+
+    async def _admit(self):
+        """
+        Take a slot, waiting in the bounded queue if none is free.
+        Returns True, or the reason the request was shed.
+        """
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return True
+        if self._waiting >= self.max_queue:
+            return "queue_full"
+        self._waiting += 1
+        ADMISSION_QUEUE_DEPTH.inc()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return "queue_timeout"
+        finally:
+            self._waiting -= 1
+            ADMISSION_QUEUE_DEPTH.dec()
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path")
+        if scope["type"] != "http" or path in self.exempt:
+            await self.app(scope, receive, send)
+            return
+
+        token = deadlines.start(self.timeouts.get(path, self.default_timeout))
+        try:
+            if path in self.unqueued:
+                await self._run(scope, receive, send)
+                return
+            with request_timing.timed("queue"):
+                admitted = await self._admit()
+            if admitted is not True:
+                await self._reject(send, admitted)
+                return
+            try:
+                await self._run(scope, receive, send)
+            finally:
+                self._slots.release()
+        finally:
+            deadlines.reset(token)
+
+    async def _run(self, scope, receive, send):
+        started = False
+        timed_out = False
+        left = deadlines.remaining()
+        deadline = asyncio.timeout(None if left is None else max(0.0, left))
+
+        async def send_wrapper(message):
+            nonlocal started, timed_out
+            if message["type"] == "http.response.start":
+                started = True
+                if message["status"] >= 400 and deadlines.expired():
+                    # The handler reported the cancelled query as an error
+                    timed_out = True
+                    await self._timeout(scope, send)
+                    return
+                deadline.reschedule(None)
+            elif timed_out:
+                return
+            await send(message)
+
+        try:
+            async with deadline:
+                await self.app(scope, receive, send_wrapper)
+        except TimeoutError:
+            if started:
+                raise
+            await self._timeout(scope, send)
+
+    async def _timeout(self, scope, send):
+        REQUESTS_TIMED_OUT.labels(endpoint=route_template(scope)).inc()
+        await _send_json(send, 504, {"detail": "Request timed out"})
+
+
+class ReadYourWritesMiddleware:
+    """
+    Gives every request a replica routing state. A client that wrote
+    gets a cookie pinning its reads to the primary for `window` seconds,
+    so it sees its own writes however far the replicas lag behind.
+    """
+
+    def __init__(self, app, window=10.0, cookie="db_primary_until"):
+        self.app = app
+        self.window = window
+        self.cookie = cookie
+        self._prefix = f"{cookie}=".encode()
+
+    def _pinned(self, scope):
+        for name, value in scope["headers"]:
+            if name != b"cookie":
+                continue
+            for item in value.split(b";"):
+                item = item.strip()
+                if item.startswith(self._prefix):
+                    try:
+                        return float(item[len(self._prefix):]) > time.time()
+                    except ValueError:
+                        return False
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = replicas.start(self._pinned(scope))
+        state = replicas.current()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and state.wrote:
+                until = int(time.time() + self.window) + 1
+                cookie = (f"{self.cookie}={until}; Max-Age="
+                          f"{int(self.window) + 1}; Path=/; HttpOnly; "
+                          f"SameSite=Lax")
+                message = message | {"headers": [
+                    *message.get("headers", ()),
+                    (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            replicas.reset(token)
+
+
+def debug_authorized(headers, token):
+    """
+    Whether the X-Debug-Token request header carries `token`. Always
+    False when no token is configured.
+    """
+    if not token:
+        return False
+    for name, value in headers:
+        if name == b"x-debug-token":
+            return hmac.compare_digest(value, token.encode())
+    return False
+
+
+class ServerTimingMiddleware:
+    """
+    Adds a Server-Timing header breaking the request's time down by
+    phase (see request_timing.py), to every response with `always`, or
+    else only to requests with a valid X-Debug-Token. Phases after the
+    response has started, such as a streamed body, are not included.
+    """
+
+    def __init__(self, app, always=False, token=None):
+        self.app = app
+        self.always = always
+        self.token = token
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (
+                self.always or debug_authorized(scope["headers"],
+                                                self.token)):
+            await self.app(scope, receive, send)
+            return
+
+        token = request_timing.start()
+        timings = request_timing.current()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = message | {"headers": [
+                    *message.get("headers", ()),
+                    (b"server-timing", timings.header().encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_timing.reset(token)
+
+
+class ProfilerMiddleware:
+    """
+    Samples the stacks of requests with a valid X-Debug-Token, and of a
+    random `sample_rate` fraction of all requests, and saves them to
+    `store`. A requested profile's ID is returned in X-Profile-Id;
+    every profile is logged as a request_profiled event.
+    """
+
+    def __init__(self, app, sampler, store, token=None, sample_rate=0.0):
+        self.app = app
+        self.sampler = sampler
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested = debug_authorized(scope["headers"], self.token)
+        if not requested and not (self.sample_rate and
+                                  random.random() < self.sample_rate):
+            await self.app(scope, receive, send)
+            return
+
+        profile, token = profiler.start(self.sampler)
+        start_time = time.perf_counter()
+        saved = False
+
+        async def save():
+            # Before the last body chunk goes out, so the profile can be
+            # fetched as soon as the client has the response
+            nonlocal saved
+            saved = True
+            self.sampler.remove(profile)
+            await to_thread.run_sync(self.store.save, profile)
+            logger.info({
+                "event": "request_profiled",
+                "profile_id": profile.id,
+                "endpoint": route_template(scope),
+                "method": scope["method"],
+                "seconds": round(time.perf_counter() - start_time, 6),
+                "samples": profile.samples
+            })
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and requested:
+                message = message | {"headers": [
+                    *message.get("headers", ()),
+                    (b"x-profile-id", profile.id.encode())]}
+            elif (message["type"] == "http.response.body" and not saved
+                    and not message.get("more_body", False)):
+                await save()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.sampler.remove(profile)
+            profiler.reset(token)
+
+
+async def _send_json(send, status, content, headers=()):
+    body = dumps(content)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,498 @@
+"""
+Online schema migrations.
+pyway applies DB/Schemas/migrations one file per transaction, holding
+every lock a file takes until the whole file is done. That is fine for
+small tables, but on a large students table an index build or a backfill
+stalls the API for minutes. This runner applies the migrations in
+DB/Schemas/online step by step, keeping the table available:
+
+    -- step: transaction
+        The statements run in one transaction under a short lock_timeout
+        and a statement_timeout. A step that cannot get its locks in time
+        is rolled back and retried with backoff, rather than queueing
+        every query of the table behind its lock request.
+    -- step: concurrently
+        Each statement (ending with `;` at the end of a line) runs on its
+        own outside a transaction, as CREATE INDEX CONCURRENTLY needs.
+        An invalid index left behind by a failed attempt is dropped
+        before the statement is retried.
+    -- step: backfill table=students [key=id] [batch=1000] [triggers=skip]
+        One UPDATE with %(start)s and %(end)s placeholders, run over the
+        table's key range in short transactions, for the rows with
+        start < key <= end, `batch` rows at a time. Progress is committed
+        with every batch, so an interrupted backfill resumes where it
+        stopped. Batches grow or shrink to take about `batch_seconds`,
+        and the backfill pauses while a replica lags more than `max_lag`
+        seconds or more than `max_active` other queries are running.
+
+        The table's triggers fire for every row, so on students each
+        backfilled row gets a new version and updated_at (a new ETag)
+        and a change-feed entry. triggers=skip runs the batches with
+        session_replication_role = replica instead. Only use it for
+        columns no client reads: skipped rows keep their ETags, so
+        clients go on getting 304 for them, change-feed readers never
+        hear of the change, and foreign keys aren't checked. It needs a
+        superuser or a role granted SET on that setting.
+
+Files are named like pyway's, V<version>__<description>.sql, and are
+applied in version order. Each step's progress is kept in the
+online_migrations table.
+
+    python code/online_migrate.py migrate
+    python code/online_migrate.py info
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import re
+import sys
+import time
+
+import psycopg2
+from psycopg2 import errors, sql
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+from loguru import logger
+
+load_dotenv()
+
+DEFAULT_DIR = os.getenv("ONLINE_MIGRATION_DIR", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    "DB", "Schemas", "online"))
+
+HISTORY_TABLE = """
+    CREATE TABLE IF NOT EXISTS online_migrations (
+        version TEXT NOT NULL,
+        step INTEGER NOT NULL,
+        description TEXT NOT NULL,
+        checksum TEXT NOT NULL,
+        last_key BIGINT,
+        started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        completed_at TIMESTAMPTZ,
+        PRIMARY KEY (version, step)
+    );
+    """
+
+# Replay lag of the slowest standby, as seen from the primary (needs
+# pg_monitor to see other sessions), and the queries running right now
+LOAD_QUERY = """
+    SELECT (SELECT COALESCE(max(EXTRACT(EPOCH FROM replay_lag)), 0)
+            FROM pg_stat_replication) AS lag,
+           (SELECT count(*) FROM pg_stat_activity
+            WHERE state = 'active' AND backend_type = 'client backend'
+              AND pid <> pg_backend_pid()) AS active;
+    """
+
+FILE_PATTERN = re.compile(r"^V(\d+(?:\.\d+)*)__(\w+)\.sql$")
+STEP_PATTERN = re.compile(r"^--\s*step:\s*(\w+)([^\n]*)$", re.MULTILINE)
+STATEMENT_END = re.compile(r";[ \t]*(?:\n|$)")
+CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+"
+    r"(?:IF\s+NOT\s+EXISTS\s+)?([\w.\"]+)", re.IGNORECASE)
+STEP_KINDS = ("transaction", "concurrently", "backfill")
+
+# Lock waits and cancelled statements are retried; anything else stops
+RETRYABLE = (errors.LockNotAvailable, errors.DeadlockDetected,
+             errors.QueryCanceled)
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Step:
+    def __init__(self, number, kind, options, body):
+        self.number = number
+        self.kind = kind
+        self.options = options
+        self.body = body
+
+
+class Migration:
+    def __init__(self, version, description, checksum, steps):
+        self.version = version
+        self.description = description
+        self.checksum = checksum
+        self.steps = steps
+
+    @property
+    def order(self):
+        return tuple(int(part) for part in self.version.split("."))
+
+
+def parse_steps(text):
+    """Split a migration into its `-- step:` sections."""
+    matches = list(STEP_PATTERN.finditer(text))
+    if not matches:
+        raise MigrationError("no '-- step:' line")
+    preamble = text[:matches[0].start()]
+    if any(line.strip() and not line.strip().startswith("--")
+           for line in preamble.splitlines()):
+        raise MigrationError("SQL before the first '-- step:' line")
+    steps = []
+    for number, match in enumerate(matches):
+        kind = match.group(1)
+        if kind not in STEP_KINDS:
+            raise MigrationError(f"unknown step kind: {kind}")
+        options = {}
+        for item in match.group(2).split():
+            name, sep, value = item.partition("=")
+            if not sep:
+                raise MigrationError(f"bad step option: {item}")
+            options[name] = value
+        end = (matches[number + 1].start() if number + 1 < len(matches)
+               else len(text))
+        body = text[match.end():end].strip()
+        if kind == "backfill" and ("table" not in options
+                                   or "%(start)s" not in body
+                                   or "%(end)s" not in body):
+            raise MigrationError("a backfill step needs table= and an "
+                                 "UPDATE using %(start)s and %(end)s")
+        if options.get("triggers", "fire") not in ("skip", "fire"):
+            raise MigrationError("triggers= must be skip or fire")
+        steps.append(Step(number, kind, options, body))
+    return steps
+
+
+def load_migration(path):
+    match = FILE_PATTERN.match(os.path.basename(path))
+    if not match:
+        raise MigrationError(f"not a migration file name: {path}")
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    try:
+        steps = parse_steps(text)
+    except MigrationError as e:
+        raise MigrationError(f"{os.path.basename(path)}: {e}") from None
+    return Migration(match.group(1), match.group(2),
+                     hashlib.sha256(text.encode()).hexdigest()[:16], steps)
+
+
+def load_migrations(directory):
+    """The migrations in `directory`, in version order."""
+    if not os.path.isdir(directory):
+        return []
+    migrations = [load_migration(os.path.join(directory, name))
+                  for name in os.listdir(directory)
+                  if FILE_PATTERN.match(name)]
+    return sorted(migrations, key=lambda m: m.order)
+
+
+def split_statements(body):
+    return [statement.strip()
+            for statement in STATEMENT_END.split(body) if statement.strip()]
+
+
+class OnlineMigrator:
+    """
+    Applies online migrations over one connection from `connect`.
+    Timeouts and delays are in seconds.
+    """
+
+    def __init__(self, connect, lock_timeout=2.0, statement_timeout=60.0,
+                 retries=30, backoff=0.5, max_backoff=10.0, batch_size=1000,
+                 batch_seconds=0.2, pause=0.0, max_lag=5.0, max_active=None,
+                 throttle_wait=1.0):
+        self.connect = connect
+        self.lock_timeout = lock_timeout
+        self.statement_timeout = statement_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.pause = pause
+        self.max_lag = max_lag
+        self.max_active = max_active
+        self.throttle_wait = throttle_wait
+
+    def _history(self, conn, migration):
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("SELECT * FROM online_migrations WHERE version = %s;",
+                        (migration.version,))
+            rows = {row["step"]: row for row in cur.fetchall()}
+        conn.commit()
+        return rows
+
+    def migrate(self, migrations):
+        """Apply whatever is not applied yet of `migrations`, in order."""
+        conn = self.connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(HISTORY_TABLE)
+            conn.commit()
+            for migration in migrations:
+                self._apply(conn, migration)
+        finally:
+            conn.close()
+
+    def info(self, migrations):
+        """[(migration, step, history row or None)] for every step."""
+        conn = self.connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(HISTORY_TABLE)
+            conn.commit()
+            steps = []
+            for migration in migrations:
+                history = self._history(conn, migration)
+                steps.extend((migration, step, history.get(step.number))
+                             for step in migration.steps)
+            return steps
+        finally:
+            conn.close()
+
+    def _apply(self, conn, migration):
+        history = self._history(conn, migration)
+        if any(row["checksum"] != migration.checksum
+               for row in history.values()):
+            raise MigrationError(
+                f"V{migration.version} changed after it was started")
+        if len(history) == len(migration.steps) and all(
+                row["completed_at"] for row in history.values()):
+            return
+        logger.info({"event": "online_migration_start",
+                     "version": migration.version,
+                     "description": migration.description})
+        start_time = time.perf_counter()
+        for step in migration.steps:
+            row = history.get(step.number)
+            if row is not None and row["completed_at"]:
+                continue
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO online_migrations
+                        (version, step, description, checksum)
+                    VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING;
+                    """, (migration.version, step.number,
+                          migration.description, migration.checksum))
+            conn.commit()
+            step_start = time.perf_counter()
+            try:
+                if step.kind == "transaction":
+                    self._transaction(conn, migration, step)
+                elif step.kind == "concurrently":
+                    self._concurrently(conn, migration, step)
+                else:
+                    self._backfill(conn, migration, step,
+                                   row["last_key"] if row else None)
+            except psycopg2.Error as e:
+                raise MigrationError(
+                    f"V{migration.version} step {step.number} "
+                    f"({step.kind}) failed: "
+                    f"{e.diag.message_primary or str(e).strip()}") from e
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE online_migrations SET completed_at = now()
+                    WHERE version = %s AND step = %s;
+                    """, (migration.version, step.number))
+            conn.commit()
+            logger.info({"event": "online_migration_step",
+                         "version": migration.version,
+                         "step": step.number, "kind": step.kind,
+                         "seconds": round(time.perf_counter() - step_start,
+                                          3)})
+        logger.info({"event": "online_migration_done",
+                     "version": migration.version,
+                     "seconds": round(time.perf_counter() - start_time, 3)})
+
+    def _set_timeouts(self, cur, statement_timeout, local=True):
+        cur.execute("SELECT set_config('lock_timeout', %s, %s), "
+                    "set_config('statement_timeout', %s, %s);",
+                    (f"{int(self.lock_timeout * 1000)}ms", local,
+                     f"{int(statement_timeout * 1000)}ms", local))
+
+    def _retrying(self, conn, attempt, migration, step):
+        """Run `attempt()`, retrying lock timeouts with backoff."""
+        delay = self.backoff
+        for number in range(1, self.retries + 1):
+            try:
+                return attempt()
+            except RETRYABLE as e:
+                if not conn.autocommit:
+                    conn.rollback()
+                logger.warning({"event": "online_migration_retry",
+                                "version": migration.version,
+                                "step": step.number, "attempt": number,
+                                "error": str(e).strip()})
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, self.max_backoff)
+        raise MigrationError(f"V{migration.version} step {step.number} "
+                             f"failed after {self.retries} attempts")
+
+    def _transaction(self, conn, migration, step):
+        def attempt():
+            with conn.cursor() as cur:
+                self._set_timeouts(cur, self.statement_timeout)
+                cur.execute(step.body)
+            conn.commit()
+        self._retrying(conn, attempt, migration, step)
+
+    def _concurrently(self, conn, migration, step):
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                # Index builds take as long as they take; only the lock
+                # waits are bounded
+                self._set_timeouts(cur, 0, local=False)
+            for statement in split_statements(step.body):
+                index = CONCURRENT_INDEX.search(statement)
+
+                def attempt():
+                    with conn.cursor() as cur:
+                        if index:
+                            self._drop_invalid_index(cur, index.group(1))
+                        cur.execute(statement)
+                self._retrying(conn, attempt, migration, step)
+        finally:
+            with conn.cursor() as cur:
+                cur.execute("RESET lock_timeout; RESET statement_timeout;")
+            conn.autocommit = False
+
+    @staticmethod
+    def _drop_invalid_index(cur, name):
+        cur.execute("""
+            SELECT 1 FROM pg_index
+            WHERE indexrelid = to_regclass(%s) AND NOT indisvalid;
+            """, (name,))
+        if cur.fetchone():
+            logger.warning({"event": "online_migration_drop_invalid_index",
+                            "index": name})
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+
+    def _throttle(self, conn, migration):
+        """Wait while replicas lag or the database is busy."""
+        while True:
+            with conn.cursor() as cur:
+                cur.execute(LOAD_QUERY)
+                lag, active = cur.fetchone()
+            conn.commit()
+            if self.max_lag is not None and lag > self.max_lag:
+                reason = f"replication lag {float(lag):.1f}s"
+            elif self.max_active is not None and active > self.max_active:
+                reason = f"{active} active queries"
+            else:
+                return
+            logger.info({"event": "online_migration_throttled",
+                         "version": migration.version, "reason": reason})
+            time.sleep(self.throttle_wait)
+
+    def _backfill(self, conn, migration, step, last_key):
+        table = sql.Identifier(*step.options["table"].split("."))
+        key = sql.Identifier(step.options.get("key", "id"))
+        batch = int(step.options.get("batch", self.batch_size))
+        max_batch = batch * 100
+        skip_triggers = step.options.get("triggers", "fire") == "skip"
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("SELECT min({key}), max({key}) FROM {table};")
+                        .format(key=key, table=table))
+            low, high = cur.fetchone()
+        conn.commit()
+        if high is None:
+            return
+        # The range is fixed when the backfill starts: rows inserted later
+        # must already get the new value from the application or a default
+        start = last_key if last_key is not None else low - 1
+        updated = failures = 0
+        reported = time.monotonic()
+        # Batches are counted in rows, not keys, so gaps in the key range
+        # don't make a batch that lands on dense keys run long
+        next_end = sql.SQL(
+            "SELECT {key} FROM {table} WHERE {key} > %s ORDER BY {key} "
+            "OFFSET %s LIMIT 1;").format(key=key, table=table)
+        while start < high:
+            self._throttle(conn, migration)
+            batch_start = time.perf_counter()
+            try:
+                with conn.cursor() as cur:
+                    self._set_timeouts(cur, self.statement_timeout)
+                    if skip_triggers:
+                        cur.execute("SET LOCAL session_replication_role "
+                                    "= replica;")
+                    cur.execute(next_end, (start, batch - 1))
+                    row = cur.fetchone()
+                    end = min(row[0], high) if row else high
+                    cur.execute(step.body, {"start": start, "end": end})
+                    updated += cur.rowcount
+                    cur.execute("""
+                        UPDATE online_migrations SET last_key = %s
+                        WHERE version = %s AND step = %s;
+                        """, (end, migration.version, step.number))
+                conn.commit()
+            except RETRYABLE as e:
+                conn.rollback()
+                failures += 1
+                if failures > self.retries:
+                    raise MigrationError(
+                        f"V{migration.version} step {step.number} failed "
+                        f"at key {start}: {str(e).strip()}") from e
+                batch = max(1, batch // 2)
+                time.sleep(min(self.backoff * 2 ** failures,
+                               self.max_backoff))
+                continue
+            failures = 0
+            elapsed = time.perf_counter() - batch_start
+            if elapsed < self.batch_seconds / 2:
+                batch = min(batch * 2, max_batch)
+            elif elapsed > self.batch_seconds:
+                batch = max(1, batch // 2)
+            start = end
+            if time.monotonic() - reported >= 10:
+                reported = time.monotonic()
+                logger.info({"event": "online_backfill_progress",
+                             "version": migration.version,
+                             "step": step.number, "key": end, "of": high,
+                             "rows": updated, "batch": batch})
+            if self.pause:
+                time.sleep(self.pause)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("command", choices=("migrate", "info"))
+    parser.add_argument("--dir", default=DEFAULT_DIR,
+                        help="directory of online migrations")
+    parser.add_argument("--lock-timeout", type=float, default=2.0)
+    parser.add_argument("--statement-timeout", type=float, default=60.0)
+    parser.add_argument("--retries", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="initial backfill batch, in rows")
+    parser.add_argument("--batch-seconds", type=float, default=0.2,
+                        help="target duration of one backfill batch")
+    parser.add_argument("--pause", type=float, default=0.0,
+                        help="sleep between backfill batches")
+    parser.add_argument("--max-lag", type=float, default=5.0,
+                        help="pause backfills while replicas lag more")
+    parser.add_argument("--max-active", type=int, default=None,
+                        help="pause backfills while more queries run")
+    args = parser.parse_args()
+
+    import db_students
+    db_students.check_settings()
+    migrator = OnlineMigrator(
+        db_students.connect, lock_timeout=args.lock_timeout,
+        statement_timeout=args.statement_timeout, retries=args.retries,
+        batch_size=args.batch_size, batch_seconds=args.batch_seconds,
+        pause=args.pause, max_lag=args.max_lag, max_active=args.max_active)
+    migrations = load_migrations(args.dir)
+    if args.command == "info":
+        for migration, step, row in migrator.info(migrations):
+            state = ("done" if row and row["completed_at"] else
+                     f"at key {row['last_key']}" if row and row["last_key"]
+                     else "started" if row else "pending")
+            print(f"V{migration.version} {migration.description} "
+                  f"step {step.number} {step.kind}: {state}")
+        return 0
+    try:
+        migrator.migrate(migrations)
+    except (MigrationError, psycopg2.Error) as e:
+        logger.error({"event": "online_migration_failed",
+                      "error": str(e).strip()})
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+On-demand sampling profiler for single requests.
+While a profiled request runs, a background thread samples the Python
+stack of the event loop thread whenever the request's task is the one
+running there, and of the worker threads running its database calls.
+Samples are written in the collapsed-stack format read by flamegraph.pl,
+speedscope and inferno:
+
+    thread;module:function;module:function... count
+
+Code the request hands off to other tasks (the insert batcher, streamed
+response bodies sent from Starlette's threadpool) is not attributed to
+it. Sampling costs one stack walk per interval per profiled request;
+unprofiled requests pay nothing.
+"""
+
+import asyncio
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+_profile = contextvars.ContextVar("request_profile", default=None)
+
+PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class Profile:
+    """Stack samples of one request."""
+
+    def __init__(self, loop, task, loop_thread):
+        self.id = uuid.uuid4().hex
+        self.loop = loop
+        self.task = task
+        self.loop_thread = loop_thread
+        self.workers = set()
+        self.stacks = Counter()
+        self.samples = 0
+
+    def collapsed(self):
+        """The samples as collapsed stacks, one per line."""
+        return "".join(f"{stack} {count}\n"
+                       for stack, count in self.stacks.most_common())
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_qualname}"
+
+
+def _collapse(thread_name, frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    """
+    One sampling thread per process, running only while at least one
+    request is being profiled.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile):
+        with self._lock:
+            self._active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True, name="profiler")
+                self._thread.start()
+
+    def remove(self, profile):
+        with self._lock:
+            self._active.discard(profile)
+
+    def _sample(self, profiles):
+        frames = sys._current_frames()
+        for profile in profiles:
+            if asyncio.current_task(profile.loop) is profile.task:
+                frame = frames.get(profile.loop_thread)
+                if frame is not None:
+                    profile.stacks[_collapse("loop", frame)] += 1
+            for worker in tuple(profile.workers):
+                frame = frames.get(worker)
+                if frame is not None:
+                    profile.stacks[_collapse("db-thread", frame)] += 1
+            profile.samples += 1
+
+    def _run(self):
+        while True:
+            with self._lock:
+                profiles = tuple(self._active)
+                if not profiles:
+                    self._thread = None
+                    return
+            self._sample(profiles)
+            time.sleep(self.interval)
+
+
+def start(sampler):
+    """
+    Start profiling the current request with `sampler`, until it is
+    removed from the sampler. Returns the Profile and a token for reset().
+    """
+    profile = Profile(asyncio.get_running_loop(), asyncio.current_task(),
+                      threading.get_ident())
+    sampler.add(profile)
+    return profile, _profile.set(profile)
+
+
+def reset(token):
+    _profile.reset(token)
+
+
+def current():
+    """This request's Profile, or None when it is not profiled."""
+    return _profile.get()
+
+
+@contextmanager
+def worker():
+    """Sample the current worker thread for the request while in the block."""
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+    ident = threading.get_ident()
+    profile.workers.add(ident)
+    try:
+        yield
+    finally:
+        profile.workers.discard(ident)
+
+
+class ProfileStore:
+    """
+    Profiles written as <id>.folded files in `directory`, keeping the
+    newest `keep`. A directory shared by the workers lets any of them
+    serve a profile.
+    """
+
+    def __init__(self, directory, keep=100):
+        self.directory = directory
+        self.keep = keep
+
+    def _path(self, profile_id):
+        return os.path.join(self.directory, f"{profile_id}.folded")
+
+    def save(self, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(profile.id), "w") as f:
+            f.write(profile.collapsed())
+        saved = sorted(
+            (entry for entry in os.scandir(self.directory)
+             if entry.name.endswith(".folded")),
+            key=lambda entry: entry.stat().st_mtime)
+        for entry in saved[:-self.keep]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def load(self, profile_id):
+        """The collapsed stacks of a saved profile, or None."""
+        if not PROFILE_ID.match(profile_id):
+            return None
+        try:
+            with open(self._path(profile_id)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,118 @@
+"""
+Slow-query log for the data layer.
+Every statement the student cursors run at or over SLOW_QUERY_MS is
+logged as a slow_query event with its SQL, the shape of its parameters
+(types and lengths, never values), its duration and row count. With
+SLOW_QUERY_EXPLAIN enabled, slow SELECTs are run again under
+EXPLAIN (ANALYZE, BUFFERS) and the plan is logged with them.
+
+Prepared statements are logged with their original SQL rather than
+the EXECUTE that ran them. Statements built by execute_values carry
+their values inline; their VALUES lists are left out of the log.
+"""
+
+import os
+import re
+
+import psycopg2
+from psycopg2 import sql
+from loguru import logger
+
+from metrics import DB_SLOW_QUERIES
+
+# A VALUES list with the row values written inline
+_INLINE_VALUES = re.compile(r"VALUES\s*\((?:'(?:[^']|'')*'|[^()'])*\)"
+                            r"(?:\s*,\s*\((?:'(?:[^']|'')*'|[^()'])*\))*",
+                            re.IGNORECASE)
+
+
+def params_shape(params):
+    """Types (and lengths of sequences) of the parameters, not values."""
+    def shape(value):
+        if isinstance(value, (list, tuple)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: shape(value) for key, value in params.items()}
+    return [shape(value) for value in params]
+
+
+def _text(cur, query):
+    if isinstance(query, sql.Composable):
+        return query.as_string(cur)
+    if isinstance(query, bytes):
+        return query.decode("utf-8", "replace")
+    return query
+
+
+def _original(cur, text):
+    """The SQL behind an EXECUTE of a prepared statement."""
+    if not text.startswith("EXECUTE "):
+        return text
+    name = text[len("EXECUTE "):].split(None, 1)[0].rstrip(";")
+    prepared = getattr(cur.connection, "prepared", None) or {}
+    for query, statement_name in prepared.items():
+        if statement_name == name:
+            return " ".join(query.split())
+    return text
+
+
+class SlowQueryLog:
+    def __init__(self, threshold, explain=False, max_sql=2000):
+        self.threshold = threshold
+        self.explain = explain
+        self.max_sql = max_sql
+
+    def _plan(self, cur, text, params):
+        # EXPLAIN ANALYZE executes the statement again, so only reads are
+        # explained, behind a savepoint that keeps a failing EXPLAIN from
+        # aborting the caller's transaction.
+        with cur.connection.cursor() as explain:
+            explain.execute("SAVEPOINT slow_query_explain;")
+            try:
+                explain.execute("EXPLAIN (ANALYZE, BUFFERS) " + text, params)
+                plan = "\n".join(row[0] for row in explain.fetchall())
+                explain.execute("RELEASE SAVEPOINT slow_query_explain;")
+                return plan
+            except psycopg2.Error as e:
+                explain.execute("ROLLBACK TO SAVEPOINT slow_query_explain;")
+                return f"EXPLAIN failed: {str(e).strip()}"
+
+    def record(self, cur, query, params, seconds, failed=False):
+        """Log the statement if it took `threshold` seconds or longer."""
+        if seconds < self.threshold:
+            return
+        DB_SLOW_QUERIES.inc()
+        text = _text(cur, query)
+        original = _original(cur, text)
+        plan = None
+        if (self.explain and not failed
+                and original.lstrip().upper().startswith("SELECT")):
+            plan = self._plan(cur, text, params)
+        logger.warning({
+            "event": "slow_query",
+            "sql": (_INLINE_VALUES.sub("VALUES ...", original)
+                    if params is None else original)[:self.max_sql],
+            "params": params_shape(params),
+            "duration_ms": round(seconds * 1000, 2),
+            "rows": None if failed else cur.rowcount,
+            "failed": failed,
+            "plan": plan
+        })
+
+
+def build_slow_query_log():
+    """
+    Build the slow-query log from the environment, or return None when
+    SLOW_QUERY_MS is 0.
+    """
+    threshold = float(os.getenv("SLOW_QUERY_MS", 500)) / 1000
+    if threshold <= 0:
+        return None
+    return SlowQueryLog(
+        threshold,
+        explain=os.getenv("SLOW_QUERY_EXPLAIN", "").lower() in (
+            "1", "true", "yes"))
@@ -0,0 +1,222 @@
+"""
+Read replica routing for the data layer.
+Reads go to a streaming replica chosen round-robin or by fewest
+connections in use; writes and everything else stay on the primary.
+
+Each request gets a routing state in a context variable (see
+ReadYourWritesMiddleware). All reads of one request go to the same
+replica, so a table version and the rows read after it come from one
+server. A request is pinned to the primary after it writes, and for
+`window` seconds afterwards for the client that wrote. A background
+monitor ejects replicas whose replication lag exceeds `max_lag` and
+takes them back once they catch up. A replica whose WAL receiver is
+not streaming replays nothing new while looking caught up, so it is
+ejected as well.
+"""
+
+import asyncio
+import contextvars
+import itertools
+
+import psycopg2
+from anyio import to_thread
+from loguru import logger
+
+from metrics import DB_READS_ROUTED, REPLICA_LAG, REPLICA_AVAILABLE
+
+_route = contextvars.ContextVar("db_route", default=None)
+
+# Seconds the replica is behind the primary; 0 when it has replayed all
+# WAL it received, which keeps an idle primary from looking like lag.
+# That only holds while WAL is still arriving: `streaming` is false when
+# the WAL receiver is down or reconnecting. Roles without
+# pg_read_all_stats see a NULL status, taken as streaming.
+LAG_QUERY = """
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                THEN 0
+                ELSE EXTRACT(EPOCH FROM
+                             now() - pg_last_xact_replay_timestamp())
+           END AS lag,
+           pg_is_in_recovery() AS standby,
+           EXISTS (SELECT 1 FROM pg_stat_wal_receiver
+                   WHERE COALESCE(status, 'streaming') = 'streaming')
+               AS streaming;
+    """
+
+
+class RouteState:
+    """Where the reads of one request go."""
+
+    __slots__ = ("pinned", "wrote", "replica", "served_by")
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+        # Replica that served the latest read, None for the primary
+        self.served_by = None
+
+
+def start(pinned=False):
+    """Begin routing a request; returns a token for reset()."""
+    return _route.set(RouteState(pinned))
+
+
+def reset(token):
+    _route.reset(token)
+
+
+def current():
+    """This request's RouteState, or None outside a request."""
+    return _route.get()
+
+
+def pinned():
+    """Whether this request's reads must see its client's own writes."""
+    state = _route.get()
+    return state is not None and state.pinned
+
+
+def mark_write():
+    """Record a write: later reads of this request use the primary."""
+    state = _route.get()
+    if state is not None:
+        state.wrote = True
+        state.pinned = True
+
+
+def served(replica):
+    """Record the replica (None: the primary) that served a read."""
+    state = _route.get()
+    if state is not None:
+        state.served_by = replica
+
+
+def parse_hosts(value, default_port="5432"):
+    """Parse "host[:port],..." into [(host, port)]."""
+    hosts = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if item:
+            host, _, port = item.partition(":")
+            hosts.append((host, port or default_port))
+    return hosts
+
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        # Unproven until the monitor has measured its lag
+        self.healthy = False
+        self.lag = None
+
+
+class ReplicaRouter:
+    """
+    Picks the replica for a read: `round_robin` over the healthy
+    replicas, or `least_loaded` by connections in use.
+    """
+
+    def __init__(self, replicas, selection="round_robin"):
+        if selection not in ("round_robin", "least_loaded"):
+            raise ValueError(f"Unknown replica selection: {selection}")
+        self.replicas = list(replicas)
+        self.selection = selection
+        self._turn = itertools.count()
+
+    def choose(self):
+        candidates = [r for r in self.replicas if r.healthy]
+        if not candidates:
+            return None
+        if self.selection == "least_loaded":
+            return min(candidates, key=lambda r: r.pool.stats()["in_use"])
+        return candidates[next(self._turn) % len(candidates)]
+
+    def for_read(self):
+        """The replica for a read in this context, or None for primary."""
+        state = _route.get()
+        if state is not None and state.pinned:
+            replica = None
+        elif (state is not None and state.replica is not None
+                and state.replica.healthy):
+            replica = state.replica
+        else:
+            replica = self.choose()
+            if state is not None:
+                state.replica = replica
+        DB_READS_ROUTED.labels(
+            target=replica.name if replica else "primary").inc()
+        return replica
+
+    def eject(self, replica, reason):
+        """Stop routing to `replica` until the monitor readmits it."""
+        if replica.healthy:
+            logger.warning({"event": "replica_ejected",
+                            "replica": replica.name, "reason": reason})
+        replica.healthy = False
+        REPLICA_AVAILABLE.labels(replica=replica.name).set(0)
+
+
+class ReplicaMonitor:
+    """
+    Measures every replica's lag each `interval` seconds. Replicas over
+    `max_lag` seconds, unreachable, not streaming WAL from the primary or
+    no longer in recovery are ejected from routing; they are readmitted
+    once streaming again within `max_lag`.
+    """
+
+    def __init__(self, router, interval=1.0, max_lag=5.0):
+        self.router = router
+        self.interval = interval
+        self.max_lag = max_lag
+        self._task = None
+
+    @staticmethod
+    def _measure(replica):
+        with replica.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(LAG_QUERY)
+                lag, standby, streaming = cur.fetchone()
+        return (float(lag) if lag is not None else None), standby, streaming
+
+    async def check(self):
+        for replica in self.router.replicas:
+            try:
+                lag, standby, streaming = await to_thread.run_sync(
+                    self._measure, replica)
+            except psycopg2.Error as e:
+                self.router.eject(replica, str(e).strip())
+                continue
+            replica.lag = lag
+            if lag is not None:
+                REPLICA_LAG.labels(replica=replica.name).set(lag)
+            if not standby:
+                self.router.eject(replica, "not in recovery")
+            elif not streaming:
+                self.router.eject(replica, "WAL receiver not streaming")
+            elif lag is None or lag > self.max_lag:
+                self.router.eject(replica, f"replication lag {lag}s")
+            elif not replica.healthy:
+                logger.info({"event": "replica_admitted",
+                             "replica": replica.name, "lag": lag})
+                replica.healthy = True
+                REPLICA_AVAILABLE.labels(replica=replica.name).set(1)
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
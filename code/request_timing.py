@@ -0,0 +1,123 @@
+"""
+Per-request timing breakdown for the Server-Timing header.
+ServerTimingMiddleware gives a request a Timings object in a context
+variable; anyio copies it into the worker threads that run db_students,
+so every layer adds its time to the same object:
+
+    queue       waiting for an admission slot
+    validation  reading, parsing and validating the request
+    db_wait     waiting for a database thread and a pooled connection
+    db          executing statements
+    fetch       building result rows
+    serialize   rendering JSON responses
+    log         writing log records on the request's threads
+
+Outside a timed request every call here is a no-op.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from fastapi.routing import APIRoute
+
+PHASES = ("queue", "validation", "db_wait", "db", "fetch", "serialize",
+          "log")
+
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class Timings:
+    """Seconds spent in each phase of one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.route_started = None
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        # Worker threads of the request add concurrently with the loop
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.durations[phase] += seconds
+
+    def header(self):
+        """Server-Timing value, in milliseconds, up to this moment."""
+        total = time.perf_counter() - self.started
+        return ", ".join(
+            [f"{phase};dur={seconds * 1000:.2f}"
+             for phase, seconds in self.durations.items() if seconds]
+            + [f"total;dur={total * 1000:.2f}"])
+
+
+def start():
+    """Begin timing a request; returns a token for reset()."""
+    return _timings.set(Timings())
+
+
+def reset(token):
+    _timings.reset(token)
+
+
+def current():
+    """This request's Timings, or None when it is not timed."""
+    return _timings.get()
+
+
+def add(phase, seconds):
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to `phase`."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - start_time)
+
+
+def _validated():
+    timings = _timings.get()
+    if timings is not None and timings.route_started is not None:
+        timings.add("validation",
+                    time.perf_counter() - timings.route_started)
+
+
+class TimedRoute(APIRoute):
+    """
+    APIRoute that records the time from the start of its handler, which
+    reads the body and solves the parameters, to the endpoint call.
+    """
+
+    def get_route_handler(self):
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+            @wraps(call)
+            async def endpoint(*args, **kwargs):
+                _validated()
+                return await call(*args, **kwargs)
+        else:
+            @wraps(call)
+            def endpoint(*args, **kwargs):
+                _validated()
+                return call(*args, **kwargs)
+        self.dependant.call = endpoint
+        handler = super().get_route_handler()
+
+        async def app(request):
+            timings = _timings.get()
+            if timings is not None:
+                timings.route_started = time.perf_counter()
+            return await handler(request)
+        return app
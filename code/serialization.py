@@ -0,0 +1,62 @@
+"""
+Fast JSON encoding for responses and log records.
+Uses orjson when it is installed and falls back to the standard library
+with the same compact output otherwise. Database rows are already
+JSON-native, so they are written straight to bytes without a
+jsonable_encoder pass.
+"""
+
+import json
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import request_timing
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def _default(obj):
+    # Only reached for values that are not JSON-native (datetime under the
+    # stdlib fallback, Decimal, pydantic models...).
+    return jsonable_encoder(obj)
+
+
+if orjson is not None:
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def dumps(obj) -> bytes:
+        """Serialize `obj` to compact UTF-8 JSON bytes."""
+        return orjson.dumps(obj, default=_default)
+
+    def loads(data):
+        """Parse JSON from bytes or str."""
+        return orjson.loads(data)
+else:
+    JSONDecodeError = json.JSONDecodeError
+
+    def dumps(obj) -> bytes:
+        """Serialize `obj` to compact UTF-8 JSON bytes."""
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":"),
+                          default=_default).encode("utf-8")
+
+    def loads(data):
+        """Parse JSON from bytes or str."""
+        return json.loads(data)
+
+
+def dumps_str(obj) -> str:
+    """Serialize `obj` to a compact JSON string."""
+    return dumps(obj).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse that renders through `dumps`."""
+
+    def render(self, content) -> bytes:
+        with request_timing.timed("serialize"):
+            return dumps(content)
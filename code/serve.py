@@ -0,0 +1,54 @@
+"""
+Production entry point for the student API.
+Starts uvicorn with WEB_CONCURRENCY worker processes. With more than one
+worker, Prometheus runs in multiprocess mode so /metrics aggregates the
+counters of every worker, and each worker sizes its database pool from
+its share of POSTGRES_CONNECTION_BUDGET.
+
+Send SIGHUP to restart the workers one at a time without dropping the
+listening socket.
+"""
+
+import os
+import shutil
+import tempfile
+
+import uvicorn
+from dotenv import load_dotenv
+
+
+def prepare_multiprocess_metrics():
+    """
+    Point every worker at one empty metrics directory. This must happen
+    before any worker imports prometheus_client.
+    """
+    metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not metrics_dir:
+        metrics_dir = os.path.join(tempfile.gettempdir(), "prometheus")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    # Files left by a previous run would be merged into the new totals.
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def main():
+    load_dotenv()
+    port = int(os.getenv("PORT", 8000))
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    # Workers read the count back to size their share of the DB budget.
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    if workers > 1:
+        prepare_multiprocess_metrics()
+    uvicorn.run(
+        "Main:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="0.0.0.0",
+        port=port,
+        workers=workers,
+        timeout_graceful_shutdown=int(
+            os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", 30)),
+    )
+
+
+if __name__ == "__main__":
+    main()
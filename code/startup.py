@@ -0,0 +1,56 @@
+"""
+Cold-start timing for an API worker.
+Records when the process finished importing the application, started
+serving and first reached the database, in seconds since the process
+started, so startup regressions can be tracked from release to release.
+"""
+
+import os
+import time
+
+from loguru import logger
+
+from metrics import STARTUP_SECONDS
+
+
+def _process_started():
+    """Wall-clock start of this process, from /proc where available."""
+    try:
+        with open("/proc/self/stat") as f:
+            # starttime is field 22, in clock ticks since boot
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+PROCESS_STARTED = _process_started()
+_phases = {}
+
+
+def mark(phase):
+    """
+    Record that `phase` has been reached. Only the first call per phase
+    counts; returns whether this call recorded it.
+    """
+    if phase in _phases:
+        return False
+    seconds = round(time.time() - PROCESS_STARTED, 3)
+    _phases[phase] = seconds
+    STARTUP_SECONDS.labels(phase=phase).set(seconds)
+    return True
+
+
+def mark_ready():
+    """Record the first successful database check and log the report."""
+    if mark("ready"):
+        logger.info({"event": "startup_report", "pid": os.getpid(),
+                     **report()})
+
+
+def report():
+    """Seconds from process start to each phase reached so far."""
+    return {f"{phase}_seconds": seconds
+            for phase, seconds in _phases.items()}
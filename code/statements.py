@@ -0,0 +1,78 @@
+"""
+Server-side prepared statements for the student queries.
+Each pooled connection keeps a small LRU of the statements it has
+prepared, so a query is parsed and planned by Postgres once per
+connection and afterwards run with EXECUTE. Queries are written with
+the usual %s placeholders and the cache is keyed by the query text.
+
+Prepared statements live in the database session, which does not
+survive a transaction-mode connection pooler such as PgBouncer; set
+POSTGRES_STATEMENT_CACHE_SIZE=0 in that setup to send plain SQL.
+"""
+
+import hashlib
+import re
+from collections import OrderedDict
+from itertools import count
+
+from psycopg2.extensions import connection as _connection
+
+
+class PreparingConnection(_connection):
+    """psycopg2 connection that tracks its own prepared statements."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = OrderedDict()
+
+
+def _statement_name(query):
+    return "s_" + hashlib.sha1(query.encode("utf-8")).hexdigest()[:16]
+
+
+_PLACEHOLDER = re.compile(r"%%|%s")
+
+
+def _numbered(query):
+    """
+    Rewrite %s placeholders as $1, $2, ... for PREPARE and unescape %%,
+    which psycopg2 only does when it interpolates parameters itself.
+    Both are read left to right, so "%%s" stays a literal "%s".
+    """
+    positions = count(1)
+
+    def replace(match):
+        return "%" if match.group() == "%%" else f"${next(positions)}"
+    return _PLACEHOLDER.sub(replace, query.rstrip().rstrip(";"))
+
+
+def execute(cur, query, params=(), cache_size=64):
+    """
+    Run `query` with `params` on `cur` as a prepared statement, preparing
+    it on this connection first if needed. With `cache_size` 0, or on a
+    connection that is not a PreparingConnection, the query is sent as
+    plain SQL instead.
+    """
+    conn = cur.connection
+    prepared = getattr(conn, "prepared", None)
+    if not cache_size or prepared is None:
+        cur.execute(query, params)
+        return
+    name = prepared.get(query)
+    if name is None:
+        while len(prepared) >= cache_size:
+            oldest = next(iter(prepared))
+            cur.execute(f"DEALLOCATE {prepared[oldest]};")
+            del prepared[oldest]
+        name = _statement_name(query)
+        # PREPARE is not undone by a rollback, so recording it right away
+        # is safe even if the surrounding transaction fails later.
+        cur.execute(f"PREPARE {name} AS {_numbered(query)}")
+        prepared[query] = name
+    else:
+        prepared.move_to_end(query)
+    if params:
+        placeholders = ", ".join(["%s"] * len(params))
+        cur.execute(f"EXECUTE {name} ({placeholders});", params)
+    else:
+        cur.execute(f"EXECUTE {name};")
@@ -0,0 +1,206 @@
+"""
+Read-through cache for single-student lookups.
+An in-process LRU/TTL tier sits in front of an optional shared tier
+(Redis, or any object with the same async get/set/delete interface).
+Concurrent misses on the same key are coalesced into one load, and
+writes invalidate entries by student ID. Rows read from a replica may
+already be behind a write the invalidation has passed, so they are kept
+only in the local tier, and only briefly. An invalidation only reaches
+the local tier of the worker that wrote, so with several workers that
+tier keeps entries for STUDENT_CACHE_WORKER_TTL at most.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import (CACHE_HITS, CACHE_MISSES, CACHE_COALESCED,
+                     CACHE_EVICTIONS, CACHE_INVALIDATIONS)
+from serialization import dumps, loads
+
+_MISSING = object()
+# Result of a load whose leader was cancelled: waiters load it themselves
+_RETRY = object()
+
+
+class LocalCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after ttl."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                CACHE_EVICTIONS.labels(reason="expired").inc()
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store `value` for `ttl` seconds, at most the cache's ttl."""
+        if ttl is None or ttl > self.ttl:
+            ttl = self.ttl
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                CACHE_EVICTIONS.labels(reason="size").inc()
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache:
+    """
+    Shared tier backed by Redis. Values are stored as JSON.
+    Any object exposing the same async get/set/delete methods, such as a
+    dict-backed fake in tests, can be used in its place.
+    """
+
+    def __init__(self, url, ttl, prefix="student:"):
+        import redis.asyncio as redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    async def get(self, key):
+        value = await self._client.get(self.prefix + str(key))
+        return _MISSING if value is None else loads(value)
+
+    async def set(self, key, value):
+        await self._client.set(self.prefix + str(key), dumps(value),
+                               ex=self.ttl)
+
+    async def delete(self, key):
+        await self._client.delete(self.prefix + str(key))
+
+
+class _Flight:
+    """One in-flight load that concurrent callers wait on."""
+
+    def __init__(self):
+        self.future = asyncio.get_running_loop().create_future()
+        self.stale = False
+
+
+class ReadThroughCache:
+    """
+    Looks a key up in the local tier, then the shared tier, then calls the
+    loader. Only one load per key runs at a time; a write that invalidates
+    the key while a load is in flight keeps that result out of the cache.
+    If the request running a load is cancelled, one of its waiters loads
+    the key again. Values the loader read from a replica live in the local
+    tier for at most `replica_ttl` seconds, and are not cached when it is
+    0.
+    """
+
+    def __init__(self, local, shared=None, replica_ttl=0.0):
+        self.local = local
+        self.shared = shared
+        self.replica_ttl = replica_ttl
+        self._flights = {}
+
+    async def get_or_load(self, key, loader):
+        """
+        Return the cached value for `key`, or await `loader` on a miss.
+        `loader` must return (value, source): source is "primary",
+        "replica", or None for a value that must not be cached.
+        """
+        while True:
+            value = self.local.get(key)
+            if value is not _MISSING:
+                CACHE_HITS.labels(tier="local").inc()
+                return value
+
+            flight = self._flights.get(key)
+            if flight is None:
+                break
+            CACHE_COALESCED.inc()
+            value = await asyncio.shield(flight.future)
+            if value is not _RETRY:
+                return value
+
+        flight = self._flights[key] = _Flight()
+        try:
+            value = _MISSING
+            if self.shared is not None:
+                value = await self.shared.get(key)
+            if value is not _MISSING:
+                CACHE_HITS.labels(tier="shared").inc()
+                source = "primary"
+            else:
+                CACHE_MISSES.inc()
+                value, source = await loader()
+                if (source == "primary" and not flight.stale
+                        and self.shared is not None):
+                    await self.shared.set(key, value)
+            if not flight.stale:
+                if source == "primary":
+                    self.local.set(key, value)
+                elif source == "replica" and self.replica_ttl > 0:
+                    self.local.set(key, value, self.replica_ttl)
+            flight.future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # The leader's request went away; the waiters' haven't
+            flight.future.set_result(_RETRY)
+            raise
+        except Exception as e:
+            flight.future.set_exception(e)
+            # Waiters re-raise it; don't warn when there are none.
+            flight.future.exception()
+            raise
+        finally:
+            self._flights.pop(key, None)
+
+    async def invalidate(self, key):
+        CACHE_INVALIDATIONS.inc()
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.stale = True
+        self.local.delete(key)
+        if self.shared is not None:
+            await self.shared.delete(key)
+
+
+def build_student_cache():
+    """
+    Build the student cache from the environment, or return None when
+    STUDENT_CACHE_SIZE is 0.
+    """
+    size = int(os.getenv("STUDENT_CACHE_SIZE", 10000))
+    if size <= 0:
+        return None
+    ttl = float(os.getenv("STUDENT_CACHE_TTL", 30))
+    # Other workers never hear of this one's writes, so their copies are
+    # as stale as the local ttl allows
+    if int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+        ttl = min(ttl, float(os.getenv("STUDENT_CACHE_WORKER_TTL", 1)))
+    local = LocalCache(size, ttl)
+    shared = None
+    redis_url = os.getenv("STUDENT_CACHE_REDIS_URL")
+    if redis_url:
+        shared = RedisCache(
+            redis_url, int(os.getenv("STUDENT_CACHE_SHARED_TTL", 300)))
+    # A replica row is at most the lag limit behind when it is read; kept
+    # for half the limit, it is never served more than 1.5 times as stale
+    return ReadThroughCache(local, shared, replica_ttl=float(
+        os.getenv("POSTGRES_REPLICA_MAX_LAG", 5)) / 2)
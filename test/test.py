@@ -35,6 +35,78 @@ class TestStudentDetailsAPI(unittest.TestCase):
         response = requests.get(self.url + 'GetAllStudents')
         self.assertEqual(response.status_code, 200)
 
+    def test_getstudents_paginated(self):
+        response = requests.get(self.url + 'GetAllStudents',
+                                params={'limit': 1, 'fields': 'name'})
+        self.assertEqual(response.status_code, 200)
+        students = response.json()
+        self.assertLessEqual(len(students), 1)
+        for student in students:
+            self.assertEqual(set(student), {'id', 'name'})
+
+    def test_getstudents_stream(self):
+        response = requests.get(self.url + 'GetAllStudents',
+                                params={'stream': 'ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-type'],
+                         'application/x-ndjson')
+
+    def test_bulk_create_students(self):
+        body = ('{"name": "Foo", "email": "foo.bulk@example.com", '
+                '"age": 20, "phone": "1234567890"}\n'
+                '{"name": "Bar", "email": "not-an-email", '
+                '"age": 20, "phone": "1234567890"}\n')
+        response = requests.post(
+            self.url + 'v2/students/bulk', data=body,
+            headers={'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(response.status_code, 200)
+        response_data = response.json()
+        self.assertEqual(response_data['inserted'], 1)
+        self.assertEqual(response_data['errors'][0]['row'], 1)
+        requests.delete(f"{self.url}v2/DeleteStudent?id="
+                        f"{response_data['student_ids'][0]}")
+
+    def test_search_students(self):
+        response = requests.get(self.url + 'v2/students/search',
+                                params={'email': 'FOO@example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s['id'] for s in response.json()],
+                         [TestStudentDetailsAPI.student_id])
+        response = requests.get(self.url + 'v2/students/search',
+                                params={'name': 'fo', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.json()), 1)
+        response = requests.get(self.url + 'v2/students/search')
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_students(self):
+        student_id = TestStudentDetailsAPI.student_id
+        response = requests.post(self.url + 'v2/students:batchGet',
+                                 json={'ids': [student_id, 0]})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results],
+                         ['success', 'error'])
+        response = requests.post(
+            self.url + 'v2/students:batchUpdate',
+            json={'students': [{'id': student_id, 'age': 21}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['status'], 'success')
+        response = requests.post(self.url + 'v2/students:batchDelete',
+                                 json={'ids': [0]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['status'], 'error')
+
+    def test_health_probes(self):
+        response = requests.get(self.url + 'livez')
+        self.assertEqual(response.status_code, 200)
+        response = requests.get(self.url + 'readyz')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pool', response.json()['database'])
+        response = requests.get(self.url + 'HealthCheck')
+        startup = response.json()['components']['application']['startup']
+        self.assertIn('ready_seconds', startup)
+
     def test_GetStudenbyid(self):
         if not hasattr(TestStudentDetailsAPI, 'student_id'):
             self.skipTest("No student ID available for test_GetStudent")
@@ -58,6 +130,104 @@ class TestStudentDetailsAPI(unittest.TestCase):
                          f'''Expected status code 200 but got
                          {response.status_code}''')
 
+    def test_update_if_match(self):
+        student_id = TestStudentDetailsAPI.student_id
+        response = requests.get(f"{self.url}GetStudent?id={student_id}")
+        etag = response.headers['ETag']
+        url = f"{self.url}v2/UpdateStudent?id={student_id}"
+        response = requests.patch(url, json={'age': 30},
+                                  headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['student']['age'], 30)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        response = requests.patch(url, json={'age': 31},
+                                  headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.json()['student']['age'], 30)
+        # A weak tag never satisfies If-Match, even for the current version
+        current = response.headers['ETag']
+        response = requests.patch(url, json={'age': 31},
+                                  headers={'If-Match': 'W/' + current})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.headers['ETag'], current)
+
+    def test_conditional_get(self):
+        student_id = TestStudentDetailsAPI.student_id
+        url = f"{self.url}GetStudent?id={student_id}"
+        response = requests.get(url)
+        etag = response.headers['ETag']
+        modified = response.headers['Last-Modified']
+        response = requests.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = requests.get(url, headers={'If-Modified-Since': modified})
+        self.assertEqual(response.status_code, 304)
+        url = self.url + 'GetAllStudents?limit=10'
+        etag = requests.get(url).headers['ETag']
+        response = requests.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        requests.patch(f"{self.url}v2/UpdateStudent?id={student_id}",
+                       json={'age': 26})
+        response = requests.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_compression(self):
+        response = requests.get(self.url + 'openapi.json',
+                                headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('paths', response.json())
+        response = requests.get(self.url + 'livez',
+                                headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_server_timing(self):
+        token = os.getenv('DEBUG_TOKEN')
+        if not token:
+            self.skipTest("DEBUG_TOKEN is not set")
+        response = requests.get(self.url + 'GetAllStudents',
+                                params={'limit': 1},
+                                headers={'X-Debug-Token': token})
+        self.assertIn('total;dur=', response.headers['Server-Timing'])
+        url = f"{self.url}debug/profiles/{response.headers['X-Profile-Id']}"
+        response = requests.get(url, headers={'X-Debug-Token': token})
+        self.assertEqual(response.status_code, 200)
+        response = requests.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_read_your_writes(self):
+        database = requests.get(
+            self.url + 'HealthCheck').json()['components']['database']
+        if 'replicas' not in database:
+            self.skipTest("No read replicas configured")
+        student_id = TestStudentDetailsAPI.student_id
+        session = requests.Session()
+        response = session.patch(
+            f"{self.url}v2/UpdateStudent?id={student_id}", json={'age': 27})
+        self.assertIn('db_primary_until', session.cookies)
+        response = session.get(f"{self.url}GetStudent?id={student_id}")
+        self.assertEqual(response.json()['age'], 27)
+
+    def test_change_feed(self):
+        student_id = TestStudentDetailsAPI.student_id
+        url = self.url + 'v2/students/changes'
+        cursor = None
+        while True:
+            response = requests.get(url, params={'since': cursor,
+                                                 'limit': 1000})
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            cursor = page['next_cursor']
+            if not page['has_more']:
+                break
+        requests.patch(f"{self.url}v2/UpdateStudent?id={student_id}",
+                       json={'age': 25})
+        response = requests.get(url, params={'since': cursor, 'wait': 5})
+        self.assertEqual(response.status_code, 200)
+        changes = response.json()['changes']
+        self.assertIn(('update', student_id),
+                      [(c['op'], c['id']) for c in changes])
+        response = requests.get(url, params={'since': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
     def test_DeleteStudent(self):
         if not hasattr(TestStudentDetailsAPI, 'student_id'):
             self.skipTest("No student ID available for test_DeleteStudent")
@@ -74,7 +244,19 @@ if __name__ == "__main__":
     suite.addTest(TestStudentDetailsAPI('test_post_studentdetails'))
     suite.addTest(TestStudentDetailsAPI('test_GetStudenbyid'))
     suite.addTest(TestStudentDetailsAPI('test_getALLstudentdetails'))
+    suite.addTest(TestStudentDetailsAPI('test_getstudents_paginated'))
+    suite.addTest(TestStudentDetailsAPI('test_getstudents_stream'))
+    suite.addTest(TestStudentDetailsAPI('test_bulk_create_students'))
+    suite.addTest(TestStudentDetailsAPI('test_search_students'))
+    suite.addTest(TestStudentDetailsAPI('test_batch_students'))
+    suite.addTest(TestStudentDetailsAPI('test_health_probes'))
     suite.addTest(TestStudentDetailsAPI('test_Update'))
+    suite.addTest(TestStudentDetailsAPI('test_update_if_match'))
+    suite.addTest(TestStudentDetailsAPI('test_conditional_get'))
+    suite.addTest(TestStudentDetailsAPI('test_compression'))
+    suite.addTest(TestStudentDetailsAPI('test_server_timing'))
+    suite.addTest(TestStudentDetailsAPI('test_read_your_writes'))
+    suite.addTest(TestStudentDetailsAPI('test_change_feed'))
     suite.addTest(TestStudentDetailsAPI('test_DeleteStudent'))
     runner = unittest.TextTestRunner()
     runner.run(suite)
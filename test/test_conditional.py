@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+from conditional import NO_MATCH, none_match, parse_if_match  # noqa: E402
+
+
+class TestIfMatch(unittest.TestCase):
+
+    def test_strong_tag_gives_version(self):
+        self.assertEqual(parse_if_match('"7"'), 7)
+
+    def test_any_only_requires_the_row(self):
+        self.assertIsNone(parse_if_match(" * "))
+        self.assertIsNone(parse_if_match(None))
+
+    def test_weak_tag_never_matches(self):
+        self.assertEqual(parse_if_match('W/"7"'), NO_MATCH)
+
+    def test_malformed_tags_are_rejected(self):
+        for value in ('"abc"', '"1", "2"', ","):
+            with self.assertRaises(ValueError):
+                parse_if_match(value)
+
+
+class TestIfNoneMatch(unittest.TestCase):
+
+    def test_weak_comparison(self):
+        self.assertTrue(none_match('W/"7"', '"7"'))
+        self.assertTrue(none_match('"6", "7"', '"7"'))
+        self.assertTrue(none_match("*", '"7"'))
+        self.assertFalse(none_match('"6"', '"7"'))
+        self.assertFalse(none_match(None, '"7"'))
+
+
+if __name__ == "__main__":
+    unittest.main()
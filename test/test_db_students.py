@@ -0,0 +1,80 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+import db_students  # noqa: E402
+import deadlines  # noqa: E402
+
+
+class FakeConnection:
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakeCursor:
+    """
+    Records statements the way _DeadlineCursor sends them: a pending
+    SET LOCAL goes out with the next statement only.
+    """
+
+    def __init__(self):
+        self.pending = db_students._timeout_statement()
+        self.sent = []
+
+    def execute(self, query, params=None):
+        prefix, self.pending = self.pending, None
+        self.sent.append((prefix or "") + query)
+
+
+def insert_values(cur, query, values, **kwargs):
+    """execute_values stand-in whose multi-row insert hits a duplicate."""
+    cur.execute("INSERT")
+    if len(values) > 1:
+        raise psycopg2.IntegrityError("duplicate key")
+    return [{"id": 1}]
+
+
+class Student:
+    name, email, age, phone = "A", "a@example.com", 20, "1234567890"
+
+
+class TestStatementTimeout(unittest.TestCase):
+
+    def test_savepoint_retry_is_bounded(self):
+        token = deadlines.start(5)
+        try:
+            cur = FakeCursor()
+            with mock.patch.object(db_students, "execute_values",
+                                   insert_values):
+                ids, errors = db_students._insert_rows(
+                    FakeConnection(), cur, [Student(), Student()])
+        finally:
+            deadlines.reset(token)
+        self.assertEqual(ids, [1, 1])
+        self.assertTrue(cur.sent[0].startswith("SET LOCAL statement_timeout"))
+        # The retry after the rollback is a new transaction
+        self.assertTrue(cur.sent[1].startswith("SET LOCAL statement_timeout"))
+        self.assertTrue(cur.sent[1].endswith("SAVEPOINT bulk_row;"))
+
+    def test_no_timeout_without_deadline(self):
+        self.assertIsNone(db_students._timeout_statement())
+
+    def test_timeout_is_never_zero(self):
+        token = deadlines.start(0.0001)
+        try:
+            self.assertEqual(db_students._timeout_statement(),
+                             "SET LOCAL statement_timeout = 1; ")
+        finally:
+            deadlines.reset(token)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import asyncio
+import contextvars
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+import deadlines  # noqa: E402
+from insert_batcher import InsertBatcher, UNEXPECTED_ERROR  # noqa: E402
+
+caller = contextvars.ContextVar("caller", default=None)
+
+
+class FakeFlush:
+    """Records each batch and the context it was flushed in."""
+
+    def __init__(self):
+        self.batches = []
+        self.remaining = []
+        self.callers = []
+
+    async def __call__(self, students):
+        self.batches.append(list(students))
+        self.remaining.append(deadlines.remaining())
+        self.callers.append(caller.get())
+        return [{"status": "success", "student_id": {"id": student}}
+                for student in students]
+
+
+async def insert(batcher, student, timeout=None, name=None):
+    """Insert from a request context of its own, as the API does."""
+    token = deadlines.start(timeout)
+    caller.set(name)
+    try:
+        return await batcher.insert(student)
+    finally:
+        deadlines.reset(token)
+
+
+class TestInsertBatcher(unittest.TestCase):
+
+    def test_concurrent_inserts_share_one_flush(self):
+        async def scenario():
+            flush = FakeFlush()
+            batcher = InsertBatcher(flush, window=0.01)
+            results = await asyncio.gather(
+                *(insert(batcher, n) for n in range(3)))
+            return flush, results
+        flush, results = asyncio.run(scenario())
+        self.assertEqual(flush.batches, [[0, 1, 2]])
+        self.assertEqual([r["student_id"]["id"] for r in results], [0, 1, 2])
+
+    def test_full_batch_flushes_at_once(self):
+        async def scenario():
+            flush = FakeFlush()
+            batcher = InsertBatcher(flush, window=60, max_rows=2)
+            await asyncio.wait_for(asyncio.gather(
+                insert(batcher, 1), insert(batcher, 2)), 1)
+            return flush
+        self.assertEqual(asyncio.run(scenario()).batches, [[1, 2]])
+
+    def test_batch_runs_under_latest_deadline(self):
+        async def scenario():
+            flush = FakeFlush()
+            batcher = InsertBatcher(flush, window=0.01)
+            await asyncio.gather(insert(batcher, 1, 0.5, "first"),
+                                 insert(batcher, 2, 5, "second"))
+            return flush
+        flush = asyncio.run(scenario())
+        self.assertGreater(flush.remaining[0], 4)
+        # Nothing else from the opening caller's context leaks in
+        self.assertEqual(flush.callers, [None])
+
+    def test_caller_without_deadline_lifts_it(self):
+        async def scenario():
+            flush = FakeFlush()
+            batcher = InsertBatcher(flush, window=0.01)
+            await asyncio.gather(insert(batcher, 1, 0.5),
+                                 insert(batcher, 2))
+            return flush
+        self.assertEqual(asyncio.run(scenario()).remaining, [None])
+
+    def test_failed_flush_answers_every_caller(self):
+        async def failing(students):
+            raise RuntimeError("connection lost")
+
+        async def scenario():
+            batcher = InsertBatcher(failing, window=0.01)
+            return await asyncio.gather(insert(batcher, 1),
+                                        insert(batcher, 2))
+        self.assertEqual(asyncio.run(scenario()), [UNEXPECTED_ERROR] * 2)
+
+    def test_cancelled_caller_leaves_others_their_result(self):
+        async def scenario():
+            flush = FakeFlush()
+            batcher = InsertBatcher(flush, window=0.05)
+            gone = asyncio.create_task(insert(batcher, 1))
+            kept = asyncio.create_task(insert(batcher, 2))
+            await asyncio.sleep(0)
+            gone.cancel()
+            return flush, await kept
+        flush, result = asyncio.run(scenario())
+        self.assertEqual(result["student_id"]["id"], 2)
+        self.assertEqual(flush.batches, [[1, 2]])
+
+    def test_stop_flushes_queued_rows(self):
+        async def scenario():
+            flush = FakeFlush()
+            batcher = InsertBatcher(flush, window=60)
+            task = asyncio.create_task(insert(batcher, 1))
+            await asyncio.sleep(0)
+            await batcher.stop()
+            return flush, await task
+        flush, result = asyncio.run(scenario())
+        self.assertEqual(flush.batches, [[1]])
+        self.assertEqual(result["student_id"]["id"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+import deadlines  # noqa: E402
+from middleware import AdmissionMiddleware  # noqa: E402
+
+
+def request(path="/"):
+    return {"type": "http", "method": "GET", "path": path, "headers": []}
+
+
+async def call(app, scope):
+    """Run `app` on `scope`; returns (status, body chunks)."""
+    messages = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    status = next(m["status"] for m in messages
+                  if m["type"] == "http.response.start")
+    body = [m.get("body", b"") for m in messages
+            if m["type"] == "http.response.body"]
+    return status, body
+
+
+def streaming_app(chunks, delay):
+    """Sends `chunks` body chunks, `delay` seconds apart."""
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": []})
+        for i in range(chunks):
+            await asyncio.sleep(delay)
+            await send({"type": "http.response.body", "body": b"x",
+                        "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    return app
+
+
+def blocking_app(release):
+    """Answers 200 once `release` is set."""
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+    return app
+
+
+class TestAdmissionShedding(unittest.TestCase):
+
+    def test_full_queue_is_shed(self):
+        async def scenario():
+            release = asyncio.Event()
+            app = AdmissionMiddleware(blocking_app(release),
+                                      max_in_flight=1, max_queue=0)
+            first = asyncio.create_task(call(app, request()))
+            await asyncio.sleep(0)
+            status, _ = await call(app, request())
+            release.set()
+            return status, (await first)[0]
+        self.assertEqual(asyncio.run(scenario()), (503, 200))
+
+    def test_queue_timeout_is_shed(self):
+        async def scenario():
+            release = asyncio.Event()
+            app = AdmissionMiddleware(blocking_app(release),
+                                      max_in_flight=1, max_queue=1,
+                                      queue_timeout=0.05)
+            first = asyncio.create_task(call(app, request()))
+            await asyncio.sleep(0)
+            status, _ = await call(app, request())
+            release.set()
+            await first
+            return status
+        self.assertEqual(asyncio.run(scenario()), 503)
+
+    def test_queued_request_runs_when_a_slot_frees(self):
+        async def scenario():
+            release = asyncio.Event()
+            app = AdmissionMiddleware(blocking_app(release),
+                                      max_in_flight=1, max_queue=1)
+            first = asyncio.create_task(call(app, request()))
+            second = asyncio.create_task(call(app, request()))
+            await asyncio.sleep(0.01)
+            release.set()
+            return [(await task)[0] for task in (first, second)]
+        self.assertEqual(asyncio.run(scenario()), [200, 200])
+
+    def test_exempt_path_is_never_shed(self):
+        async def scenario():
+            release = asyncio.Event()
+            app = AdmissionMiddleware(blocking_app(release),
+                                      max_in_flight=1, max_queue=0,
+                                      exempt=("/livez",))
+            first = asyncio.create_task(call(app, request()))
+            await asyncio.sleep(0)
+            release.set()
+            status, _ = await call(app, request("/livez"))
+            await first
+            return status
+        self.assertEqual(asyncio.run(scenario()), 200)
+
+
+class TestAdmissionDeadline(unittest.TestCase):
+
+    def test_stream_outlives_deadline(self):
+        app = AdmissionMiddleware(streaming_app(6, 0.05),
+                                  timeouts={"/stream": 0.1})
+        status, body = asyncio.run(call(app, request("/stream")))
+        self.assertEqual(status, 200)
+        self.assertEqual(b"".join(body), b"x" * 6)
+
+    def test_slow_start_times_out(self):
+        async def slow(scope, receive, send):
+            await asyncio.sleep(1)
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        app = AdmissionMiddleware(slow, default_timeout=0.05)
+        status, _ = asyncio.run(call(app, request()))
+        self.assertEqual(status, 504)
+
+    def test_error_after_deadline_becomes_504(self):
+        async def cancelled_query(scope, receive, send):
+            # A handler stuck in a blocking call until statement_timeout
+            # fired, reporting the failed query as an error
+            time.sleep(0.06)
+            await send({"type": "http.response.start", "status": 500,
+                        "headers": []})
+            await send({"type": "http.response.body", "body": b"{}"})
+
+        app = AdmissionMiddleware(cancelled_query, default_timeout=0.05)
+        status, body = asyncio.run(call(app, request()))
+        self.assertEqual(status, 504)
+        self.assertIn(b"timed out", b"".join(body))
+
+    def test_error_within_deadline_is_kept(self):
+        async def failing(scope, receive, send):
+            await send({"type": "http.response.start", "status": 400,
+                        "headers": []})
+            await send({"type": "http.response.body", "body": b"{}"})
+
+        app = AdmissionMiddleware(failing, default_timeout=5)
+        self.assertEqual(asyncio.run(call(app, request()))[0], 400)
+
+    def test_stream_batch_gets_own_deadline(self):
+        seen = []
+
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": []})
+            await asyncio.sleep(0.1)
+            # As encode_student_stream does before each further batch
+            token = deadlines.start(5)
+            seen.append(deadlines.statement_timeout_ms())
+            deadlines.reset(token)
+            await send({"type": "http.response.body", "body": b""})
+
+        middleware = AdmissionMiddleware(app, default_timeout=0.05)
+        status, _ = asyncio.run(call(middleware, request()))
+        self.assertEqual(status, 200)
+        self.assertGreater(seen[0], 4000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import unittest
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+import statements  # noqa: E402
+
+
+class FakeConnection:
+    def __init__(self, preparing=True):
+        if preparing:
+            self.prepared = OrderedDict()
+
+
+class FakeCursor:
+    """Records the SQL it is given instead of running it."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.sent = []
+
+    def execute(self, query, params=None):
+        self.sent.append(query)
+
+
+class TestNumbered(unittest.TestCase):
+
+    def test_placeholders_are_numbered(self):
+        self.assertEqual(
+            statements._numbered("SELECT * FROM t WHERE a = %s AND b = %s;"),
+            "SELECT * FROM t WHERE a = $1 AND b = $2")
+
+    def test_escaped_percent_is_unescaped(self):
+        self.assertEqual(
+            statements._numbered("SELECT * FROM t WHERE a LIKE 'x%%' "
+                                 "AND b = %s"),
+            "SELECT * FROM t WHERE a LIKE 'x%' AND b = $1")
+
+    def test_escaped_placeholder_stays_literal(self):
+        self.assertEqual(
+            statements._numbered("SELECT '%%s', %s, '100%%'"),
+            "SELECT '%s', $1, '100%'")
+
+
+class TestExecute(unittest.TestCase):
+
+    def test_prepares_once_per_connection(self):
+        cur = FakeCursor(FakeConnection())
+        statements.execute(cur, "SELECT %s;", (1,))
+        statements.execute(cur, "SELECT %s;", (2,))
+        name = statements._statement_name("SELECT %s;")
+        self.assertEqual(cur.sent, [f"PREPARE {name} AS SELECT $1",
+                                    f"EXECUTE {name} (%s);",
+                                    f"EXECUTE {name} (%s);"])
+
+    def test_least_recently_used_is_deallocated(self):
+        cur = FakeCursor(FakeConnection())
+        for query in ("SELECT 1;", "SELECT 2;", "SELECT 1;", "SELECT 3;"):
+            statements.execute(cur, query, cache_size=2)
+        evicted = statements._statement_name("SELECT 2;")
+        self.assertIn(f"DEALLOCATE {evicted};", cur.sent)
+        self.assertEqual(list(cur.connection.prepared),
+                         ["SELECT 1;", "SELECT 3;"])
+        # The evicted statement is prepared again when it comes back
+        cur.sent.clear()
+        statements.execute(cur, "SELECT 2;", cache_size=2)
+        self.assertEqual(cur.sent[0], "DEALLOCATE "
+                         f"{statements._statement_name('SELECT 1;')};")
+        self.assertTrue(cur.sent[1].startswith(f"PREPARE {evicted} AS"))
+
+    def test_plain_sql_without_cache(self):
+        for cur, size in ((FakeCursor(FakeConnection()), 0),
+                          (FakeCursor(FakeConnection(preparing=False)), 64)):
+            statements.execute(cur, "SELECT %s;", (1,), cache_size=size)
+            self.assertEqual(cur.sent, ["SELECT %s;"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+from student_cache import LocalCache, ReadThroughCache, _MISSING  # noqa
+
+
+class FakeLoader:
+    """Loader that blocks until released and counts its calls."""
+
+    def __init__(self, value="row", source="primary"):
+        self.value = value
+        self.source = source
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return self.value, self.source
+
+
+class DictCache:
+    """Shared tier stand-in with RedisCache's interface."""
+
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key, _MISSING)
+
+    async def set(self, key, value):
+        self.values[key] = value
+
+    async def delete(self, key):
+        self.values.pop(key, None)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestReadThroughCache(unittest.TestCase):
+
+    def test_concurrent_misses_load_once(self):
+        async def scenario():
+            cache = ReadThroughCache(LocalCache(10, 30))
+            loader = FakeLoader()
+            tasks = [asyncio.create_task(cache.get_or_load(1, loader))
+                     for _ in range(5)]
+            await asyncio.sleep(0)
+            loader.release.set()
+            results = await asyncio.gather(*tasks)
+            self.assertEqual(results, ["row"] * 5)
+            self.assertEqual(loader.calls, 1)
+            # Now served from the local tier
+            self.assertEqual(await cache.get_or_load(1, loader), "row")
+            self.assertEqual(loader.calls, 1)
+        run(scenario())
+
+    def test_invalidation_during_load_is_not_cached(self):
+        async def scenario():
+            shared = DictCache()
+            cache = ReadThroughCache(LocalCache(10, 30), shared)
+            loader = FakeLoader(value="old")
+            task = asyncio.create_task(cache.get_or_load(1, loader))
+            await asyncio.sleep(0)
+            await cache.invalidate(1)
+            loader.release.set()
+            self.assertEqual(await task, "old")
+            self.assertEqual(shared.values, {})
+            loader.value = "new"
+            self.assertEqual(await cache.get_or_load(1, loader), "new")
+            self.assertEqual(loader.calls, 2)
+        run(scenario())
+
+    def test_cancelled_leader_leaves_waiters_loading(self):
+        async def scenario():
+            cache = ReadThroughCache(LocalCache(10, 30))
+            loader = FakeLoader()
+            leader = asyncio.create_task(cache.get_or_load(1, loader))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(cache.get_or_load(1, loader))
+            await asyncio.sleep(0)
+            leader.cancel()
+            await asyncio.sleep(0)
+            loader.release.set()
+            self.assertEqual(await waiter, "row")
+            self.assertEqual(loader.calls, 2)
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+        run(scenario())
+
+    def test_loader_error_reaches_waiters(self):
+        async def scenario():
+            cache = ReadThroughCache(LocalCache(10, 30))
+            release = asyncio.Event()
+
+            async def failing():
+                await release.wait()
+                raise RuntimeError("database down")
+
+            tasks = [asyncio.create_task(cache.get_or_load(1, failing))
+                     for _ in range(3)]
+            await asyncio.sleep(0)
+            release.set()
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            self.assertTrue(all(isinstance(r, RuntimeError)
+                                for r in results))
+        run(scenario())
+
+    def test_replica_rows_stay_local_and_brief(self):
+        async def scenario():
+            shared = DictCache()
+            cache = ReadThroughCache(LocalCache(10, 30), shared,
+                                     replica_ttl=0.05)
+            loader = FakeLoader(source="replica")
+            loader.release.set()
+            await cache.get_or_load(1, loader)
+            self.assertEqual(shared.values, {})
+            await cache.get_or_load(1, loader)
+            self.assertEqual(loader.calls, 1)
+            await asyncio.sleep(0.06)
+            await cache.get_or_load(1, loader)
+            self.assertEqual(loader.calls, 2)
+        run(scenario())
+
+    def test_uncacheable_result_is_not_stored(self):
+        async def scenario():
+            cache = ReadThroughCache(LocalCache(10, 30))
+            loader = FakeLoader(value={"status": "error"}, source=None)
+            loader.release.set()
+            await cache.get_or_load(1, loader)
+            await cache.get_or_load(1, loader)
+            self.assertEqual(loader.calls, 2)
+        run(scenario())
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LocalCache(2, 30)
+        cache.set(1, "a")
+        cache.set(2, "b")
+        cache.get(1)
+        cache.set(3, "c")
+        self.assertEqual(cache.get(2), _MISSING)
+        self.assertEqual(cache.get(1), "a")
+
+    def test_entry_ttl_is_capped(self):
+        cache = LocalCache(2, 0)
+        cache.set(1, "a", ttl=60)
+        self.assertEqual(cache.get(1), _MISSING)
+
+
+if __name__ == "__main__":
+    unittest.main()